@@ -0,0 +1,89 @@
+"""
+Time to accept a small block against the number of accounts holding coins,
+then against the number of pending transactions
+
+usage: python benchmarks/bench_accept.py [transactions per block]
+"""
+import base64
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import mempool
+import miner
+
+ROUNDS = 20
+
+
+def prepare(chain, search, creator, creator_priv, student, per_block):
+    """
+    :return: <list> (proof, transactions) of ROUNDS blocks following the chain, signatures already checked
+    """
+    blocks = []
+    last_proof = chain.last_block['proof']
+    for r in range(ROUNDS):
+        transactions = []
+        for i in range(per_block):
+            amount = r * per_block + i + 1
+            signature = rsa.sign(f'{creator}{student}{amount}'.encode('UTF-8'), creator_priv, 'SHA-256')
+            transactions.append({'sender': creator, 'recipient': student, 'amount': amount,
+                                 'signature': base64.b64encode(signature).decode('UTF-8')})
+        last_proof = search.search(last_proof)
+        blocks.append((last_proof, transactions))
+    chain.verifier.verify([t for _, transactions in blocks for t in transactions])
+    return blocks
+
+
+def accept(chain, blocks):
+    """
+    :return: <float> Mean seconds accept_block took per block
+    """
+    elapsed = 0
+    for proof, transactions in blocks:
+        last_block = chain.last_block
+        start = time.perf_counter()
+        assert chain.accept_block(proof, last_block['index'] + 1, chain.hash(last_block),
+                                  last_block['timestamp'], transactions, bc.INITIAL_TARGET)
+        elapsed += time.perf_counter() - start
+    return elapsed / ROUNDS
+
+
+def main():
+    per_block = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+        creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+    creator = rsa.PublicKey(creator_priv.n, creator_priv.e).save_pkcs1().decode('UTF-8')
+    student = rsa.newkeys(512)[0].save_pkcs1().decode('UTF-8')
+    search = miner.ProofMiner(workers=1)
+
+    print(f'{"accounts":<12}{"ms per block":>14}')
+    for accounts in (1000, 100000, 1000000):
+        # No retarget during the run, every block has the initial target
+        chain = bc.Blockchain(retarget_interval=ROUNDS + 1)
+        chain.unspent.update((f'account-{i}', 10) for i in range(accounts))
+        # Blocks are prepared up front, only accept_block is timed
+        blocks = prepare(chain, search, creator, creator_priv, student, per_block)
+        print(f'{accounts:<12,}{accept(chain, blocks) * 1000:>14.3f}')
+
+    # Pending transactions the blocks don't touch should not slow them down
+    print(f'{"pending":<12}{"ms per block":>14}')
+    for pending in (0, 10000, 100000):
+        chain = bc.Blockchain(retarget_interval=ROUNDS + 1)
+        chain.mempool = mempool.Mempool(max_size=pending + 1)
+        # Coins minted for other accounts, put in the pool directly as their signatures don't matter here
+        for i in range(pending):
+            t = {'sender': creator, 'recipient': f'account-{i}', 'amount': i + 1, 'signature': ''}
+            chain.mempool.add(t)
+            chain.apply_verified(t, chain.pending_unspent)
+        blocks = prepare(chain, search, creator, creator_priv, student, per_block)
+        print(f'{pending:<12,}{accept(chain, blocks) * 1000:>14.3f}')
+    search.close()
+
+if __name__ == '__main__':
+    main()
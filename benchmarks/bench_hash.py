@@ -0,0 +1,46 @@
+"""
+Cost of Blockchain.hash against the number of transactions in a block
+
+usage: python benchmarks/bench_hash.py [transactions ...]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import blockchain as bc
+
+REPEAT = 200
+
+
+def block_with(count):
+    # Roughly the size of real transactions: two PEM keys and a signature
+    transactions = [{'sender': 'S' * 150, 'recipient': 'R' * 150, 'amount': i, 'signature': 'G' * 88}
+                    for i in range(count)]
+    return {'index': 2, 'timestamp': time.time(), 'transactions': transactions, 'proof': 35293,
+            'previous_hash': '0' * 64}
+
+
+def timed(fn, block):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        fn(block)
+    return (time.perf_counter() - start) / REPEAT * 1e6
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [0, 10, 100, 1000]
+    print(f'{"transactions":>12}{"first hash us":>16}{"cached hash us":>16}')
+    for size in sizes:
+        block = block_with(size)
+        first = timed(bc.Blockchain.hash, block)
+        bc.Blockchain.seal(block)
+        cached = timed(bc.Blockchain.hash, block)
+        print(f'{size:>12}{first:>16.1f}{cached:>16.3f}')
+
+
+if __name__ == '__main__':
+    main()
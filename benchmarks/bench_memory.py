@@ -0,0 +1,78 @@
+"""
+Memory held by the chain against its length, blocks as parsed JSON dicts and as records
+
+Blocks are made up without proofs or valid signatures, neither changes their
+size. They hold a few transactions between a pool of real public keys, like a
+class of students paying each other, and arrive as JSON like from another node.
+
+usage: python benchmarks/bench_memory.py [transactions per block] [students]
+"""
+import base64
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import records
+
+
+def chain_json(length, per_block, keys, rng):
+    blocks = []
+    for index in range(1, length + 1):
+        transactions = [{'sender': rng.choice(keys), 'recipient': rng.choice(keys), 'amount': rng.randint(1, 100),
+                         'signature': base64.b64encode(rng.getrandbits(512).to_bytes(64, 'big')).decode('UTF-8')}
+                        for _ in range(per_block)]
+        transactions.append({'sender': "0", 'recipient': rng.choice(keys), 'amount': 1,
+                             'signature': base64.b64encode(rng.getrandbits(512).to_bytes(64, 'big')).decode('UTF-8')})
+        blocks.append({'index': index, 'timestamp': 1700000000.0 + index * 10, 'transactions': transactions,
+                       'proof': rng.getrandbits(20), 'previous_hash': f'{rng.getrandbits(256):064x}',
+                       'target': '0001' + '0' * 60, 'merkle_root': f'{rng.getrandbits(256):064x}',
+                       'hash': f'{rng.getrandbits(256):064x}'})
+    return json.dumps(blocks)
+
+
+def held(load):
+    """
+    :return: <int> Bytes still allocated by load once it returned, while its result is alive
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def as_records(text):
+    # A fresh key table, so the keys are counted too
+    records.KEYS = records.KeyTable()
+    return [records.Block.compact(block) for block in json.loads(text)]
+
+
+def main():
+    per_block = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    students = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    rng = random.Random(1)
+    keys = [rsa.newkeys(512)[0].save_pkcs1().decode('UTF-8') for _ in range(students)]
+
+    print(f'{"blocks":<10}{"dicts MB":>10}{"records MB":>12}{"saved":>8}{"B/tx dicts":>12}{"B/tx records":>14}')
+    for length in (1000, 10000, 50000):
+        text = chain_json(length, per_block, keys, rng)
+        dicts = held(lambda: json.loads(text))
+        compact = held(lambda: as_records(text))
+        transactions = length * (per_block + 1)
+        print(f'{length:<10,}{dicts / 1e6:>10.1f}{compact / 1e6:>12.1f}{1 - compact / dicts:>8.0%}'
+              f'{dicts / transactions:>12.0f}{compact / transactions:>14.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Mempool acceptance throughput at 10k and 100k pending transactions
+
+Signature checks are left out, this measures the pool itself: duplicate
+detection, insertion and removal of the transactions of a block.
+
+usage: python benchmarks/bench_mempool.py [pending ...]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import mempool
+
+BLOCK_SIZE = 500
+# The old list scan is quadratic, it is only run up to this many transactions
+LIST_LIMIT = 10000
+
+
+def synthetic(count):
+    senders = [f'sender-{i}' for i in range(1000)]
+    return [{'sender': senders[i % len(senders)], 'recipient': f'recipient-{i}',
+             'amount': i, 'signature': f'signature-{i}'} for i in range(count)]
+
+
+def list_pool(transactions):
+    # How Blockchain.current_transactions worked before: a scan per transaction
+    pool = []
+    start = time.perf_counter()
+    for t in transactions:
+        if all(p['sender'] != t['sender'] or p['recipient'] != t['recipient'] or p['amount'] != t['amount']
+               for p in pool):
+            pool.append(t)
+    accept = time.perf_counter() - start
+
+    block = transactions[:BLOCK_SIZE]
+    start = time.perf_counter()
+    pool = [p for p in pool
+            if not any(p['sender'] == s['sender'] and p['recipient'] == s['recipient'] and p['amount'] == s['amount']
+                       for s in block)]
+    return accept, time.perf_counter() - start
+
+
+def indexed_pool(transactions):
+    pool = mempool.Mempool(max_size=len(transactions))
+    start = time.perf_counter()
+    for t in transactions:
+        pool.add(t)
+    accept = time.perf_counter() - start
+    assert len(pool) == len(transactions)
+
+    start = time.perf_counter()
+    pool.remove_included(transactions[:BLOCK_SIZE])
+    return accept, time.perf_counter() - start
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000]
+    print(f'{"pending":>8}  {"pool":<8}{"accepted tx/s":>15}{"block removal ms":>18}')
+    for size in sizes:
+        transactions = synthetic(size)
+        for name, fn in (('list', list_pool), ('indexed', indexed_pool)):
+            if name == 'list' and size > LIST_LIMIT:
+                print(f'{size:>8}  {name:<8}{"skipped":>15}{"":>18}')
+                continue
+            accept, removal = fn(transactions)
+            print(f'{size:>8}  {name:<8}{size / accept:>15,.0f}{removal * 1000:>18.2f}')
+
+
+if __name__ == '__main__':
+    main()
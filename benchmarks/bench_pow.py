@@ -0,0 +1,61 @@
+"""
+Proof of work throughput: hashes per second per core
+
+usage: python benchmarks/bench_pow.py [nonces]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import blockchain as bc
+import miner
+
+
+def naive(last_proof, nonces):
+    # The original loop: one valid_proof call per guess
+    for proof in range(nonces):
+        bc.Blockchain.valid_proof(last_proof, proof)
+
+
+def tight(last_proof, nonces):
+    # Impossible target so the whole range is searched
+    miner.search_range(last_proof, 0, nonces, bytes(32))
+
+
+def main():
+    nonces = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    last_proof = 35293
+
+    print(f'{"loop":<24}{"hashes/s":>14}')
+    for name, fn in (('valid_proof loop', naive), ('search_range', tight)):
+        start = time.perf_counter()
+        fn(last_proof, nonces)
+        rate = nonces / (time.perf_counter() - start)
+        print(f'{name:<24}{rate:>14,.0f}')
+
+    cores = os.cpu_count() or 1
+    print(f'\n{"workers":<10}{"proofs":>8}{"hashes/s":>14}{"per core":>14}')
+    for workers in sorted({1, 2, cores}):
+        m = miner.ProofMiner(workers=workers)
+        hashes = 0
+        proofs = 0
+        start = time.perf_counter()
+        # Chain a few proofs together like consecutive blocks would
+        previous = last_proof
+        while time.perf_counter() - start < 3:
+            proof = m.search(previous)
+            assert bc.Blockchain.valid_proof(previous, proof)
+            previous = proof
+            hashes += m.hashes
+            proofs += 1
+        rate = hashes / (time.perf_counter() - start)
+        m.close()
+        print(f'{workers:<10}{proofs:>8}{rate:>14,.0f}{rate / workers:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
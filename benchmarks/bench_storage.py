@@ -0,0 +1,92 @@
+"""
+Node startup time from the block store against chain length
+
+usage: python benchmarks/bench_storage.py [length ...]
+"""
+import base64
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import signatures
+import storage
+
+TRANSACTIONS_PER_BLOCK = 4
+
+
+def signed(sender, recipient, amount, priv):
+    message = f'{sender}{recipient}{amount}'
+    signature = rsa.sign(message.encode('UTF-8'), priv, 'SHA-256')
+    return {'sender': sender, 'recipient': recipient, 'amount': amount,
+            'signature': base64.b64encode(signature).decode('UTF-8')}
+
+
+def synthetic_blocks(length, transactions):
+    # Proofs are not checked when loading, so the blocks skip proof of work
+    previous_hash = 1
+    for index in range(1, length + 1):
+        block = {
+            'index': index,
+            'timestamp': time.time(),
+            'transactions': transactions if index > 1 else [],
+            'proof': 100,
+            'previous_hash': previous_hash,
+        }
+        previous_hash = bc.Blockchain.hash(block)
+        yield block
+
+
+def main():
+    lengths = [int(n) for n in sys.argv[1:]] or [1000, 10000, 50000]
+
+    with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+        creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+    creator = rsa.PublicKey(creator_priv.n, creator_priv.e).save_pkcs1().decode('UTF-8')
+    students = [rsa.newkeys(512)[0].save_pkcs1().decode('UTF-8') for _ in range(TRANSACTIONS_PER_BLOCK)]
+    transactions = [signed(creator, student, 5, creator_priv) for student in students]
+
+    # What a re-sync spends at the very least: checking every signature again
+    chain = bc.Blockchain()
+    start = time.perf_counter()
+    for t in transactions * 25:
+        # A node syncing from scratch has nothing cached
+        signatures.load_public_key.cache_clear()
+        signatures.verified = signatures.SignatureCache()
+        chain.valid_transaction(t['sender'], t['recipient'], t['amount'], t['signature'], unspent={})
+    verify = (time.perf_counter() - start) / 100
+
+    print(f'{"blocks":>8}{"store MB":>10}{"full load s":>13}{"snapshot load s":>17}{"re-verify s":>13}')
+    for length in lengths:
+        with tempfile.TemporaryDirectory() as path:
+            store = storage.BlockStore(path, snapshot_interval=length + 1)
+            for block in synthetic_blocks(length, transactions):
+                store.append(block)
+            store.close()
+            size = os.path.getsize(os.path.join(path, 'blocks.log')) / 2 ** 20
+
+            # No snapshot yet: every block's balances are replayed
+            start = time.perf_counter()
+            loaded = bc.Blockchain(store=storage.BlockStore(path))
+            full = time.perf_counter() - start
+            loaded.store.save_snapshot(length, loaded.unspent)
+            loaded.store.close()
+
+            start = time.perf_counter()
+            loaded = bc.Blockchain(store=storage.BlockStore(path))
+            snap = time.perf_counter() - start
+            assert len(loaded.chain) == length
+            loaded.store.close()
+
+        resync = verify * (length - 1) * TRANSACTIONS_PER_BLOCK
+        print(f'{length:>8}{size:>10.1f}{full:>13.3f}{snap:>17.3f}{resync:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
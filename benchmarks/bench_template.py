@@ -0,0 +1,43 @@
+"""
+Block assembly time and block size against the number of pending transactions
+
+usage: python benchmarks/bench_template.py [policy]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import blockchain as bc
+
+
+def main():
+    policy = sys.argv[1] if len(sys.argv) > 1 else 'oldest'
+    with open(os.path.join(ROOT, 'Creator_Keys', 'pub_key')) as f:
+        creator = f.read()
+
+    print(f'{"pending":<10}{"in block":>10}{"kB":>8}{"template ms":>13}{"new_block ms":>14}')
+    for backlog in (1000, 10000, 100000):
+        chain = bc.Blockchain()
+        chain.assembler.policy = policy
+        chain.mempool.max_size = backlog
+        # Only balances are checked while assembling, the signatures were checked on arrival
+        for i in range(backlog):
+            chain.mempool.add({'sender': creator, 'recipient': f'student-{i % 500}', 'amount': i + 1,
+                               'signature': f'{i:088d}'})
+
+        start = time.perf_counter()
+        template = chain.block_template()
+        assembled = time.perf_counter() - start
+        start = time.perf_counter()
+        block = chain.new_block(0, template=template)
+        added = time.perf_counter() - start
+        print(f'{backlog:<10,}{len(block["transactions"]):>10,}{template.size / 1000:>8.0f}'
+              f'{assembled * 1000:>13.1f}{added * 1000:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Full-chain validation time against the number of cores verifying signatures
+
+usage: python benchmarks/bench_validation.py [blocks] [transactions per block]
+"""
+import base64
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import miner
+import signatures
+
+
+def build_chain(blocks, per_block):
+    with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+        creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+    creator = rsa.PublicKey(creator_priv.n, creator_priv.e).save_pkcs1().decode('UTF-8')
+    students = [rsa.newkeys(512)[0].save_pkcs1().decode('UTF-8') for _ in range(8)]
+
+    chain = bc.Blockchain()
+    chain.miner = miner.ProofMiner(workers=1)
+    amount = 1
+    for _ in range(blocks):
+        for i in range(per_block):
+            recipient = students[i % len(students)]
+            message = f'{creator}{recipient}{amount}'
+            signature = rsa.sign(message.encode('UTF-8'), creator_priv, 'SHA-256')
+            chain.new_transaction(creator, recipient, amount, base64.b64encode(signature).decode('UTF-8'))
+            amount += 1
+        last_block = chain.last_block
+        chain.new_block(chain.proof_of_work(last_block['proof']), chain.hash(last_block))
+    return chain.chain
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    print(f'building {blocks} blocks of {per_block} signed transactions...')
+    chain = build_chain(blocks, per_block)
+
+    cores = os.cpu_count() or 1
+    print(f'{"workers":<10}{"seconds":>10}{"tx/s":>12}')
+    for workers in sorted({1, 2, 4, cores}):
+        if workers > cores:
+            continue
+        validator = bc.Blockchain()
+        validator.verifier = signatures.BatchVerifier(workers)
+        # Every run starts cold, like a node syncing for the first time
+        signatures.load_public_key.cache_clear()
+        signatures.verified = signatures.SignatureCache()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert validator.valid_chain(chain, {})
+        elapsed = time.perf_counter() - start
+        validator.verifier.close()
+        print(f'{workers:<10}{elapsed:>10.2f}{blocks * per_block / elapsed:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
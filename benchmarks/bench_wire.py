@@ -0,0 +1,76 @@
+"""
+Size and encode/decode time of the compact wire format against JSON on a realistic chain
+
+usage: python benchmarks/bench_wire.py [blocks] [transactions per block] [students]
+"""
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import wire
+
+REPEAT = 5
+
+
+def realistic_chain(blocks, per_block, students):
+    # Transfers between a fixed set of students, like a class trading coins
+    keys = [rsa.newkeys(512) for _ in range(students)]
+    pems = [pub.save_pkcs1().decode('UTF-8') for pub, _ in keys]
+    random.seed(1)
+    chain = [{'index': 1, 'timestamp': time.time(), 'transactions': [], 'proof': 100, 'previous_hash': 1}]
+    bc.Blockchain.seal(chain[0])
+    for index in range(2, blocks + 2):
+        transactions = []
+        for _ in range(per_block):
+            s, r = random.sample(range(students), 2)
+            amount = random.randint(1, 100)
+            signature = rsa.sign(f'{pems[s]}{pems[r]}{amount}'.encode('UTF-8'), keys[s][1], 'SHA-256')
+            transactions.append({'sender': pems[s], 'recipient': pems[r], 'amount': amount,
+                                 'signature': base64.b64encode(signature).decode('UTF-8')})
+        block = {'index': index, 'timestamp': time.time(), 'transactions': transactions,
+                 'proof': random.randint(0, 200000), 'previous_hash': chain[-1]['hash']}
+        bc.Blockchain.seal(block)
+        chain.append(block)
+    return chain
+
+
+def timed(fn, arg):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = fn(arg)
+    return result, (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_block = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    students = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    print(f'signing {blocks * per_block} transactions between {students} students...')
+    chain = realistic_chain(blocks, per_block, students)
+    # What /chain hands out
+    document = {'transactions': [], 'chain': chain, 'length': len(chain)}
+
+    encoded_json, json_encode = timed(lambda d: json.dumps(d).encode(), document)
+    _, json_decode = timed(json.loads, encoded_json)
+    wire.encode(document)  # warm the key caches, like a node that has seen these students before
+    encoded_wire, wire_encode = timed(wire.encode, document)
+    decoded, wire_decode = timed(wire.decode, encoded_wire)
+    assert decoded == document
+
+    print(f'{"format":<8}{"bytes":>12}{"encode ms":>12}{"decode ms":>12}')
+    print(f'{"json":<8}{len(encoded_json):>12,}{json_encode:>12.1f}{json_decode:>12.1f}')
+    print(f'{"wire":<8}{len(encoded_wire):>12,}{wire_encode:>12.1f}{wire_decode:>12.1f}')
+    print(f'wire is {len(encoded_wire) / len(encoded_json):.0%} of the json size')
+
+
+if __name__ == '__main__':
+    main()
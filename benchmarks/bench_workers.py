@@ -0,0 +1,98 @@
+"""
+Read throughput of a node against its number of reader processes
+
+Every run starts src/main.py on a data directory holding a chain of easy
+blocks, with no readers and then with 1, 2, 4... of them (--workers), and
+sends requests from client processes for a few seconds. Readers only scale
+as far as the cores of the machine go, the clients share them too.
+
+usage: python benchmarks/bench_workers.py [max workers] [client processes] [seconds per run]
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from run import Keys, ROOT, extend, node
+
+import storage
+
+BLOCKS = 500
+PORT = 5480
+
+# Read endpoints of a wallet or the website, each client goes round them
+READS = (
+    ('GET', '/chain/tip', None),
+    ('GET', '/chain/blocks?after=400&limit=10', None),
+    ('GET', '/identifier', None),
+)
+
+
+def build(path, keys):
+    chain = node()
+    chain.attach_store(storage.BlockStore(path))
+    for block in extend(list(chain.chain), BLOCKS, keys)[1:]:
+        assert chain.accept_block(block['proof'], block['index'], block['previous_hash'], block['timestamp'],
+                                  block['transactions'], block['target'])
+    chain.store.close()
+
+
+def client(args):
+    url, reads, seconds = args
+    session = requests.Session()
+    done = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        method, path, document = reads[done % len(reads)]
+        session.request(method, url + path, json=document).raise_for_status()
+        done += 1
+    return done
+
+
+def measure(path, workers, clients, seconds, reads):
+    args = [sys.executable, os.path.join(ROOT, 'src', 'main.py'), '127.0.0.1', str(PORT), path]
+    if workers:
+        args += ['--workers', str(workers)]
+    process = subprocess.Popen(args, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                requests.get(f'http://127.0.0.1:{PORT}/chain/tip', timeout=1).raise_for_status()
+                break
+            except requests.exceptions.RequestException:
+                time.sleep(0.05)
+        with multiprocessing.Pool(clients) as pool:
+            done = sum(pool.map(client, [(f'http://127.0.0.1:{PORT}', reads, seconds)] * clients))
+        return done / seconds
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    print('generating keys...')
+    keys = Keys()
+    reads = READS + (('POST', '/balance', {'keys': keys.students}),)
+    path = tempfile.mkdtemp(prefix='educoin-workers-')
+    try:
+        build(path, keys)
+        print(f'{os.cpu_count()} cpus, {clients} client processes')
+        print(f'{"workers":<10}{"requests/s":>12}')
+        counts = [0] + [2 ** i for i in range(max_workers.bit_length()) if 2 ** i <= max_workers]
+        for workers in counts:
+            print(f'{workers or "none":<10}{measure(path, workers, clients, seconds, reads):>12,.0f}')
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""
+Starts a cluster of nodes on localhost and measures how it spreads work
+
+Every node is a src/main.py process on its own port, wired to the others
+through /register. The harness then measures, in order:
+- how long resolve_conflicts takes to bring every node onto one chain;
+- signed transactions sent to random nodes: how many are accepted per
+  second, and how long a transaction takes to reach every node;
+- blocks mined on random nodes: how long a block takes to reach every node.
+
+Results are printed and can be written as JSON, in the format of
+benchmarks/run.py, so runs are compared with benchmarks/compare.py.
+
+usage: python benchmarks/cluster.py [--nodes 4] [--peers k] [--transactions 2000] [--blocks 5]
+                                    [--clients 8] [--base-port 5300] [--output results.json]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from run import Keys, Results, ROOT, commit
+
+import gossip
+import mempool
+
+# Seconds between two looks at the nodes while waiting for something to spread
+POLL_INTERVAL = 0.01
+# Seconds between two looks for sampled transactions, which load the nodes more
+PROBE_INTERVAL = 0.05
+# Seconds to wait for a node to start, and for anything to reach every node
+START_TIMEOUT = 20
+SPREAD_TIMEOUT = 60
+# One in SAMPLE_EVERY transactions is followed until every node has it
+SAMPLE_EVERY = 10
+
+
+class Cluster(object):
+    def __init__(self, count, base_port, log_dir):
+        """
+        :param count: <int> Number of nodes
+        :param base_port: <int> Port of the first node, the others follow it
+        :param log_dir: <str> Directory the output of every node goes to
+        """
+        self.urls = [f'http://127.0.0.1:{base_port + i}' for i in range(count)]
+        self.session = requests.Session()
+        self.processes = []
+        for i, url in enumerate(self.urls):
+            log = open(os.path.join(log_dir, f'node-{i}.log'), 'w')
+            self.processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, 'src', 'main.py'), '127.0.0.1', str(base_port + i)],
+                cwd=ROOT, stdout=log, stderr=subprocess.STDOUT))
+
+    def __enter__(self):
+        deadline = time.monotonic() + START_TIMEOUT
+        for url in self.urls:
+            while True:
+                try:
+                    self.session.get(f'{url}/chain/tip', timeout=1)
+                    break
+                except requests.exceptions.RequestException:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f'{url} did not start, see its log')
+                    time.sleep(0.1)
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+    def wire(self, peers, rng):
+        """
+        Registers every node with up to peers random nodes started before it, both ways
+
+        :param peers: <int> Peers each node registers with, None for all of them
+        :param rng: <Random>
+        """
+        for i, url in enumerate(self.urls[1:], 1):
+            others = self.urls[:i] if peers is None else rng.sample(self.urls[:i], min(peers, i))
+            self.session.post(f'{url}/register', json={'nodes': others}).raise_for_status()
+
+    def tip(self, url):
+        return self.session.get(f'{url}/chain/tip').json()
+
+    def mine(self, url):
+        """
+        :return: <dict> Result of the mining job, once it is done
+        """
+        job = self.session.get(f'{url}/mine').json()['job']
+        while True:
+            status = self.session.get(f'{url}/mine/{job}').json()
+            if status['status'] != 'running':
+                if status['status'] != 'done':
+                    raise RuntimeError(f'Mining on {url} {status["status"]}: {status["error"]}')
+                return status['result']
+            time.sleep(POLL_INTERVAL)
+
+
+def wait_for(check, timeout=SPREAD_TIMEOUT):
+    """
+    :param check: Called until it returns True
+    :return: <float> Seconds it took
+    """
+    start = time.monotonic()
+    while not check():
+        if time.monotonic() - start > timeout:
+            raise RuntimeError('Timed out waiting for the cluster')
+        time.sleep(POLL_INTERVAL)
+    return time.monotonic() - start
+
+
+def converge(cluster, keys, results, blocks):
+    # The nodes start on chains of their own, the first one mines a few blocks and the others resolve
+    first = cluster.urls[0]
+    # Enough coins for the node to be willing to mine
+    funds = keys.signed(keys.creator, keys.students[0], 10 ** 6, keys.creator_priv)
+    cluster.session.post(f'{first}/transactions/new', json=funds).raise_for_status()
+    for _ in range(blocks):
+        cluster.mine(first)
+    tip = cluster.tip(first)
+
+    def resolve(url):
+        start = time.monotonic()
+        requests.get(f'{url}/nodes/resolve').raise_for_status()
+        return time.monotonic() - start
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(len(cluster.urls)) as executor:
+        durations = list(executor.map(resolve, cluster.urls[1:]))
+    wait_for(lambda: all(cluster.tip(url) == tip for url in cluster.urls))
+    results.add('resolve.converged_s', time.monotonic() - start, 's', 'lower')
+    results.latencies('resolve.call', durations)
+
+
+def transaction_load(cluster, keys, results, count, clients, rng):
+    transactions = [keys.transfer() for _ in range(count)]
+    sampled = {}
+    sent = {}
+    answered = {}
+    # A session per client thread, so connections are reused
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        url = rng.choice(cluster.urls)
+        sent[i] = time.monotonic()
+        accepted = local.session.post(f'{url}/transactions/new', json=transactions[i]).status_code == 201
+        answered[i] = time.monotonic()
+        return accepted
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(clients) as executor:
+        futures = [executor.submit(send, i) for i in range(count)]
+        # Follow a sample until every node has it, while the load goes on
+        waiting = {i: set(cluster.urls) for i in range(0, count, SAMPLE_EVERY)}
+        ids = {i: gossip.short_id(mempool.transaction_id(transactions[i])) for i in waiting}
+        deadline = time.monotonic() + SPREAD_TIMEOUT
+        while waiting and time.monotonic() < deadline:
+            for url in cluster.urls:
+                wanted = [ids[i] for i, missing in waiting.items() if url in missing and i in sent]
+                if not wanted:
+                    continue
+                found = cluster.session.post(f'{url}/nodes/inventory/get',
+                                             json={'transactions': wanted}).json()['transactions']
+                now = time.monotonic()
+                for i in [i for i in waiting if ids[i] in found]:
+                    waiting[i].discard(url)
+                    if not waiting[i]:
+                        sampled[i] = now - sent[i]
+                        del waiting[i]
+            time.sleep(PROBE_INTERVAL)
+        accepted = sum(f.result() for f in futures)
+
+    results.add('transactions.accepted_per_s', accepted / (max(answered.values()) - start), '1/s', 'higher')
+    results.add('transactions.rejected', count - accepted, '', 'lower')
+    if sampled:
+        results.latencies('transactions.propagation', list(sampled.values()))
+    results.add('transactions.unpropagated_samples', len(waiting), '', 'lower')
+
+
+def block_propagation(cluster, results, blocks, rng):
+    samples = []
+    for _ in range(blocks):
+        url = rng.choice(cluster.urls)
+        block = cluster.mine(url)
+        mined = time.monotonic()
+        for other in cluster.urls:
+            if other != url:
+                wait_for(lambda: cluster.tip(other)['index'] >= block['index'])
+                samples.append(time.monotonic() - mined)
+    results.latencies('blocks.propagation', samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures a cluster of nodes on localhost')
+    parser.add_argument('--nodes', type=int, default=4)
+    parser.add_argument('--peers', type=int, help='peers each node registers with, defaults to all')
+    parser.add_argument('--transactions', type=int, default=2000)
+    parser.add_argument('--blocks', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=8, help='threads sending transactions')
+    parser.add_argument('--base-port', type=int, default=5300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    print('generating keys...')
+    keys = Keys()
+    results = Results()
+    log_dir = tempfile.mkdtemp(prefix='educoin-cluster-')
+    print(f'starting {args.nodes} nodes, logs in {log_dir}')
+    with Cluster(args.nodes, args.base_port, log_dir) as cluster:
+        cluster.wire(args.peers, rng)
+        print('resolve_conflicts')
+        converge(cluster, keys, results, args.blocks)
+        print('transactions')
+        transaction_load(cluster, keys, results, args.transactions, args.clients, rng)
+        print('blocks')
+        block_propagation(cluster, results, args.blocks, rng)
+
+    report = {
+        'commit': commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'nodes': args.nodes,
+        'peers': args.peers,
+        'transactions': args.transactions,
+        'results': results.values,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares two result files of benchmarks/run.py
+
+A result is reported as a regression when it got worse by more than the
+threshold, in its own direction: lower latencies, higher rates. Exits with
+status 1 if any result regressed, so it can gate a change.
+
+usage: python benchmarks/compare.py <before.json> <after.json> [--threshold percent]
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def change(before, after, better):
+    """
+    :param before: <dict> A result of the first file
+    :param after: <dict> The same result of the second file
+    :param better: <str> 'higher' or 'lower'
+    :return: <float> Improvement in percent, negative if it got worse
+    """
+    if before['value'] == 0:
+        return 0.0
+    delta = (after['value'] - before['value']) / before['value'] * 100
+    return delta if better == 'higher' else -delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares two benchmark result files')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10,
+                        help='percent a result may get worse before it counts as a regression')
+    args = parser.parse_args()
+    before, after = load(args.before), load(args.after)
+
+    print(f'before: {before.get("commit")} ({before.get("workload")}, {before.get("cpus")} cpus)')
+    print(f'after:  {after.get("commit")} ({after.get("workload")}, {after.get("cpus")} cpus)\n')
+    print(f'{"result":<48}{"before":>14}{"after":>14}{"change":>10}')
+    regressions = []
+    for name, old in before['results'].items():
+        new = after['results'].get(name)
+        if new is None:
+            print(f'{name:<48}{old["value"]:>14,.3f}{"missing":>14}')
+            continue
+        percent = change(old, new, old['better'])
+        flag = ''
+        if percent < -args.threshold:
+            flag = '  worse'
+            regressions.append(name)
+        elif percent > args.threshold:
+            flag = '  better'
+        print(f'{name:<48}{old["value"]:>14,.3f}{new["value"]:>14,.3f}{percent:>+9.1f}%{flag}')
+    for name in after['results'].keys() - before['results'].keys():
+        print(f'{name:<48}{"new":>14}{after["results"][name]["value"]:>14,.3f}')
+
+    if regressions:
+        print(f'\n{len(regressions)} result(s) more than {args.threshold:g}% worse')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Replays cases that once left the balances of a node wrong
+
+Each case builds a small chain on its own and checks the balances it ends
+with, pending transactions included.
+
+usage: python benchmarks/regressions.py
+"""
+import base64
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import mempool
+import miner
+
+
+class Wallets(object):
+    def __init__(self, names):
+        """
+        The creator key of the repository and a fresh key for each name
+
+        :param names: <str> One letter per wallet, Eg. 'ABC'
+        """
+        with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+            creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+        self.keys = {'creator': creator_priv}
+        for name in names:
+            self.keys[name] = rsa.newkeys(512)[1]
+
+    def public(self, name):
+        priv = self.keys[name]
+        return rsa.PublicKey(priv.n, priv.e).save_pkcs1().decode('UTF-8')
+
+    def transfer(self, sender, recipient, amount):
+        message = f'{self.public(sender)}{self.public(recipient)}{amount}'.encode('UTF-8')
+        signature = base64.b64encode(rsa.sign(message, self.keys[sender], 'SHA-256')).decode('UTF-8')
+        return {'sender': self.public(sender), 'recipient': self.public(recipient), 'amount': amount,
+                'signature': signature}
+
+
+def node():
+    chain = bc.Blockchain(initial_target=miner.target_for(1).hex())
+    chain.miner = miner.ProofMiner(workers=1)
+    return chain
+
+
+def mine(chain, template=None):
+    target = template.target if template is not None else None
+    return chain.new_block(chain.proof_of_work(chain.last_block['proof'], target), template=template)
+
+
+def evicted_before_mined(wallets):
+    """
+    A transaction of a block template is evicted from the mempool before the block is mined
+    """
+    chain = node()
+    A = wallets.public('A')
+    assert chain.new_transactions([wallets.transfer('creator', 'A', 20)]) == ['accepted']
+    mine(chain)
+    chain.mempool = mempool.Mempool(max_size=2)
+
+    assert chain.new_transactions([wallets.transfer('A', 'B', 10)]) == ['accepted']
+    template = chain.block_template()
+    assert chain.new_transactions([wallets.transfer('A', 'C', 5)]) == ['accepted']
+    # The pool is full, the oldest transaction goes: the one in the template
+    assert chain.new_transactions([wallets.transfer('creator', 'E', 1)]) == ['accepted']
+    mine(chain, template)
+
+    errors = []
+    if chain.unspent[A] != 10:
+        errors.append(f'A has {chain.unspent[A]} after the block, expected 10')
+    if chain.pending_unspent[A] != 5:
+        errors.append(f'A has {chain.pending_unspent[A]} once pending transactions go through, expected 5')
+    if chain.new_transactions([wallets.transfer('A', 'D', 8)]) != ['invalid']:
+        errors.append('A could spend 8 of the 5 left')
+    chain.miner.close()
+    return errors
+
+
+def peer_block_spends_pending(wallets):
+    """
+    A block from another node spends coins a pending transaction of the same sender counted on
+    """
+    chain = node()
+    A = wallets.public('A')
+    assert chain.new_transactions([wallets.transfer('creator', 'A', 20)]) == ['accepted']
+    mine(chain)
+    assert chain.new_transactions([wallets.transfer('A', 'C', 15), wallets.transfer('creator', 'D', 3)]) == ['accepted'] * 2
+
+    last_block = chain.last_block
+    target = chain.next_target(last_block)
+    proof = chain.proof_of_work(last_block['proof'], target)
+    assert chain.accept_block(proof, last_block['index'] + 1, chain.hash(last_block), last_block['timestamp'],
+                              [wallets.transfer('A', 'B', 10)], target)
+
+    errors = []
+    if chain.pending_unspent[A] != 10:
+        errors.append(f'A has {chain.pending_unspent[A]} once pending transactions go through, expected 10')
+    if len(chain.mempool) != 1:
+        errors.append(f'{len(chain.mempool)} transactions pending, expected 1: A can no longer pay C')
+    chain.miner.close()
+    return errors
+
+
+CASES = (evicted_before_mined, peer_block_spends_pending)
+
+
+def main():
+    wallets = Wallets('ABCDE')
+    failed = 0
+    for case in CASES:
+        errors = case(wallets)
+        print(f'{case.__name__:<32}{"FAIL" if errors else "OK"}')
+        for error in errors:
+            print('  ', error)
+        failed += bool(errors)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
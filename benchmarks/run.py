@@ -0,0 +1,362 @@
+"""
+Benchmark suite of the node's hot paths, with machine readable results
+
+Runs offline: keys, signed transactions and chains are all made locally.
+Chains built for the suite use the easiest proof of work target so a
+100k block chain is cheap to build; proof_of_work itself is measured at
+the default target, on one core so every run tries the same nonces.
+
+Every result is a name with a value, a unit and whether higher or lower is
+better. Results of two commits are compared with benchmarks/compare.py.
+
+usage: python benchmarks/run.py [--quick] [--only case,...] [--output results.json]
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import miner
+import signatures
+
+# Easiest target, one leading zero bit: a proof takes two guesses on average
+EASY_TARGET = miner.target_for(1).hex()
+# A signed transfer in every TRANSFER_EVERY blocks, every block has a mining reward
+TRANSFER_EVERY = 10
+MINERS = 8
+STUDENTS = 32
+
+# Workload of each case, the quick one is for a first look
+SIZES = {
+    'full': {'solves': 20, 'transactions': 2000, 'accounts': 100000, 'accept_blocks': 50,
+             'chains': (1000, 10000, 100000), 'hashes': 20000, 'requests': 500, 'served_blocks': 1000,
+             'starts': 10},
+    'quick': {'solves': 5, 'transactions': 300, 'accounts': 10000, 'accept_blocks': 10,
+              'chains': (1000,), 'hashes': 2000, 'requests': 50, 'served_blocks': 100,
+              'starts': 3},
+}
+
+
+class Results(object):
+    def __init__(self):
+        self.values = {}
+
+    def add(self, name, value, unit, better):
+        """
+        :param name: <str> Eg. 'valid_chain.1000.seconds'
+        :param value: <float> The measurement
+        :param unit: <str> Eg. 's', 'ms', '1/s'
+        :param better: <str> 'higher' or 'lower'
+        """
+        self.values[name] = {'value': value, 'unit': unit, 'better': better}
+        print(f'  {name:<48}{value:>16,.3f} {unit}')
+
+    def latencies(self, name, samples):
+        """
+        Records the mean, median and 95th percentile of durations
+
+        :param name: <str> Prefix of the results
+        :param samples: <list> Durations in seconds
+        """
+        ordered = sorted(samples)
+        self.add(f'{name}.mean_ms', statistics.mean(ordered) * 1000, 'ms', 'lower')
+        self.add(f'{name}.p50_ms', ordered[len(ordered) // 2] * 1000, 'ms', 'lower')
+        self.add(f'{name}.p95_ms', ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 'ms', 'lower')
+
+
+class Keys(object):
+    def __init__(self):
+        """
+        The creator key of the repository, which mints coins, and fresh miner and student keys
+        """
+        with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+            self.creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+        self.creator = self.public(self.creator_priv)
+        self.miners = [rsa.newkeys(512)[1] for _ in range(MINERS)]
+        self.students = [self.public(rsa.newkeys(512)[1]) for _ in range(STUDENTS)]
+        self.transfers = 0
+
+    @staticmethod
+    def public(priv):
+        return rsa.PublicKey(priv.n, priv.e).save_pkcs1().decode('UTF-8')
+
+    @staticmethod
+    def signed(sender, recipient, amount, priv):
+        message = f'{sender}{recipient}{amount}'.encode('UTF-8')
+        signature = base64.b64encode(rsa.sign(message, priv, 'SHA-256')).decode('UTF-8')
+        return {'sender': sender, 'recipient': recipient, 'amount': amount, 'signature': signature}
+
+    def transfer(self):
+        """
+        :return: <dict> A coin minted by the creator for a student, never the same one twice
+        """
+        self.transfers += 1
+        recipient = self.students[self.transfers % len(self.students)]
+        return self.signed(self.creator, recipient, self.transfers, self.creator_priv)
+
+    def rewards(self):
+        """
+        :return: <list> The mining reward of each miner, the same in every block it mines
+        """
+        return [self.signed("0", self.public(priv), 1, priv) for priv in self.miners]
+
+
+def node():
+    """
+    :return: <Blockchain> A node whose chain accepts the blocks built by extend,
+             which are dated further ahead than a node would accept
+    """
+    return bc.Blockchain(initial_target=EASY_TARGET, max_future_drift=None)
+
+
+def extend(chain, count, keys, transfers_every=TRANSFER_EVERY, per_block=1):
+    """
+    Builds valid blocks after the last one of a chain, BLOCK_INTERVAL seconds apart
+
+    :param chain: <list> Blocks of a node made by node(), the new ones are appended
+    :param count: <int> Number of blocks
+    :param keys: <Keys>
+    :param transfers_every: <int> Blocks between those with signed transfers
+    :param per_block: <int> Signed transfers in those blocks
+    :return: <list> The chain
+    """
+    rules = node()
+    rewards = keys.rewards()
+    ancestor = lambda index: chain[index - 1]
+    for _ in range(count):
+        last_block = chain[-1]
+        index = last_block['index'] + 1
+        transactions = [keys.transfer() for _ in range(per_block if index % transfers_every == 0 else 0)]
+        transactions.append(rewards[index % len(rewards)])
+        target = rules.next_target(last_block, ancestor)
+        proof = 0
+        while not rules.valid_proof(last_block['proof'], proof, target):
+            proof += 1
+        block = {'index': index, 'timestamp': last_block['timestamp'] + bc.BLOCK_INTERVAL,
+                 'transactions': transactions, 'proof': proof, 'previous_hash': rules.hash(last_block),
+                 'target': target}
+        rules.seal(block)
+        chain.append(block)
+    return chain
+
+
+def cold_caches():
+    # Like a node that just started: no parsed keys, no verified signatures
+    signatures.load_public_key.cache_clear()
+    signatures.verified = signatures.SignatureCache()
+
+
+def bench_proof_of_work(results, sizes, keys):
+    chain = bc.Blockchain()
+    chain.miner = miner.ProofMiner(workers=1)
+    samples = []
+    hashes = 0
+    last_proof = chain.last_block['proof']
+    for _ in range(sizes['solves']):
+        start = time.perf_counter()
+        last_proof = chain.proof_of_work(last_proof, bc.INITIAL_TARGET)
+        samples.append(time.perf_counter() - start)
+        hashes += chain.miner.hashes
+    chain.miner.close()
+    results.add('proof_of_work.hash_rate', hashes / sum(samples), '1/s', 'higher')
+    results.latencies('proof_of_work.solve', samples)
+
+
+def bench_valid_transaction(results, sizes, keys):
+    transactions = [keys.transfer() for _ in range(sizes['transactions'])]
+    chain = node()
+    cold_caches()
+    for name in ('cold', 'cached'):
+        unspent = {}
+        samples = []
+        for t in transactions:
+            start = time.perf_counter()
+            assert chain.valid_transaction(t['sender'], t['recipient'], t['amount'], t['signature'], unspent)
+            samples.append(time.perf_counter() - start)
+        results.add(f'valid_transaction.{name}.per_s', len(samples) / sum(samples), '1/s', 'higher')
+        results.latencies(f'valid_transaction.{name}', samples)
+
+
+def bench_accept_block(results, sizes, keys):
+    chain = node()
+    chain.unspent.update((f'account-{i}', 10) for i in range(sizes['accounts']))
+    blocks = extend(list(chain.chain), sizes['accept_blocks'], keys, transfers_every=1, per_block=3)[1:]
+    # The transactions of a block were usually seen as pending before, their signatures are cached
+    chain.verifier.verify([t for block in blocks for t in block['transactions']])
+    samples = []
+    for block in blocks:
+        start = time.perf_counter()
+        assert chain.accept_block(block['proof'], block['index'], block['previous_hash'], block['timestamp'],
+                                  block['transactions'], block['target'])
+        samples.append(time.perf_counter() - start)
+    results.add('accept_block.per_s', len(samples) / sum(samples), '1/s', 'higher')
+    results.latencies('accept_block', samples)
+
+
+def bench_valid_chain(results, sizes, keys):
+    longest = max(sizes['chains'])
+    print(f'  building a chain of {longest:,} blocks...')
+    chain = extend(list(node().chain), longest, keys)
+    for length in sizes['chains']:
+        blocks = chain[:length + 1]
+        transactions = sum(len(block['transactions']) for block in blocks)
+        validator = node()
+        cold_caches()
+        start = time.perf_counter()
+        assert validator.valid_chain(blocks, {})
+        elapsed = time.perf_counter() - start
+        validator.verifier.close()
+        results.add(f'valid_chain.{length}.seconds', elapsed, 's', 'lower')
+        results.add(f'valid_chain.{length}.blocks_per_s', length / elapsed, '1/s', 'higher')
+        results.add(f'valid_chain.{length}.transactions_per_s', transactions / elapsed, '1/s', 'higher')
+
+
+def bench_hash(results, sizes, keys):
+    block = extend(list(node().chain), 1, keys, transfers_every=1, per_block=100)[-1]
+    unsealed = {k: v for k, v in block.items() if k not in ('hash', 'merkle_root')}
+    for name, candidate in (('sealed', block), ('unsealed_100tx', unsealed)):
+        start = time.perf_counter()
+        for _ in range(sizes['hashes']):
+            bc.Blockchain.hash(candidate)
+        elapsed = time.perf_counter() - start
+        results.add(f'hash.{name}.per_s', sizes['hashes'] / elapsed, '1/s', 'higher')
+
+
+def bench_endpoints(results, sizes, keys):
+    import routes
+    # Serve a chain of easy blocks, main() would set the address
+    served = node()
+    for block in extend(list(served.chain), sizes['served_blocks'], keys)[1:]:
+        assert served.accept_block(block['proof'], block['index'], block['previous_hash'], block['timestamp'],
+                                   block['transactions'], block['target'])
+    routes.blockchain = served
+    routes.addr, routes.portn = 'localhost', 5000
+    client = routes.app.test_client()
+
+    transactions = iter([keys.transfer() for _ in range(sizes['requests'])])
+    requests = (
+        ('chain_tip', lambda: client.get('/chain/tip')),
+        ('chain', lambda: client.get('/chain')),
+        ('chain_blocks', lambda: client.get('/chain/blocks?after=0')),
+        ('transactions_new', lambda: client.post('/transactions/new', json=next(transactions))),
+        ('balance', lambda: client.post('/balance', json={'keys': keys.students})),
+        ('metrics', lambda: client.get('/metrics')),
+    )
+    for name, send in requests:
+        samples = []
+        for _ in range(sizes['requests']):
+            start = time.perf_counter()
+            response = send()
+            response.get_data()
+            samples.append(time.perf_counter() - start)
+            assert response.status_code < 300, f'{name}: {response.status_code}'
+        results.add(f'endpoints.{name}.per_s', len(samples) / sum(samples), '1/s', 'higher')
+        results.latencies(f'endpoints.{name}', samples)
+
+
+def bench_startup(results, sizes, keys):
+    import requests
+    import socket
+    import tempfile
+
+    def start(*args):
+        # Seconds from launching a node to its first answer
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        begin = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'src', 'main.py'), '127.0.0.1', str(port),
+                                    *args], cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                try:
+                    requests.get(f'http://127.0.0.1:{port}/chain/tip', timeout=1).raise_for_status()
+                    return time.perf_counter() - begin
+                except requests.exceptions.ConnectionError:
+                    assert process.poll() is None, 'the node exited'
+                    time.sleep(0.005)
+        finally:
+            process.terminate()
+            process.wait()
+
+    results.latencies('startup.memory', [start() for _ in range(sizes['starts'])])
+    # Restarts of a node keeping its chain and keys, which it made on the first start
+    with tempfile.TemporaryDirectory() as data_dir:
+        start(data_dir)
+        results.latencies('startup.data_dir', [start(data_dir) for _ in range(sizes['starts'])])
+
+
+CASES = {
+    'proof_of_work': bench_proof_of_work,
+    'valid_transaction': bench_valid_transaction,
+    'accept_block': bench_accept_block,
+    'valid_chain': bench_valid_chain,
+    'hash': bench_hash,
+    'endpoints': bench_endpoints,
+    'startup': bench_startup,
+}
+
+
+def commit():
+    """
+    :return: <str> The commit measured, with '-dirty' if the tree has changes
+    """
+    try:
+        head = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return head.strip() + ('-dirty' if status.strip() else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the node\'s hot paths')
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, for a first look')
+    parser.add_argument('--only', help='comma separated cases, out of ' + ', '.join(CASES))
+    parser.add_argument('--output', help='file to write the results to, as JSON')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f'unknown case {", ".join(unknown)}')
+    sizes = SIZES['quick' if args.quick else 'full']
+
+    print('generating keys...')
+    keys = Keys()
+    results = Results()
+    for name in names:
+        print(name)
+        CASES[name](results, sizes, keys)
+
+    report = {
+        'commit': commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'workload': 'quick' if args.quick else 'full',
+        'results': results.values,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'results written to {args.output}')
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
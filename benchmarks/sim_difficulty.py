@@ -0,0 +1,52 @@
+"""
+Simulates retargeting under a changing hash rate, without doing any proof of work
+
+Block times are drawn from the exponential distribution a proof search
+follows: on average 2^256 / target hashes at the current hash rate. The
+targets come from Blockchain.next_target, exactly as nodes compute them.
+
+usage: python benchmarks/sim_difficulty.py [blocks per phase] [seed]
+"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import blockchain as bc
+
+# Hash rate of each phase, relative to the rate at which the initial target gives BLOCK_INTERVAL
+PHASES = (1, 4, 4, 0.5, 10, 1)
+
+
+def main():
+    per_phase = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+
+    chain = bc.Blockchain()
+    base_rate = 2 ** 256 / int(chain.initial_target, 16) / chain.block_interval
+    blocks = [{'index': 1, 'timestamp': 0.0, 'target': chain.initial_target}]
+    ancestor = lambda index: blocks[index - 1]
+
+    print(f'block interval {chain.block_interval}s, retarget every {chain.retarget_interval} blocks\n')
+    print(f'{"phase":<7}{"hash rate":>10}{"first window":>14}{"last window":>13}{"phase mean":>12}{"difficulty":>12}')
+    for phase, factor in enumerate(PHASES, 1):
+        rate = base_rate * factor
+        times = []
+        for _ in range(per_phase):
+            last_block = blocks[-1]
+            target = chain.next_target(last_block, ancestor)
+            elapsed = rng.expovariate(rate * int(target, 16) / 2 ** 256)
+            times.append(elapsed)
+            blocks.append({'index': last_block['index'] + 1, 'timestamp': last_block['timestamp'] + elapsed,
+                           'target': target})
+        window = chain.retarget_interval
+        difficulty = int(chain.initial_target, 16) / int(blocks[-1]['target'], 16)
+        print(f'{phase:<7}{factor:>9}x{sum(times[:window]) / window:>13.1f}s'
+              f'{sum(times[-window:]) / window:>12.1f}s{sum(times) / len(times):>11.1f}s{difficulty:>11.2f}x')
+
+
+if __name__ == '__main__':
+    main()
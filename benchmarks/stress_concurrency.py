@@ -0,0 +1,126 @@
+"""
+Concurrent stress test: transfers, blocks and balance reads from many threads at once
+
+Checks that readers always see the total amount of money, and that once the
+threads stop, unspent matches a replay of the chain and pending_unspent a
+replay of the mempool on top of it.
+
+usage: python benchmarks/stress_concurrency.py [seconds] [intake threads]
+"""
+import base64
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
+
+import rsa
+import blockchain as bc
+import miner
+
+STUDENTS = 6
+# Coins minted to every student before the threads start
+GRANT = 1000
+
+
+def sign(priv, sender, recipient, amount):
+    signature = rsa.sign(f'{sender}{recipient}{amount}'.encode('UTF-8'), priv, 'SHA-256')
+    return base64.b64encode(signature).decode('UTF-8')
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    intake_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with open(os.path.join(ROOT, 'Creator_Keys', 'priv_key')) as f:
+        creator_priv = rsa.PrivateKey.load_pkcs1(f.read())
+    creator = rsa.PublicKey(creator_priv.n, creator_priv.e).save_pkcs1().decode('UTF-8')
+    students = []
+    for _ in range(STUDENTS):
+        pub, priv = rsa.newkeys(512)
+        students.append((pub.save_pkcs1().decode('UTF-8'), priv))
+
+    chain = bc.Blockchain()
+    chain.miner = miner.ProofMiner(workers=1)
+    for key, _ in students:
+        assert chain.new_transactions([{'sender': creator, 'recipient': key, 'amount': GRANT,
+                                         'signature': sign(creator_priv, creator, key, GRANT)}]) == ['accepted']
+    chain.new_block(chain.proof_of_work(chain.last_block['proof']))
+    total = sum(chain.unspent.values())
+    assert total == STUDENTS * GRANT
+
+    stop = threading.Event()
+    counts = {'accepted': 0, 'duplicate': 0, 'invalid': 0, 'reads': 0}
+    errors = []
+    counts_lock = threading.Lock()
+
+    def intake(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            (sender, priv), (recipient, _) = rng.sample(students, 2)
+            # Amounts a sender can't cover are refused as invalid
+            amount = rng.randint(1, 300)
+            results = chain.new_transactions([{'sender': sender, 'recipient': recipient, 'amount': amount,
+                                               'signature': sign(priv, sender, recipient, amount)}])
+            with counts_lock:
+                counts[results[0]] += 1
+
+    def mine():
+        while not stop.is_set():
+            last_block = chain.last_block
+            proof = chain.proof_of_work(last_block['proof'])
+            with chain.chain_lock:
+                if chain.last_block is last_block:
+                    chain.new_block(proof)
+
+    def read():
+        while not stop.is_set():
+            unspent = chain.unspent
+            balance = sum(unspent.values())
+            if balance != total:
+                errors.append(f'reader saw a total of {balance}, expected {total}')
+            with counts_lock:
+                counts['reads'] += 1
+
+    threads = [threading.Thread(target=intake, args=(i,)) for i in range(intake_threads)]
+    threads += [threading.Thread(target=mine), threading.Thread(target=read), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    replayed = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not chain.valid_chain(chain.chain, replayed):
+            errors.append('chain does not validate')
+    if replayed != chain.unspent:
+        errors.append('unspent differs from a replay of the chain')
+    pending = dict(chain.unspent)
+    for t in chain.mempool:
+        if not chain.apply_verified(t, pending):
+            errors.append('a pending transaction does not go through')
+    if pending != chain.pending_unspent:
+        errors.append('pending_unspent differs from a replay of the mempool')
+    if sum(pending.values()) != total:
+        errors.append('pending transactions create or destroy money')
+
+    print(f'{seconds:.0f}s, {intake_threads} intake threads: {len(chain.chain)} blocks, '
+          f'{counts["accepted"]} accepted, {counts["invalid"]} invalid, {counts["duplicate"]} duplicate, '
+          f'{counts["reads"]} balance reads')
+    for error in errors[:10]:
+        print('FAIL:', error)
+    if errors:
+        sys.exit(1)
+    print('OK: balances stayed consistent')
+
+
+if __name__ == '__main__':
+    main()
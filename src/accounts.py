@@ -0,0 +1,90 @@
+from bisect import bisect_right
+
+
+class AccountIndex(object):
+    def __init__(self, apply):
+        """
+        Maps every public key to the transactions that touched it, block by block
+
+        :param apply: Called as apply(transaction, balances) to move the amount of a
+                      transaction from an already validated block
+        """
+        self.apply = apply
+        # Index of the last block added
+        self.height = 0
+        # Current balance of every key, like Blockchain.unspent
+        self.balances = {}
+        # Per key, one entry per transaction: block index, position in the block
+        # and the key's balance right after it
+        self._blocks = {}
+        self._positions = {}
+        self._after = {}
+
+    def add_block(self, block):
+        """
+        Indexes the transactions of the block after the last one added
+
+        :param block: <dict> Block with index height + 1
+        :return: None
+        """
+        for position, t in enumerate(block['transactions']):
+            self.apply(t, self.balances)
+            for key in {t['sender'], t['recipient']}:
+                if key == "0":
+                    continue
+                self._blocks.setdefault(key, []).append(block['index'])
+                self._positions.setdefault(key, []).append(position)
+                self._after.setdefault(key, []).append(self.balances.get(key, 0))
+        self.height = block['index']
+
+    def rollback(self, blocks):
+        """
+        Forgets the last blocks added, Eg. when the chain is replaced
+
+        :param blocks: <list> The blocks to drop, in chain order, ending with the last one added
+        :return: None
+        """
+        for block in reversed(blocks):
+            for t in block['transactions']:
+                for key in {t['sender'], t['recipient']}:
+                    heights = self._blocks.get(key)
+                    while heights and heights[-1] >= block['index']:
+                        heights.pop()
+                        self._positions[key].pop()
+                        self._after[key].pop()
+                    if heights:
+                        self.balances[key] = self._after[key][-1]
+                    elif key in self._blocks:
+                        del self._blocks[key], self._positions[key], self._after[key]
+                        self.balances.pop(key, None)
+            self.height = block['index'] - 1
+
+    def count(self, key):
+        """
+        :param key: <str> Public key
+        :return: <int> Number of transactions that touched the key
+        """
+        return len(self._blocks.get(key, ()))
+
+    def history(self, key, offset=0, limit=50):
+        """
+        :param key: <str> Public key
+        :param offset: <int> Number of transactions to skip, oldest first
+        :param limit: <int> Maximum number of transactions
+        :return: <list> (block index, position in block, balance after) tuples
+        """
+        return list(zip(self._blocks.get(key, ())[offset:offset + limit],
+                        self._positions.get(key, ())[offset:offset + limit],
+                        self._after.get(key, ())[offset:offset + limit]))
+
+    def balance_at(self, key, height):
+        """
+        :param key: <str> Public key
+        :param height: <int> Index of a block
+        :return: Balance of the key once that block was applied
+        """
+        heights = self._blocks.get(key)
+        if not heights:
+            return 0
+        i = bisect_right(heights, height)
+        return self._after[key][i - 1] if i else 0
@@ -0,0 +1,96 @@
+import json
+import records
+import state
+
+# Most transactions in a block
+MAX_TRANSACTIONS = 2000
+# Most bytes of JSON transactions in a block
+MAX_BYTES = 1000000
+# 'oldest' takes pending transactions in arrival order, 'value' the largest amounts first
+POLICIES = ('oldest', 'value')
+
+
+class BlockTemplate(object):
+    def __init__(self, last_block, target, transactions, selected, unspent, size, prefix):
+        """
+        A block ready for proof of work, its transactions already checked against the balances
+
+        :param last_block: <dict> The block it follows
+        :param target: <str> Its proof of work target
+        :param transactions: <list> Its transactions
+        :param selected: <int> How many of them were pending, the others come after them
+        :param unspent: <BalanceOverlay> Balances once its transactions went through
+        :param size: <int> Bytes of JSON transactions
+        :param prefix: <bool> Whether the selected transactions are the oldest pending ones, in order
+        """
+        self.last_block = last_block
+        self.target = target
+        self.transactions = transactions
+        self.selected = selected
+        self.unspent = unspent
+        self.size = size
+        self.prefix = prefix
+
+
+class BlockAssembler(object):
+    def __init__(self, max_transactions=MAX_TRANSACTIONS, max_bytes=MAX_BYTES, policy='oldest'):
+        """
+        Picks the pending transactions that go into the next block
+
+        :param max_transactions: <int> Most transactions in a block
+        :param max_bytes: <int> Most bytes of JSON transactions in a block
+        :param policy: <str> Order transactions are picked in, one of POLICIES
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown selection policy {policy}')
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.policy = policy
+
+    def assemble(self, last_block, target, pending, unspent, apply, extra=()):
+        """
+        Selects pending transactions within the limits and stages them on a balance overlay
+
+        Transactions are taken in policy order. One that no longer goes through,
+        Eg. because it depends on a transaction picked later, is skipped and
+        stays pending. The extra transactions, Eg. the mining reward, always go last.
+
+        :param last_block: <dict> The block the new one follows
+        :param target: <str> Proof of work target of the new block
+        :param pending: <list> Pending transactions, oldest first
+        :param unspent: <dict> Balances as of last_block
+        :param apply: Called as apply(transaction, balances), returns False if it does not go through
+        :param extra: <list> Transactions added after the pending ones
+        :return: <BlockTemplate>
+        :raises ValueError: If an extra transaction does not go through
+        """
+        candidates = pending if self.policy == 'oldest' else sorted(pending, key=lambda t: -t['amount'])
+        max_transactions = self.max_transactions - len(extra)
+        max_bytes = self.max_bytes - sum(self.size(t) for t in extra)
+        staged = state.BalanceOverlay(unspent)
+        selected = []
+        size = 0
+        prefix = self.policy == 'oldest'
+        for t in candidates:
+            if len(selected) == max_transactions:
+                break
+            t_size = self.size(t)
+            if size + t_size > max_bytes:
+                break
+            if not apply(t, staged):
+                prefix = False
+                continue
+            selected.append(t)
+            size += t_size
+        for t in extra:
+            if not apply(t, staged):
+                raise ValueError('Invalid transaction in block')
+            size += self.size(t)
+        return BlockTemplate(last_block, target, selected + list(extra), len(selected), staged, size, prefix)
+
+    @staticmethod
+    def size(transaction):
+        """
+        :return: <int> Bytes of the transaction as JSON
+        """
+        return len(json.dumps(transaction, default=records.to_json))
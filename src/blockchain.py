@@ -1,59 +1,248 @@
 #Source: https://hackernoon.com/learn-blockchains-by-building-one-117428612f46
 import hashlib
+import logging
+from collections.abc import Mapping
 from urllib.parse import urlparse
 from textwrap import dedent
-from time import time
-from threading import Lock
-import rsa
-import base64
+from time import time, perf_counter
+from threading import RLock
 import json
-import requests
+import accounts
+import assembly
+import blocktree
+import keystore
+import mempool
+import metrics
+import miner
+import peers
+import records
+import signatures
+import state
 
-# TODO implement creator public key
-pub_key = open("Creator_Keys/pub_key","r")
-CREATOR_KEY= rsa.PublicKey.load_pkcs1(pub_key.read())
-pub_key.close()
+# Fields of a block covered by its hash, next to the merkle root of its transactions
+HEADER_FIELDS = ('index', 'timestamp', 'proof', 'previous_hash', 'target')
+# Blocks fetched per request while looking for a common ancestor
+SYNC_PAGE_SIZE = 100
+# Blocks validated together while syncing
+SYNC_WINDOW = 100
+# Blocks whose signatures are verified in one batch
+VERIFY_WINDOW = 1000
+# Proof of work target of the first blocks, as 64 hex digits: four leading hex zeros
+INITIAL_TARGET = miner.target_for(miner.DIFFICULTY_BITS).hex()
+# Easiest target allowed: one leading zero bit
+MAX_TARGET = int(miner.target_for(1).hex(), 16)
+# Seconds wanted between blocks
+BLOCK_INTERVAL = 10
+# The target is recomputed every RETARGET_INTERVAL blocks
+RETARGET_INTERVAL = 20
+# A retarget changes the target by at most this factor either way
+MAX_RETARGET = 4
+# Seconds a block's timestamp can be ahead of our clock. Clocks of nodes differ a little,
+# but a miner dating blocks further ahead would make the next targets easier
+MAX_FUTURE_DRIFT = 2 * 60
+
+logger = logging.getLogger(__name__)
+
+POW_SECONDS = metrics.histogram('educoin_pow_seconds', 'Time to find a proof of work',
+                                buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600))
+POW_HASHES = metrics.counter('educoin_pow_hashes_total', 'Nonces tried by proof of work searches')
+POW_HASH_RATE = metrics.gauge('educoin_pow_hash_rate', 'Nonces per second of the last proof of work search')
+TRANSACTION_CHECKS = metrics.counter('educoin_transaction_checks_total',
+                                     'Transactions checked against signature and balances, by result', ('result',))
+TRANSACTION_CHECK_SECONDS = metrics.histogram('educoin_transaction_check_seconds',
+                                              'Time to check a single transaction')
+BLOCK_VALIDATION_SECONDS = metrics.histogram('educoin_block_validation_seconds',
+                                             'Time to validate a block, its share of the batched signature checks included')
+BLOCK_VALIDATIONS = metrics.counter('educoin_block_validations_total', 'Blocks validated, by result', ('result',))
+HEADER_HASHES = metrics.counter('educoin_header_hashes_total', 'Block headers hashed')
+HEADER_HASH_SECONDS = metrics.counter('educoin_header_hash_seconds_total', 'Time spent hashing block headers')
 
 class Blockchain(object):
-    def __init__(self):
+    def __init__(self, store=None, initial_target=INITIAL_TARGET, block_interval=BLOCK_INTERVAL,
+                 retarget_interval=RETARGET_INTERVAL, max_future_drift=MAX_FUTURE_DRIFT):
+        """
+        :param store: (Optional) <BlockStore> Where the chain is persisted, see attach_store
+        :param initial_target: <str> Proof of work target of the first blocks, as 64 hex digits
+        :param block_interval: Seconds wanted between blocks
+        :param retarget_interval: <int> Number of blocks between target changes
+        :param max_future_drift: Seconds a block can be dated ahead of our clock, None for no limit
+        """
+        #Every node of a network has to use the same difficulty settings
+        self.initial_target = initial_target
+        self.block_interval = block_interval
+        self.retarget_interval = retarget_interval
+        self.max_future_drift = max_future_drift
         self.chain = []
-        self.current_transactions = []
+        #Transactions waiting for the next block
+        self.mempool = mempool.Mempool()
         self.nodes=set()
+        #Pooled, concurrent connections to the nodes
+        self.peers = peers.PeerClient()
         self.amount = 0
+        #Balances as of the last block. Replaced or updated in one step, so it can be read without a lock
         self.unspent = {}
-        #Used for validating incoming transactions, later updating unspent
-        self.temp_unspent = {}
+        #Balances once the pending transactions go through, staged on top of unspent.
+        #The next block commits them to unspent
+        self.pending_unspent = state.BalanceOverlay(self.unspent)
+        #Held while the chain, unspent, the store or the account index change
+        self.chain_lock = RLock()
+        #Held while the mempool and pending_unspent change. Taken after chain_lock when both are needed
+        self.pending_lock = RLock()
+        #Searches for proofs on every core
+        self.miner = miner.ProofMiner()
+        #Checks signatures of whole blocks on every core
+        self.verifier = signatures.BatchVerifier()
+        #Where blocks are persisted, see attach_store
+        self.store = None
+        #Transactions of every public key, see account_index
+        self.accounts = accounts.AccountIndex(self.apply_verified)
+        #Recent blocks of the chain and of competing branches, see accept_block
+        self.tree = blocktree.BlockTree()
+        #Picks the pending transactions of new blocks, see block_template
+        self.assembler = assembly.BlockAssembler()
 
         #Create the genesis block
         self.new_block(previous_hash=1,proof=100)
 
-    def new_block(self, proof, previous_hash=None):
+        if store is not None:
+            self.attach_store(store)
+
+    def attach_store(self, store):
+        """
+        Persists the chain to a block store, loading it from there if the store already has blocks
+
+        Loading starts from the latest snapshot of unspent and only replays the
+        balance changes of the blocks after it. The blocks were validated before
+        they were written, so their signatures are not checked again.
+
+        :param store: <BlockStore> The store to use
+        :return: None
+        """
+        with self.chain_lock, self.pending_lock:
+            self.store = store
+            if store.height == 0:
+                for block in self.chain:
+                    store.append(block)
+                return
+
+            chain = []
+            for block in store.blocks():
+                if 'hash' not in block:
+                    self.seal(block)
+                chain.append(records.Block.compact(block))
+            # Built on the first query, see account_index
+            self.accounts = accounts.AccountIndex(self.apply_verified)
+            self.tree = blocktree.BlockTree(self.tree.max_depth)
+            height, unspent = store.load_snapshot()
+            for block in chain[max(0, len(chain) - self.tree.max_depth):height]:
+                self.tree.add(block)
+            for block in chain[height:]:
+                # Blocks replayed on top of the snapshot can be rolled back by a reorg
+                staged = state.BalanceOverlay(unspent)
+                for t in block['transactions']:
+                    self.apply_transaction(t['sender'], t['recipient'], t['amount'], staged,
+                                           self.is_minting(t['sender']))
+                self.tree.add(block, staged.commit())
+            self.chain = chain
+            self.unspent = unspent
+            self.pending_unspent = state.BalanceOverlay(unspent)
+            self.mempool.clear()
+
+    def _index_accounts(self, block):
+        """
+        Adds a block that was just added to the chain to the account index, if the index is up to date
+
+        :param block: <dict> The new last block
+        :return: None
+        """
+        if self.accounts.height == block['index'] - 1:
+            self.accounts.add_block(block)
+
+    def account_index(self):
+        """
+        Brings the account index up to date and returns it. After a restart
+        the index is built on the first query instead of at startup.
+
+        :return: <AccountIndex>
+        """
+        with self.chain_lock:
+            for block in self.chain[self.accounts.height:]:
+                self.accounts.add_block(block)
+            return self.accounts
+
+    def _persist(self, block):
+        """
+        Appends a block that was just added to the chain to the store, if there is one
+
+        :param block: <dict> The new last block
+        :return: None
+        """
+        if self.store is None:
+            return
+        self.store.append(block)
+        if block['index'] - self.store.snapshot_height >= self.store.snapshot_interval:
+            self.store.save_snapshot(block['index'], self.unspent)
+
+    def block_template(self, extra=()):
+        """
+        Assembles the next block from the pending transactions, within the assembler's limits
+
+        :param extra: <list> Transactions that go last, Eg. the mining reward
+        :return: <BlockTemplate>
+        :raises ValueError: If an extra transaction does not go through
+        """
+        with self.chain_lock, self.pending_lock:
+            last_block = self.chain[-1] if self.chain else None
+            target = self.next_target(last_block) if last_block else self.initial_target
+            return self.assembler.assemble(last_block, target, self.mempool.transactions(), self.unspent,
+                                           self.apply_verified, extra)
+
+    def new_block(self, proof, previous_hash=None, template=None):
         """
         Create a new Block in the Blockchain
         
         :param proof: <int> The proof given by the Proof of Work algorithim
         :param previous_hash: (Optional) <str> Hash of previous Block
+        :param template: (Optional) <BlockTemplate> The block the proof was found for,
+                         assembled from the pending transactions if not given
         :return: <dict> New Block
+        :raises ValueError: If the template does not follow our last block
         """
-    
-        block = {
-            'index': len(self.chain) +1,
-            'timestamp': time(),
-            'transactions': self.current_transactions,
-            'proof': proof,
-            "previous_hash": previous_hash or self.hash(self.chain[-1])
-        }
-        
-        #Reset the current list of transactions
-        self.current_transactions = []
+        with self.chain_lock, self.pending_lock:
+            if template is None:
+                template = self.block_template()
+            elif template.last_block is not self.last_block:
+                raise ValueError('The block template is for an older chain')
+            block = {
+                'index': len(self.chain) +1,
+                'timestamp': time(),
+                'transactions': template.transactions,
+                'proof': proof,
+                "previous_hash": previous_hash or self.hash(self.chain[-1]),
+                'target': template.target
+            }
+            self.seal(block)
+            # Kept as a record from now on, see records
+            block = records.Block.compact(block)
 
-        #Update unspent w/ temporary unspent dictionary
-        self.unspent.update(self.temp_unspent)
+            #Commit the balances of the block, checked when the template was assembled
+            self.tree.add(block, template.unspent.commit())
 
-        self.chain.append(block)
-        return block
+            #Remove the transactions of the block from the pending ones
+            removed = self.mempool.remove_included(template.transactions[:template.selected])
+            extra_keys = {key for t in template.transactions[template.selected:] for key in (t['sender'], t['recipient'])}
+            #Some of them may have been evicted since the template was assembled
+            if (not template.prefix or removed != template.selected
+                    or extra_keys & self.pending_unspent.changes.keys()):
+                self.update_pending(template.transactions)
+            #Otherwise the pending balances were computed from the same transactions in the same order
+
+            self.chain.append(block)
+            self._persist(block)
+            self._index_accounts(block)
+            return block
     
-    def accept_block(self, proof, index, previous_hash, timestamp, transactions):
+    def accept_block(self, proof, index, previous_hash, timestamp, transactions, target=None):
         """
         Accepting a Block in the Blockchain
         
@@ -62,50 +251,165 @@ class Blockchain(object):
         :param previous_hash: <int> Hash of the previous block at remote node
         :param timestamp: <str> Time block was created
         :param transactions: List of transactions
+        :param target: <str> Proof of work target of the block, see next_target
         
-        :return: <bool> whether block was accepted or not
+        :return: <bool> whether block was accepted or not, on our chain or on a side branch
         """
-        if(len(self.chain) + 1 != index):
+        # Blocks that follow none of our recent blocks are left to resolve_conflicts
+        if(previous_hash not in self.tree):
             return False
 
-        if(self.last_block['timestamp'] > timestamp):
+        # Also covers side blocks, accept_side_block is only reached from here
+        if(not self.well_formed(transactions) or self.has_duplicates(transactions)):
             return False
-        
-        if(self.hash(self.last_block) != previous_hash):
+
+        # Signatures don't depend on the chain, they are checked before taking the lock
+        signed = self.verifier.verify(transactions)
+
+        with self.chain_lock:
+            parent = self.tree.get(previous_hash)
+            if(parent is None or parent['index'] + 1 != index):
+                return False
+
+            if(not self.valid_timestamp(parent, timestamp)):
+                return False
+
+            extends_tip = self.hash(self.last_block) == previous_hash
+            branch = (len(self.chain), []) if extends_tip else self.tree.branch(previous_hash, self.chain)
+            if(branch is None or target != self.next_target(parent, self.ancestors(self.chain, *branch))):
+                return False
+
+            if(not self.valid_proof(parent['proof'], proof, target)):
+                return False
+
+            block = {
+                'index': index,
+                'timestamp': timestamp,
+                'transactions': transactions,
+                'proof': proof,
+                "previous_hash": previous_hash,
+                'target': target
+            }
+            if(not extends_tip):
+                return self.accept_side_block(block, signed)
+
+            # Staged on top of unspent, which only changes if the whole block is valid
+            staged = state.BalanceOverlay(self.unspent)
+            for t, ok in zip(transactions, signed):
+                if (not ok or not self.apply_verified(t, staged)):
+                    return False
+
+            self.seal(block)
+            block = records.Block.compact(block)
+
+            with self.pending_lock:
+                self.tree.add(block, staged.commit())
+                self.mempool.remove_included(transactions)
+                self.update_pending(transactions)
+
+            self.chain.append(block)
+            self._persist(block)
+            self._index_accounts(block)
+            return True
+
+    def accept_side_block(self, block, signed):
+        """
+        Keeps a block that follows a block other than our last one, and
+        switches to its branch once that branch is longer than our chain
+
+        Balances of a side branch are only checked when it becomes the longest.
+        Called with chain_lock held, after accept_block checked the proof against the parent.
+
+        :param block: <dict> The block
+        :param signed: <list> <bool> Whether each transaction's signature is valid
+        :return: <bool> whether block was accepted or not
+        """
+        if not all(signed):
             return False
-        
-        if(not self.valid_proof(self.last_block['proof'], proof)):
+        self.seal(block)
+        if block['hash'] in self.tree:
             return False
-        
-        self.temp_unspent.clear()
-        self.temp_unspent.update(self.unspent)
-        
-        for t in transactions:
-            if (not self.valid_transaction(t['sender'], t['recipient'], t['amount'], t['signature'])):
+        block = records.Block.compact(block)
+        self.tree.add(block)
+
+        common, branch = self.tree.branch(block['hash'], self.chain)
+        if common + len(branch) <= len(self.chain):
+            return True
+        return self.reorganize(common, branch)
+
+    def reorganize(self, common, blocks):
+        """
+        Replaces the blocks of our chain after a fork point with a longer branch
+
+        The balances are rolled back to the fork point with the undo records of
+        our blocks, then the branch is applied, so this costs O(fork depth)
+        instead of O(chain length).
+
+        :param common: <int> Number of blocks our chain shares with the branch
+        :param blocks: <list> Blocks of the branch after them, already in the tree
+        :return: <bool> True if our chain was replaced, False if the branch is invalid
+                 or forks too deep to roll back
+        """
+        with self.chain_lock:
+            staged = state.BalanceOverlay(self.unspent)
+            if not self.tree.rollback(self.chain[common:], staged):
                 return False
-        self.unspent.update(self.temp_unspent)
-            
-        
-        block = {
-            'index': index,
-            'timestamp': timestamp,
-            'transactions': transactions,
-            'proof': proof,
-            "previous_hash": previous_hash
-        }
-        # TODO: filter out transactions from current_transactions
-        temp = []
-        for t in self.current_transactions:
-            not_in_trans = True
-            for s in transactions:
-                if t['sender'] == s['sender'] and t['recipient'] == s['recipient'] and t['amount'] == s['amount']:
-                   not_in_trans = False 
-            if not_in_trans:
-                temp.append(t)
-        self.current_transactions = temp
-
-        self.chain.append(block)
-        return True
+            undo = []
+            if not self.valid_blocks(self.chain[common - 1], blocks, staged, undo):
+                # Blocks from the first invalid one on are of no use
+                for block in blocks[len(undo):]:
+                    self.tree.remove(block['hash'])
+                return False
+            self.switch_branch(common, blocks, staged, undo)
+            return True
+
+    def switch_branch(self, common, blocks, staged, undo):
+        """
+        Makes a validated branch our chain
+
+        Transactions of our dropped blocks that still go through are pending again.
+
+        :param common: <int> Number of blocks our chain shares with the branch
+        :param blocks: <list> Blocks of the branch after them
+        :param staged: <BalanceOverlay> Balances after the branch, on top of a plain dict
+        :param undo: <list> Undo record of each block of the branch
+        :return: None
+        """
+        blocks = [records.Block.compact(block) for block in blocks]
+        with self.chain_lock, self.pending_lock:
+            dropped = self.chain[common:]
+            staged.commit()
+            self.unspent = staged.base
+            if self.accounts.height > common:
+                self.accounts.rollback(self.chain[common:self.accounts.height])
+            if self.store is not None:
+                # A snapshot of blocks both chains share stays good, truncate drops a later one
+                stale_snapshot = self.store.snapshot_height > common
+                # Keep the part of the log both chains share
+                self.store.truncate(common)
+                for block in blocks:
+                    self.store.append(block)
+                height = common + len(blocks)
+                if stale_snapshot or height - self.store.snapshot_height >= self.store.snapshot_interval:
+                    self.store.save_snapshot(height, self.unspent)
+            # In one step, the branch is longer so readers without the lock never see the chain shrink
+            self.chain[common:] = blocks
+            self.tree.detach(dropped)
+            for block, record in zip(blocks, undo):
+                self.tree.add(block, record)
+                self._index_accounts(block)
+
+            for block in blocks:
+                self.mempool.remove_included(block['transactions'])
+            self.rebuild_pending()
+            included = {mempool.transaction_id(t) for block in blocks for t in block['transactions']}
+            for block in dropped:
+                for t in block['transactions']:
+                    # Mining rewards are only valid in the block they were mined for
+                    if t['sender'] == "0" or mempool.transaction_id(t) in included:
+                        continue
+                    if (self.test_transaction(t) and self.valid_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])):
+                        self.new_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])
     
     
     def register_node(self, address):
@@ -127,31 +431,120 @@ class Blockchain(object):
         
         :return: <True> new unspent if valid, None if not
         """
-        last_block = chain[0]
-        current_index = 1
+        return self.valid_blocks(chain[0], chain[1:], unspent, ancestor=self.ancestors(chain, len(chain), []))
 
-        while current_index < len(chain):
-            block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
-            # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(last_block):
-                return False
-            
-            for t in block['transactions']:
-                if (not self.valid_transaction(t['sender'],t['recipient'],t['amount'],t['signature'],unspent=unspent)):
+    def valid_blocks(self,last_block,blocks,unspent,undo=None,ancestor=None):
+        """
+        Determine if blocks validly extend last_block
+
+        Signatures are checked up front on the verifier's process pool, a
+        window of blocks at a time, then a sequential pass checks hashes,
+        proofs, targets and balances. The outcome is the same as checking every
+        transaction with valid_transaction in order.
+
+        :param last_block: <dict> The block the first of blocks has to follow
+        :param blocks: <list> Blocks in order
+        :param unspent: <dict> Balances as of last_block, updated with the blocks
+        :param undo: (Optional) <list> Gets the undo record of each valid block, see BalanceOverlay.commit
+        :param ancestor: (Optional) Function giving the block at an index up to last_block's,
+                         see ancestors. Defaults to the blocks of our chain
+        :return: <bool> True if valid, False if not
+        """
+        if ancestor is None:
+            ancestor = self.ancestors(self.chain, len(self.chain), [])
+        first = last_block['index'] + 1
+
+        def at(index):
+            return blocks[index - first] if index >= first else ancestor(index)
+
+        for start in range(0, len(blocks), VERIFY_WINDOW):
+            window = blocks[start:start + VERIFY_WINDOW]
+            transactions = [t for block in window for t in block['transactions']]
+            started = perf_counter()
+            signed = iter(self.verifier.verify(transactions))
+            # Signature time of the window, shared by its blocks in proportion to their transactions
+            per_transaction = (perf_counter() - started) / max(len(transactions), 1)
+
+            for block in window:
+                started = perf_counter()
+                logger.debug('Validating block %s after block %s', block, last_block)
+                if not self.validate_block(last_block, block, signed, unspent, undo, at):
+                    BLOCK_VALIDATIONS.inc(result='invalid')
                     return False
-                    
-            # Check that the Proof of Work is correct
-            if not self.valid_proof(last_block['proof'], block['proof']):
+                BLOCK_VALIDATIONS.inc(result='valid')
+                TRANSACTION_CHECKS.inc(len(block['transactions']), result='valid')
+                BLOCK_VALIDATION_SECONDS.observe(perf_counter() - started
+                                                 + per_transaction * len(block['transactions']))
+                last_block = block
+
+        return True
+
+    def validate_block(self, last_block, block, signed, unspent, undo, at):
+        """
+        Checks a block of valid_blocks against the one before it and applies its transactions
+
+        :param last_block: <dict> The block before it
+        :param block: <dict> The block
+        :param signed: <iterator> Signature check results of its transactions, in order
+        :param unspent: <dict> Balances to apply its transactions to
+        :param undo: <list> Receives its undo record, None if not wanted
+        :param at: Finds a block of its branch by index
+        :return: <bool> True if valid, False if not
+        """
+        # Check that the hash of the block is correct
+        if not self.seal(block) or block['previous_hash'] != self.hash(last_block):
+            logger.debug('Block %s has a bad hash or does not follow block %s', block.get('index'),
+                         last_block['index'])
+            return False
+
+        if block['index'] != last_block['index'] + 1 or block.get('target') != self.next_target(last_block, at):
+            logger.debug('Block %s has a bad index or target', block.get('index'))
+            return False
+
+        if not self.valid_timestamp(last_block, block['timestamp']):
+            logger.debug('Block %s is dated before block %s or in the future', block['index'], last_block['index'])
+            return False
+
+        if not self.well_formed(block['transactions']):
+            logger.debug('Block %s has a malformed transaction', block['index'])
+            return False
+
+        if self.has_duplicates(block['transactions']):
+            logger.debug('Block %s has a transaction twice', block['index'])
+            return False
+
+        # Each block on its own layer when its undo record is wanted
+        layer = unspent if undo is None else state.BalanceOverlay(unspent)
+        for t in block['transactions']:
+            if (not next(signed) or not self.apply_verified(t, layer)):
+                TRANSACTION_CHECKS.inc(result='invalid')
+                logger.debug('Block %s has an invalid transaction', block['index'])
                 return False
 
-            last_block = block
-            current_index += 1
+        # Check that the Proof of Work is correct
+        if not self.valid_proof(last_block['proof'], block['proof'], block['target']):
+            logger.debug('Block %s has an invalid proof', block['index'])
+            return False
 
+        if undo is not None:
+            undo.append(layer.commit())
         return True
 
+    def valid_timestamp(self, parent, timestamp):
+        """
+        Targets are computed from timestamps, see next_target, so they have to
+        go forward and not run ahead of our clock by more than max_future_drift
+
+        :param parent: <dict> The block before it
+        :param timestamp: Time the block was created
+        :return: <bool> True if valid, False if not
+        """
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool):
+            return False
+        if parent['timestamp'] > timestamp:
+            return False
+        return self.max_future_drift is None or timestamp <= time() + self.max_future_drift
+
     def valid_transaction(self,sender,recipient,amount,signature,unspent=None):
         """
         Determine if a transaction is valid
@@ -164,94 +557,271 @@ class Blockchain(object):
         :return: <bool> True if transaction valid, False if not 
         """
 
-        if (unspent is None):
-            unspent = self.temp_unspent
-        
         # verify identity of node doing transaction
+        with TRANSACTION_CHECK_SECONDS.time():
+            try:
+                # Parsed keys and already verified signatures are cached
+                signatures.verify(sender, recipient, amount, signature)
+                if (unspent is None):
+                    with self.pending_lock:
+                        valid = self.apply_transaction(sender, recipient, amount, self.pending_unspent,
+                                                       self.is_minting(sender))
+                else:
+                    valid = self.apply_transaction(sender, recipient, amount, unspent, self.is_minting(sender))
+
+            except:
+                valid = False
+        TRANSACTION_CHECKS.inc(result='valid' if valid else 'invalid')
+        return valid
+    
+    def apply_verified(self, transaction, unspent):
+        """
+        Applies a transaction whose signature was checked, like valid_transaction would
+
+        :param transaction: <dict> The transaction
+        :param unspent: <dict> The dict that we are updating
+        :return: <bool> True if transaction valid, False if not
+        """
         try:
-            pub = None
-            gen = False
-            if (sender == "0"):
-                gen = True
-                pub = rsa.PublicKey.load_pkcs1(recipient)
-            else:
-                pub = rsa.PublicKey.load_pkcs1(sender)
-                
-            # double check if destination is valid public key
-            rec = rsa.PublicKey.load_pkcs1(recipient)
-            message = f'{sender}{recipient}{amount}'
-            # convert into byte array 
-            sig = base64.b64decode(signature.encode('UTF-8'))
-            rsa.verify(message.encode('UTF-8'),sig,pub)
-            
-            # allow certain key to create money no matter what
-            if (pub==CREATOR_KEY or gen):
-                tamount = amount if (not sender in unspent.keys()) else amount + unspent[recipient]
-                temp = {recipient: tamount}
-                unspent.update(temp)
-                    
-                return True
-            # verify if node has enough money to send
-            if (sender in unspent.keys() and unspent[sender]<amount):
-                return False
-            tloss = unspent[sender] - amount
-            tamount = amount if (not recipient in unspent.keys()) else amount + unspent[recipient]
-            temp = {sender: tloss,recipient: tamount}
-            unspent.update(temp)
-            
+            return self.apply_transaction(transaction['sender'], transaction['recipient'], transaction['amount'],
+                                          unspent, self.is_minting(transaction['sender']))
         except:
             return False
-        
+
+    @staticmethod
+    def apply_transaction(sender, recipient, amount, unspent, minting):
+        """
+        Moves the amount of a transaction whose signature was already checked
+
+        :param sender: <str> The public key of the sender
+        :param recipient: <str> The public key of the recipient
+        :param amount: <int> The amount of money being sent
+        :param unspent: <dict> The dict that we are updating
+        :param minting: <bool> Whether the sender is allowed to create money
+        :return: <bool> True if the sender could pay, False if not
+        """
+        # allow certain key to create money no matter what
+        if (minting):
+            tamount = amount if (not sender in unspent.keys()) else amount + unspent[recipient]
+            temp = {recipient: tamount}
+            unspent.update(temp)
+                
+            return True
+        # verify if node has enough money to send
+        if (sender in unspent.keys() and unspent[sender]<amount):
+            return False
+        tloss = unspent[sender] - amount
+        tamount = amount if (not recipient in unspent.keys()) else amount + unspent[recipient]
+        temp = {sender: tloss,recipient: tamount}
+        unspent.update(temp)
         return True
-    
+
+    @staticmethod
+    def is_minting(sender):
+        """
+        Whether a transaction creates money instead of moving it
+
+        :param sender: <str> The public key of the sender
+        :return: <bool>
+        """
+        return sender == "0" or signatures.load_public_key(sender) == keystore.creator_key()
+
+    def mints(self, key):
+        """
+        :param key: <str> Any key of a transaction, not necessarily a valid public key
+        :return: <bool> Whether transactions sent by key create money, see is_minting
+        """
+        try:
+            return self.is_minting(key)
+        except:
+            return False
+
     def resolve_conflicts(self):
         """
         This is our Consensus Algorithm, it resolves conflicts
         by replacing our chain with the longest one in the network.
+
+        Only the tip of each neighbour is fetched up front. The longest valid
+        chain is then synced from the last block it shares with ours, see sync_from.
         
         :return: <bool> True if our chain was replaced, False if not
         """
 
-        neighbours = self.nodes
-        new_chain = None
-        new_unspent = {}
-
+        # Our chain as of now, the balances staged while syncing build on its tip
+        chain = list(self.chain)
         # We're only looking for chains longer than ours
-        max_length = len(self.chain)
-        current_transactions = []
-
-        # Grab and verify the chains from all the nodes in our network
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
-
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
-
-                unspent = {}
-                # Check if the length is longer and the chain is valid
-                if length > max_length and self.valid_chain(chain,unspent):
-                    new_unspent.clear()
-                    new_unspent.update(unspent)
-                    max_length = length
-                    new_chain = chain
-                    current_transactions = response.json()['transactions']
-
-        # Replace our chain if we discovered a new, valid chain longer than ours
-        if new_chain:
-            self.chain = new_chain
-            # add new unspent values that we just calculated
-            self.unspent.clear()
-            self.temp_unspent.clear()
-            self.unspent.update(new_unspent)
-            self.temp_unspent.update(new_unspent)
-            self.current_transactions = []
-            for t in current_transactions:
-                if (self.valid_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])):
-                    self.new_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])
+        max_length = len(chain)
+        candidates = []
+        # Balances at each fork point, computed once for all neighbours
+        forks = {}
+
+        tips = self.peers.broadcast(self.nodes, '/chain/tip', method='GET')
+        for node, response in tips.items():
+            if response is not None and response.status_code == 200:
+                length = self.peers.read(response)['index']
+                if length > max_length:
+                    candidates.append((length, node))
+
+        # Try the longest chains first, the first valid one wins
+        for length, node in sorted(candidates, reverse=True):
+            synced = self.sync_from(node, length, chain, forks)
+            if synced is None:
+                continue
+            common, blocks, staged, undo = synced
+
+            try:
+                response = self.peers.get(node, '/transactions/pending')
+                current_transactions = self.peers.read(response)['transactions'] if response.status_code == 200 else []
+            except peers.PeerError:
+                current_transactions = []
+
+            with self.chain_lock, self.pending_lock:
+                # The staged balances are only right if no block was added or replaced while we were syncing
+                if self.last_block is not chain[-1]:
+                    return False
+                # add new unspent values that we just calculated
+                self.switch_branch(common, blocks, staged, undo)
+                for t in current_transactions:
+                    if (self.test_transaction(t) and self.valid_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])):
+                        self.new_transaction(t['sender'],t['recipient'],t['amount'],t['signature'])
             return True
         
         return False
+
+    def fetch_blocks(self, node, after, limit=SYNC_PAGE_SIZE):
+        """
+        Fetches one page of blocks from a neighbour
+
+        :param node: <str> Address of the neighbour
+        :param after: <int> Index of the block before the first one wanted
+        :param limit: <int> Maximum number of blocks
+        :return: <list> Blocks, None if the neighbour did not answer
+        """
+        try:
+            response = self.peers.get(node, '/chain/blocks', params={'after': after, 'limit': limit})
+        except peers.PeerError:
+            return None
+        if response.status_code != 200:
+            return None
+        return self.peers.read(response)['blocks']
+
+    def find_common_ancestor(self, node, chain=None):
+        """
+        Finds how many blocks at the start of our chain a neighbour has too
+
+        Probes our own blocks from the tip backwards with growing steps, then
+        narrows down with a binary search, so this costs O(log fork depth) requests.
+
+        :param node: <str> Address of the neighbour
+        :param chain: (Optional) <list> Our chain as of some point, defaults to the current one
+        :return: <int> Number of shared blocks, None if the neighbour did not answer
+        """
+        if chain is None:
+            chain = self.chain
+
+        def shared(index):
+            blocks = self.fetch_blocks(node, index - 1, 1)
+            if blocks is None:
+                raise peers.PeerError(node)
+            return len(blocks) == 1 and self.seal(blocks[0]) and self.hash(blocks[0]) == self.hash(chain[index - 1])
+
+        try:
+            high = len(chain)
+            if shared(high):
+                return high
+            # high is known not to be shared, look for a lower block that is
+            step = 1
+            low = 0
+            while high - step >= 1:
+                if shared(high - step):
+                    low = high - step
+                    break
+                high -= step
+                step *= 2
+            while high - low > 1:
+                middle = (low + high) // 2
+                if shared(middle):
+                    low = middle
+                else:
+                    high = middle
+            return low
+        except peers.PeerError:
+            return None
+
+    def sync_from(self, node, length, chain=None, forks=None):
+        """
+        Downloads and validates the blocks of a neighbour past the last block we share
+
+        The new balances are staged on top of unspent. When the neighbour does
+        not have our last block, our blocks after the fork are rolled back first
+        with their undo records, or if the fork is too deep, the balances at the
+        fork are recomputed from genesis.
+
+        :param node: <str> Address of the neighbour
+        :param length: <int> Length of the neighbour's chain
+        :param chain: (Optional) <list> Our chain as of some point, defaults to the current one
+        :param forks: (Optional) <dict> Balances at the fork by number of shared blocks,
+                      filled in so other neighbours forking at the same block reuse them
+        :return: <tuple> (number of shared blocks, new blocks, <BalanceOverlay> balances after them,
+                 undo record of each new block), None if invalid
+        """
+        if chain is None:
+            chain = list(self.chain)
+        if forks is None:
+            forks = {}
+
+        common = self.find_common_ancestor(node, chain)
+        if common is None:
+            return None
+
+        unspent = state.BalanceOverlay(self.unspent)
+        if not common or not self.tree.rollback(chain[common:], unspent):
+            if common not in forks:
+                # Our blocks up to the fork were validated when we added them
+                forks[common] = {}
+                for block in chain[1:common]:
+                    for t in block['transactions']:
+                        self.apply_transaction(t['sender'], t['recipient'], t['amount'], forks[common],
+                                               self.is_minting(t['sender']))
+            unspent = state.BalanceOverlay(forks[common])
+
+        blocks = []
+        undo = []
+        window = []
+        last_block = chain[common - 1] if common else None
+        try:
+            # Streamed one block per line, validated a window at a time as it arrives
+            response = self.peers.get(node, '/chain', params={'after': common, 'limit': length - common,
+                                                              'format': 'ndjson'}, stream=True)
+        except peers.PeerError:
+            return None
+        with response:
+            if response.status_code != 200:
+                return None
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                block = json.loads(line)
+                if last_block is None:
+                    # Nothing is shared, the neighbour's genesis block is taken as is
+                    if not self.seal(block):
+                        return None
+                    last_block = block
+                    blocks.append(block)
+                    undo.append({})
+                    continue
+                window.append(block)
+                if len(window) == SYNC_WINDOW or common + len(blocks) + len(window) == length:
+                    if not self.valid_blocks(last_block, window, unspent, undo, self.ancestors(chain, common, blocks)):
+                        return None
+                    blocks.extend(window)
+                    last_block = blocks[-1]
+                    window = []
+
+        if window or common + len(blocks) < length:
+            return None
+        return common, blocks, unspent, undo
+
     def new_transaction(self, sender, recipient, amount, signature):
         """
         Creates a new transaction to go into the next mined Block
@@ -260,17 +830,132 @@ class Blockchain(object):
         :param recipient: <str> Address of the Recipient
         :param amount: <int> Amount
         :param signature: <str> Proof of the Sender
-        :return: <int> The index of the Block that will hold this transaction
+        :return: <int> The index of the Block that will hold this transaction,
+                 None if the mempool refused it
+        """
+        with self.pending_lock:
+            added, evicted = self.mempool.add({
+                'sender': sender,
+                'recipient': recipient,
+                'amount': amount,
+                'signature': signature
+            })
+            if not added:
+                # Its amount was already applied to pending_unspent
+                self.rebuild_pending()
+                return None
+            self.amount+=amount
+            if evicted:
+                self.rebuild_pending()
+
+            return self.last_block['index'] + 1
+
+    def new_transactions(self, transactions):
+        """
+        Validates a batch of transactions in one pass against pending_unspent and adds the valid ones
+
+        Signatures are checked without holding a lock, so intake from many
+        requests only serialises on the balance checks.
+
+        :param transactions: <list> Transactions with sender, recipient, amount and signature
+        :return: <list> <str> Per transaction 'accepted', 'duplicate', 'invalid',
+                 or 'rejected' if the mempool is full and refuses new transactions
+        """
+        results = []
+        fresh = []
+        txids = []
+        seen = set()
+        for t in transactions:
+            txid = mempool.transaction_id(t)
+            txids.append(txid)
+            if txid in seen or txid in self.mempool:
+                results.append('duplicate')
+            else:
+                seen.add(txid)
+                results.append(None)
+                fresh.append(t)
+
+        # Check all signatures at once, then apply the amounts in order
+        signed = iter(self.verifier.verify(fresh))
+        with self.pending_lock:
+            for i, t in enumerate(transactions):
+                if results[i] is not None:
+                    continue
+                if not next(signed):
+                    results[i] = 'invalid'
+                elif txids[i] in self.mempool:
+                    # Added by another request since the check above
+                    results[i] = 'duplicate'
+                elif self.mempool.full():
+                    results[i] = 'rejected'
+                elif self.apply_verified(t, self.pending_unspent):
+                    added = self.new_transaction(t['sender'], t['recipient'], t['amount'], t['signature'])
+                    results[i] = 'accepted' if added is not None else 'rejected'
+                else:
+                    results[i] = 'invalid'
+        return results
+
+    def rebuild_pending(self):
+        """
+        Recomputes pending_unspent from unspent and the pending transactions,
+        dropping the ones that no longer go through, Eg. after an eviction
+
+        :return: None
+        """
+        with self.pending_lock:
+            self.pending_unspent = state.BalanceOverlay(self.unspent)
+            # Their signatures were checked when they arrived
+            for t in self.mempool.transactions():
+                if (not self.apply_verified(t, self.pending_unspent)):
+                    self.mempool.remove(mempool.transaction_id(t))
+
+    def update_pending(self, transactions):
+        """
+        Brings pending_unspent up to date with a block just committed to unspent, like
+        rebuild_pending would. Only the pending transactions linked to the accounts of
+        the block, through the accounts they touch in turn, are applied again
+
+        :param transactions: <list> Transactions of the block, already removed from the mempool
+        :return: None
         """
-        self.amount+=amount
-        self.current_transactions.append({
-            'sender': sender,
-            'recipient': recipient,
-            'amount': amount,
-            'signature': signature
-        })
+        with self.pending_lock:
+            changes = self.pending_unspent.changes
+            received = {t['recipient'] for t in transactions}
+            # Mints depend on whether the minting key holds coins, a change to it affects all of them
+            if any(self.mints(key) for key in received):
+                self.rebuild_pending()
+                return
+            keys = received | {t['sender'] for t in transactions}
+            # Accounts without pending transactions read their new balance through to unspent
+            frontier = {key for key in keys if key in changes}
+            seen = set(frontier)
+            linked = set()
+            while frontier:
+                minting = {key for key in frontier if self.mints(key)}
+                if any(key in changes for key in minting):
+                    self.rebuild_pending()
+                    return
+                # Otherwise a mint leaves the minting key as it is, and links nothing through it
+                linked |= frontier - minting
+                frontier = {key for t in self.mempool.touching(frontier - minting)
+                            for key in (t['sender'], t['recipient']) if key not in seen}
+                seen |= frontier
+            if not linked:
+                return
+
+            for key in linked:
+                changes.pop(key, None)
+            # Their signatures were checked when they arrived
+            for t in self.mempool.touching(linked):
+                if (not self.apply_verified(t, self.pending_unspent)):
+                    self.mempool.remove(mempool.transaction_id(t))
 
-        return self.last_block['index'] + 1
+    @property
+    def current_transactions(self):
+        """
+        :return: <list> Pending transactions, oldest first
+        """
+        return self.mempool.transactions()
 
     @property
     def last_block(self):
@@ -282,43 +967,180 @@ class Blockchain(object):
         """
         Creates a SHA-256 hash of a Block
 
+        Only the header is hashed, the transactions are covered by its merkle
+        root. A block sealed with seal carries its hash, which is returned as is.
+
         :param block: <dict> Block
         :return: <str>
         """
+        if 'hash' in block:
+            return block['hash']
+        merkle_root = block.get('merkle_root') or Blockchain.merkle_root(block['transactions'])
+        return Blockchain.header_hash(block, merkle_root)
+
+    @staticmethod
+    def header_hash(block, merkle_root):
+        """
+        :param block: <dict> Block
+        :param merkle_root: <str> Merkle root of the block's transactions
+        :return: <str> SHA-256 hash of the block's header
+        """
+        # Blocks stored before targets were added have none
+        header = {field: block[field] for field in HEADER_FIELDS if field in block}
+        header['merkle_root'] = merkle_root
+        started = perf_counter()
         # We must make sure that the Dictionary is Ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        header_string = json.dumps(header, sort_keys=True).encode()
+        digest = hashlib.sha256(header_string).hexdigest()
+        HEADER_HASHES.inc()
+        HEADER_HASH_SECONDS.inc(perf_counter() - started)
+        return digest
+
+    @staticmethod
+    def well_formed(transactions):
+        """
+        Whether the transactions of a block from another node have the fields a transaction needs
+
+        :param transactions: The transactions of the block, records for a block we kept, see records
+        :return: <bool>
+        """
+        if not isinstance(transactions, (list, tuple)):
+            return False
+        for t in transactions:
+            if (not isinstance(t, Mapping) or not all(isinstance(t.get(k), str) for k in ('sender', 'recipient', 'signature'))
+                    or not isinstance(t.get('amount'), int) or isinstance(t['amount'], bool)):
+                return False
+        return True
 
+    @staticmethod
+    def has_duplicates(transactions):
+        """
+        Whether a transaction appears twice in a block
 
-    def proof_of_work(self,last_proof):
+        merkle_root pairs the last node of an odd level with itself, so a block
+        with its last transactions repeated has the hash of the block without
+        them. Such blocks are rejected, so a hash stands for one list of transactions.
+
+        :param transactions: <list> Transactions of the block
+        :return: <bool>
+        """
+        ids = {mempool.transaction_id(t) for t in transactions}
+        return len(ids) != len(transactions)
+
+    @staticmethod
+    def merkle_root(transactions):
+        """
+        Creates the root of a Merkle tree over the transactions of a block
+
+        :param transactions: <list> Transactions of the block
+        :return: <str>
+        """
+        level = [hashlib.sha256(json.dumps(t, sort_keys=True, default=records.to_json).encode()).digest() for t in transactions]
+        if not level:
+            return hashlib.sha256(b'').hexdigest()
+        while len(level) > 1:
+            if len(level) % 2:
+                level.append(level[-1])
+            level = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+        return level[0].hex()
+
+    @staticmethod
+    def seal(block):
+        """
+        Computes the merkle root and hash of a block from its contents and stores them on it,
+        so later calls to hash cost O(1)
+
+        :param block: <dict> Block, Eg. one received from another node
+        :return: <bool> False if the block claims a different merkle root or hash
+        """
+        merkle_root = Blockchain.merkle_root(block['transactions'])
+        digest = Blockchain.header_hash(block, merkle_root)
+        if block.get('merkle_root', merkle_root) != merkle_root or block.get('hash', digest) != digest:
+            return False
+        block['merkle_root'] = merkle_root
+        block['hash'] = digest
+        return True
+
+
+    def proof_of_work(self,last_proof,target=None,stopped=None):
         """
         Simple Proof of Work Algorithm:
-        - Find a number p' such that hash(pp') contains leading 4 zeroes, where p is the previous p'
+        - Find a number p' such that hash(pp') is below the target, where p is the previous p'
         -p is the previous proof, and p' is the new proof
+        The search is spread over a process pool, see miner.ProofMiner
 
         :param last_proof: <int>
-        :return: <int>
+        :param target: (Optional) <str> Target of the block, defaults to the one of the next block
+        :param stopped: (Optional) Function returning True to give up the search, see miner.ProofMiner.search
+        :return: <int>, None if the search was cancelled
         """
-
-        proof = 0
-        while self.valid_proof(last_proof, proof) is False:
-            proof +=1
-
+        if target is None:
+            target = self.next_target(self.last_block)
+        started = perf_counter()
+        proof = self.miner.search(last_proof, bytes.fromhex(target), stopped)
+        elapsed = perf_counter() - started
+        POW_HASHES.inc(self.miner.hashes)
+        if elapsed > 0:
+            POW_HASH_RATE.set(self.miner.hashes / elapsed)
+        if proof is not None:
+            POW_SECONDS.observe(elapsed)
         return proof
 
     @staticmethod
-    def valid_proof(last_proof, proof):
+    def valid_proof(last_proof, proof, target=INITIAL_TARGET):
         """
-        Validates the Proof: Does hash(last_proof, proof) contain 4 leading zeros?
+        Validates the Proof: Is hash(last_proof, proof) below the target?
+        The initial target means 4 leading zeros.
         
         :param last_proof: <int> Previous Proof
         :param proof: <int> Current Proof
+        :param target: <str> Target of the block, as 64 hex digits
         :return: <bool> True if correct, False if not.
         """
-
+        try:
+            target = bytes.fromhex(target)
+        except (TypeError, ValueError):
+            return False
         guess = f'{last_proof}{proof}'.encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[:4] =="0000"
+        return len(target) == 32 and hashlib.sha256(guess).digest() < target
+
+    def next_target(self, last_block, ancestor=None):
+        """
+        Proof of work target of the block after last_block
+
+        Every retarget_interval blocks the target is scaled by how long the
+        last blocks took compared to block_interval, by at most MAX_RETARGET
+        either way, so block times follow the hash rate of the network.
+
+        :param last_block: <dict> The block before the new one
+        :param ancestor: (Optional) Function giving the block at an index of last_block's
+                         branch, see ancestors. Defaults to the blocks of our chain
+        :return: <str> The target, as 64 hex digits
+        """
+        target = int(last_block.get('target', self.initial_target), 16)
+        if last_block['index'] % self.retarget_interval:
+            return f'{target:064x}'
+        if ancestor is None:
+            ancestor = self.ancestors(self.chain, len(self.chain), [])
+        first = ancestor(max(1, last_block['index'] - self.retarget_interval))
+        # In milliseconds, so every node gets the same integer result
+        expected = round((last_block['index'] - first['index']) * self.block_interval * 1000)
+        if expected <= 0:
+            return f'{target:064x}'
+        actual = round((last_block['timestamp'] - first['timestamp']) * 1000)
+        actual = min(max(actual, expected // MAX_RETARGET), expected * MAX_RETARGET)
+        target = min(max(target * actual // expected, 1), MAX_TARGET)
+        return f'{target:064x}'
+
+    @staticmethod
+    def ancestors(chain, common, blocks):
+        """
+        :param chain: <list> A chain
+        :param common: <int> Number of its blocks a branch shares
+        :param blocks: <list> Blocks of the branch after them
+        :return: Function giving the block of the branch at an index
+        """
+        return lambda index: chain[index - 1] if index <= common else blocks[index - common - 1]
    
     def test_transaction(self, last_transaction):
         """
@@ -327,7 +1149,4 @@ class Blockchain(object):
         :param last_transaction: <dict> Previous Transaction
         :return: <bool> True if transaction id is unique, false otherwise
         """
-        for t in self.current_transactions:
-            if t['sender'] == last_transactions['sender'] and t['recipient'] == last_transactions['recipient'] and t['amount'] == last_transactions['amount']:
-                return False
-        return True
+        return mempool.transaction_id(last_transaction) not in self.mempool
@@ -0,0 +1,106 @@
+# Blocks this far below the best tip are forgotten, side branches can only fork above that
+MAX_REORG_DEPTH = 1000
+
+
+class BlockTree(object):
+    def __init__(self, max_depth=MAX_REORG_DEPTH):
+        """
+        Recent blocks of the main chain and of competing side branches, keyed by hash
+
+        Main chain blocks keep the undo record of their balance changes, so the
+        chain can be rolled back to a fork point in O(fork depth).
+
+        :param max_depth: <int> Number of blocks below the tip that are kept
+        """
+        self.max_depth = max_depth
+        self.blocks = {}
+        # Hash to undo record, see BalanceOverlay.commit
+        self.undo = {}
+        # Block index to the hashes of the blocks at that height
+        self._heights = {}
+        self._pruned = 0
+
+    def __contains__(self, block_hash):
+        return block_hash in self.blocks
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def get(self, block_hash):
+        return self.blocks.get(block_hash)
+
+    def add(self, block, undo=None):
+        """
+        Adds a sealed block, forgetting the ones that fell more than max_depth below it
+
+        :param block: <dict> Block with its hash
+        :param undo: (Optional) <dict> Undo record, for a block added to the main chain
+        :return: None
+        """
+        block_hash = block['hash']
+        if block_hash not in self.blocks:
+            self.blocks[block_hash] = block
+            self._heights.setdefault(block['index'], []).append(block_hash)
+        if undo is not None:
+            self.undo[block_hash] = undo
+        self._prune(block['index'] - self.max_depth)
+
+    def remove(self, block_hash):
+        """
+        Forgets a block, Eg. one that turned out invalid
+        """
+        block = self.blocks.pop(block_hash, None)
+        self.undo.pop(block_hash, None)
+        if block is not None:
+            self._heights[block['index']].remove(block_hash)
+
+    def detach(self, blocks):
+        """
+        Keeps blocks that left the main chain as a side branch, without their undo records
+
+        :param blocks: <list> The blocks
+        :return: None
+        """
+        for block in blocks:
+            self.undo.pop(block['hash'], None)
+
+    def branch(self, block_hash, chain):
+        """
+        Walks back from a block to the main chain
+
+        :param block_hash: <str> Hash of a known block
+        :param chain: <list> The main chain
+        :return: <tuple> (number of blocks shared with chain, <list> blocks of the branch after them),
+                 None if the branch reaches a block we don't have
+        """
+        blocks = []
+        block = self.blocks.get(block_hash)
+        while block is not None:
+            index = block['index']
+            if index <= len(chain) and chain[index - 1]['hash'] == block['hash']:
+                blocks.reverse()
+                return index, blocks
+            blocks.append(block)
+            block = self.blocks.get(block['previous_hash'])
+        return None
+
+    def rollback(self, blocks, unspent):
+        """
+        Stages the balances as they were before blocks of the main chain
+
+        :param blocks: <list> The last blocks of the main chain, in chain order
+        :param unspent: <BalanceOverlay> Balances after the last of blocks, updated in place
+        :return: <bool> False if some block has no undo record, Eg. it is too deep
+        """
+        if not all(block['hash'] in self.undo for block in blocks):
+            return False
+        for block in reversed(blocks):
+            unspent.update(self.undo[block['hash']])
+        return True
+
+    def _prune(self, height):
+        while self._pruned < height:
+            self._pruned += 1
+            for block_hash in self._heights.pop(self._pruned, ()):
+                self.blocks.pop(block_hash, None)
+                self.undo.pop(block_hash, None)
@@ -0,0 +1,317 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from time import monotonic, sleep
+import blockchain as bc
+import mempool
+import metrics
+import peers
+
+# Kinds of items spread by gossip
+KINDS = ('transactions', 'blocks')
+# Hex digits of a transaction id or block hash announced to peers
+SHORT_ID_LENGTH = 16
+# Seconds new ids are held back so they go out together, blocks are announced at once
+FLUSH_INTERVAL = 0.05
+# Most ids of a kind in one announcement
+MAX_ANNOUNCE = 1000
+# Ids remembered as seen, so they are fetched and announced once, and for how many seconds
+SEEN_SIZE = 200000
+SEEN_TTL = 600
+# Announced items kept for peers to fetch, and for how many seconds
+INVENTORY_SIZE = 100000
+INVENTORY_TTL = 300
+# Fetches from peers in flight at once
+FETCH_WORKERS = 4
+# Blocks kept until the block they follow arrives, and for how many seconds
+ORPHAN_SIZE = 100
+ORPHAN_TTL = 120
+
+ANNOUNCED = metrics.counter('educoin_gossip_announced_total', 'Ids announced to peers, by kind', ('kind',))
+FETCHED = metrics.counter('educoin_gossip_fetched_total', 'Items fetched after an announcement, by kind', ('kind',))
+SUPPRESSED = metrics.counter('educoin_gossip_suppressed_total',
+                             'Announced ids not fetched because they were seen before, by kind', ('kind',))
+
+
+def short_id(full_id):
+    """
+    :param full_id: <str> Transaction id or block hash, as hex
+    :return: <str> The prefix announced to peers
+    """
+    return full_id[:SHORT_ID_LENGTH]
+
+
+def block_id(block):
+    """
+    :param block: <dict> A block from a peer
+    :return: <str> Its hash, computed from its contents whatever hash it claims, None if it is malformed
+    """
+    try:
+        return bc.Blockchain.header_hash(block, bc.Blockchain.merkle_root(block['transactions']))
+    except (KeyError, TypeError):
+        return None
+
+
+class ExpiringCache(object):
+    def __init__(self, max_size, ttl):
+        """
+        Values by key, each dropped ttl seconds after it was added or once max_size newer keys are in
+
+        :param max_size: <int> Keys kept at most
+        :param ttl: <float> Seconds a key is kept
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # Key to (expiry, value), oldest first
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None and entry[0] > monotonic() else None
+
+    def add(self, key, value=None):
+        """
+        :param key: The key
+        :param value: (Optional) Its value
+        :return: <bool> True if the key was not there yet
+        """
+        now = monotonic()
+        while self._entries:
+            oldest, (expiry, _) = next(iter(self._entries.items()))
+            if expiry > now:
+                break
+            del self._entries[oldest]
+        if key in self._entries:
+            return False
+        self._entries[key] = (now + self.ttl, value)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return True
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+
+class Gossip(object):
+    def __init__(self, client, nodes, receive_transactions, receive_block, has_block, flush_interval=FLUSH_INTERVAL):
+        """
+        Spreads new transactions and blocks by announcing their short ids in batches,
+        peers fetch only the items they lack from the node that announced them
+
+        :param client: <PeerClient> Talks to the other nodes
+        :param nodes: Called as nodes() for the addresses of the peers to announce to
+        :param receive_transactions: Called with fetched transactions, returns the result of each like
+                                     Blockchain.new_transactions: 'accepted', 'duplicate', 'invalid'...
+        :param receive_block: Called with a fetched block, returns its hash if accepted, else None
+        :param has_block: Called with a block hash, whether the block is known so a block can follow it
+        :param flush_interval: <float> Seconds new ids are held back to be announced together
+        """
+        self.client = client
+        self.nodes = nodes
+        self.receive_transactions = receive_transactions
+        self.receive_block = receive_block
+        self.has_block = has_block
+        self.flush_interval = flush_interval
+        # Our address, Eg. '192.168.0.5:5000', peers fetch the items we announce from it
+        self.address = None
+        self.seen = ExpiringCache(SEEN_SIZE, SEEN_TTL)
+        self.inventory = ExpiringCache(INVENTORY_SIZE, INVENTORY_TTL)
+        # Hash of a missing block to the (node, block) pairs that follow it
+        self.orphans = ExpiringCache(ORPHAN_SIZE, ORPHAN_TTL)
+        # Node to kind to ids not announced yet
+        self._outgoing = {}
+        self._lock = Condition()
+        self._executor = ThreadPoolExecutor(FETCH_WORKERS, thread_name_prefix='gossip')
+        self._flusher = None
+
+    def announce_transactions(self, transactions, exclude=()):
+        """
+        :param transactions: <list> Transactions new to us
+        :param exclude: Addresses of nodes that already have them
+        """
+        self._announce('transactions', {mempool.transaction_id(t): t for t in transactions}, exclude)
+
+    def announce_block(self, block_hash, block, exclude=()):
+        """
+        :param block_hash: <str> Hash of a block new to us
+        :param block: <dict> The block
+        :param exclude: Addresses of nodes that already have it
+        """
+        self._announce('blocks', {block_hash: block}, exclude)
+        # Mining on a stale tip wastes work, blocks don't wait for the next batch
+        self.flush()
+
+    def _announce(self, kind, items, exclude):
+        if not items:
+            return
+        with self._lock:
+            ids = []
+            for full_id, item in items.items():
+                key = short_id(full_id)
+                self.seen.add(key)
+                self.inventory.add(key, item)
+                ids.append(key)
+            for node in self.nodes():
+                if node not in exclude:
+                    self._outgoing.setdefault(node, {k: [] for k in KINDS})[kind].extend(ids)
+            if self._flusher is None:
+                self._flusher = Thread(target=self._run, name='gossip-flush', daemon=True)
+                self._flusher.start()
+            self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._outgoing:
+                    self._lock.wait()
+            # Let more ids gather before sending
+            sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the queued announcements now, at most MAX_ANNOUNCE ids of a kind per request
+
+        :return: None
+        """
+        with self._lock:
+            outgoing, self._outgoing = self._outgoing, {}
+        for node, inventory in outgoing.items():
+            while any(inventory.values()):
+                document = {'node': self.address}
+                for kind in KINDS:
+                    document[kind] = inventory[kind][:MAX_ANNOUNCE]
+                    inventory[kind] = inventory[kind][MAX_ANNOUNCE:]
+                    ANNOUNCED.inc(len(document[kind]), kind=kind)
+                self.client.broadcast([node], '/nodes/inventory', document=document, wait_for=False)
+
+    def announced(self, node, inventory):
+        """
+        Handles an announcement: ids not seen before are fetched in the background
+
+        :param node: <str> Address of the announcing node, items are fetched from it
+        :param inventory: <dict> Kind to short ids
+        :return: <dict> Kind to the ids that will be fetched
+        """
+        wanted = {}
+        with self._lock:
+            for kind in KINDS:
+                ids = [key for key in inventory.get(kind) or () if isinstance(key, str)]
+                # Marked as seen right away so other announcements of them are not fetched too
+                fresh = [key for key in ids if self.seen.add(key)]
+                SUPPRESSED.inc(len(ids) - len(fresh), kind=kind)
+                if fresh:
+                    wanted[kind] = fresh
+        if wanted:
+            self._executor.submit(self._fetch, node, wanted)
+        return wanted
+
+    def lookup(self, wanted):
+        """
+        :param wanted: <dict> Kind to short ids
+        :return: <dict> Kind to short id to item, for the items we still have
+        """
+        found = {kind: {} for kind in KINDS}
+        with self._lock:
+            for kind in KINDS:
+                for key in wanted.get(kind) or ():
+                    item = self.inventory.get(key) if isinstance(key, str) else None
+                    if item is not None:
+                        found[kind][key] = item
+        return found
+
+    def _fetch(self, node, wanted):
+        try:
+            response = self.client.post(node, '/nodes/inventory/get', document=wanted)
+            items = self.client.read(response) if response.status_code == 200 else {}
+        except (peers.PeerError, ValueError):
+            items = {}
+
+        transactions = []
+        for key, t in (items.get('transactions') or {}).items():
+            try:
+                matches = short_id(mempool.transaction_id(t)) == key
+            except (KeyError, TypeError):
+                matches = False
+            if matches and key in wanted.get('transactions', ()):
+                transactions.append(t)
+        blocks = []
+        for key, block in (items.get('blocks') or {}).items():
+            if key in wanted.get('blocks', ()) and isinstance(block, dict):
+                block_hash = block_id(block)
+                if block_hash is not None and short_id(block_hash) == key:
+                    blocks.append((key, block))
+        FETCHED.inc(len(transactions), kind='transactions')
+        FETCHED.inc(len(blocks), kind='blocks')
+
+        # Ids the node did not send can be fetched from the next node announcing them
+        fetched = {short_id(mempool.transaction_id(t)) for t in transactions} | {key for key, _ in blocks}
+        with self._lock:
+            for kind in KINDS:
+                for key in wanted.get(kind, ()):
+                    if key not in fetched:
+                        self.seen.discard(key)
+
+        if transactions:
+            results = self.receive_transactions(transactions)
+            # One refused can go through later, Eg. once the transaction paying its sender arrived
+            with self._lock:
+                for t, result in zip(transactions, results):
+                    if result not in ('accepted', 'duplicate'):
+                        self.seen.discard(short_id(mempool.transaction_id(t)))
+            self.announce_transactions([t for t, result in zip(transactions, results) if result == 'accepted'],
+                                       exclude={node})
+        for _, block in blocks:
+            self._receive(node, block)
+
+    def _receive(self, node, block):
+        """
+        Adds a fetched block, or keeps it until the block it follows arrives
+
+        Blocks are fetched concurrently, so a block can come before its parent.
+        The parent is asked for from the same node, which announced it before.
+
+        :param node: <str> Address of the node the block came from
+        :param block: <dict> The block
+        """
+        block_hash = self.receive_block(block)
+        if block_hash is not None:
+            self.announce_block(block_hash, block, exclude={node})
+            self._adopt(block_hash)
+            return
+
+        parent = block.get('previous_hash')
+        if not isinstance(parent, str) or self.has_block(parent):
+            return
+        with self._lock:
+            waiting = self.orphans.get(parent)
+            if waiting is None:
+                waiting = []
+                self.orphans.add(parent, waiting)
+            waiting.append((node, block))
+            wanted = {'blocks': [short_id(parent)]}
+            fetch = self.seen.add(wanted['blocks'][0])
+        if fetch:
+            self._executor.submit(self._fetch, node, wanted)
+        # The parent may have been added while the block was being checked
+        if self.has_block(parent):
+            self._adopt(parent)
+
+    def _adopt(self, block_hash):
+        """
+        Adds the blocks that were waiting for a block that was just added
+
+        :param block_hash: <str> Hash of the block
+        """
+        with self._lock:
+            waiting = self.orphans.get(block_hash) or []
+            self.orphans.discard(block_hash)
+        for node, block in waiting:
+            self._receive(node, block)
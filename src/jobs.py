@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from threading import Lock, Thread
+from time import time
+from uuid import uuid4
+
+# How many finished jobs are kept around for status queries
+MAX_FINISHED_JOBS = 100
+
+
+class MiningJob(object):
+    def __init__(self):
+        self.id = uuid4().hex
+        self.status = 'running'
+        self.started = time()
+        self.finished = None
+        # Nonces tried by searches that already returned
+        self.hashes = 0
+        # Number of times the search moved to a new chain tip
+        self.restarts = 0
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.restart = False
+        self.searching = False
+
+    def to_dict(self, running_hashes=0):
+        """
+        Status of the job for the API
+
+        :param running_hashes: <int> Nonces tried so far by the search in progress
+        :return: <dict>
+        """
+        hashes = self.hashes + running_hashes
+        elapsed = (self.finished or time()) - self.started
+        return {
+            'id': self.id,
+            'status': self.status,
+            'started': self.started,
+            'finished': self.finished,
+            'nonces_tried': hashes,
+            'hash_rate': hashes / elapsed if elapsed > 0 else 0,
+            'restarts': self.restarts,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class MiningJobs(object):
+    def __init__(self, blockchain, prepare, forge):
+        """
+        Runs proof of work in a background thread, one job at a time
+
+        :param blockchain: <Blockchain> The chain to mine on
+        :param prepare: Called as prepare() before each search. Returns the BlockTemplate
+                        to find a proof for, or raises ValueError to fail the job
+        :param forge: Called as forge(template, proof) once a proof is found.
+                      Returns the result to report, None if the template no longer
+                      follows the tip, or raises ValueError to fail the job
+        """
+        self.blockchain = blockchain
+        self.prepare = prepare
+        self.forge = forge
+        self.jobs = OrderedDict()
+        self.active = None
+        self._lock = Lock()
+
+    def start(self):
+        """
+        Starts a mining job, or returns the one already running
+
+        :return: <MiningJob>
+        """
+        with self._lock:
+            if self.active is not None:
+                return self.active
+            job = MiningJob()
+            self.jobs[job.id] = job
+            self.active = job
+            while len(self.jobs) > MAX_FINISHED_JOBS + 1:
+                self.jobs.popitem(last=False)
+        Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def status(self, job):
+        """
+        :param job: <MiningJob>
+        :return: <dict> Status of the job including the search in progress
+        """
+        running = self.blockchain.miner.hashes if job.searching else 0
+        return job.to_dict(running)
+
+    def cancel(self, job):
+        """
+        Stops a running job
+
+        :param job: <MiningJob>
+        """
+        with self._lock:
+            if job is self.active:
+                job.cancelled = True
+                self.blockchain.miner.cancel()
+
+    def restart(self):
+        """
+        Moves the running job onto the current chain tip, used when a new block arrives
+        """
+        with self._lock:
+            if self.active is not None:
+                self.active.restart = True
+                self.blockchain.miner.cancel()
+
+    def _run(self, job):
+        try:
+            while True:
+                template = self.prepare()
+                last_block = template.last_block
+                job.searching = True
+                # The flags and not only miner.cancel, which is lost if it lands before the search starts
+                proof = self.blockchain.proof_of_work(last_block['proof'], template.target,
+                                                      lambda: job.cancelled or job.restart)
+                job.hashes += self.blockchain.miner.hashes
+                job.searching = False
+                if job.cancelled:
+                    job.status = 'cancelled'
+                    return
+                # Don't forge on top of a block that is no longer the tip
+                if proof is None or job.restart or self.blockchain.last_block is not last_block:
+                    job.restart = False
+                    job.restarts += 1
+                    continue
+                result = self.forge(template, proof)
+                if result is None:
+                    job.restarts += 1
+                    continue
+                job.result = result
+                job.status = 'done'
+                return
+        except ValueError as e:
+            job.status = 'failed'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'failed'
+            job.error = repr(e)
+        finally:
+            job.finished = time()
+            with self._lock:
+                self.active = None
@@ -0,0 +1,96 @@
+import os
+from threading import Lock
+import rsa
+
+# Bits of a generated node key, the same as the keys students get
+KEY_BITS = 512
+# File the node key pair is kept in, inside the data directory
+KEY_FILE = 'node_key.pem'
+# Public key of the creator, whose transactions mint new coins. Found from the
+# location of this file, so nodes started from any directory read the same key
+CREATOR_KEY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'Creator_Keys', 'pub_key')
+
+_creator_key = None
+
+
+def creator_key():
+    """
+    :return: <PublicKey> The creator's public key, read from CREATOR_KEY_FILE the first time
+    """
+    global _creator_key
+    if _creator_key is None:
+        with open(CREATOR_KEY_FILE, 'r') as f:
+            _creator_key = rsa.PublicKey.load_pkcs1(f.read())
+    return _creator_key
+
+
+def load_or_create(path, bits=KEY_BITS):
+    """
+    :param path: <str> File holding a private key in PKCS#1 PEM, generated and saved there if missing
+    :param bits: <int> Size of a generated key
+    :return: <tuple> (PublicKey, PrivateKey)
+    """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            priv_key = rsa.PrivateKey.load_pkcs1(f.read())
+        return rsa.PublicKey(priv_key.n, priv_key.e), priv_key
+
+    pub_key, priv_key = rsa.newkeys(bits)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Readable by the owner only, and in place whole or not at all
+    tmp = path + '.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(priv_key.save_pkcs1())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return pub_key, priv_key
+
+
+class NodeKeys(object):
+    def __init__(self, path=None, bits=KEY_BITS):
+        """
+        The node's key pair, mining rewards are paid to its public key. Loaded or
+        generated on first use, so a node does not wait for a key to start serving
+
+        :param path: (Optional) <str> File the key pair is kept in, see load_or_create. Can be
+                     set until the keys are first used. Without one the node gets new keys every run
+        :param bits: <int> Size of a generated key
+        """
+        self.path = path
+        self.bits = bits
+        self._keys = None
+        self._address = None
+        self._lock = Lock()
+
+    def _load(self):
+        if self._keys is None:
+            with self._lock:
+                if self._keys is None:
+                    if self.path is None:
+                        keys = rsa.newkeys(self.bits)
+                    else:
+                        keys = load_or_create(self.path, self.bits)
+                    self._address = keys[0].save_pkcs1().decode('UTF-8')
+                    self._keys = keys
+        return self._keys
+
+    @property
+    def public_key(self):
+        return self._load()[0]
+
+    @property
+    def private_key(self):
+        return self._load()[1]
+
+    @property
+    def address(self):
+        """
+        :return: <str> The public key in PEM text, the node's address on the chain
+        """
+        self._load()
+        return self._address
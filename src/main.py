@@ -1,13 +1,45 @@
+import logging
 import sys
+import readers
 import routes
 
+# Optional '--log-level <level>', Eg. '--log-level debug' to follow block validation
+level = 'warning'
+if '--log-level' in sys.argv[:-1]:
+    i = sys.argv.index('--log-level')
+    level = sys.argv[i + 1]
+    del sys.argv[i:i + 2]
+
+# Optional '--key-file <path>', where the node's keys are kept when there is no data directory
+key_file = None
+if '--key-file' in sys.argv[:-1]:
+    i = sys.argv.index('--key-file')
+    key_file = sys.argv[i + 1]
+    del sys.argv[i:i + 2]
+
+# Optional '--workers <n>', serves reads from n processes next to the one that changes the chain
+workers = 0
+if '--workers' in sys.argv[:-1]:
+    i = sys.argv.index('--workers')
+    workers = int(sys.argv[i + 1])
+    del sys.argv[i:i + 2]
+
 if (len(sys.argv) < 3):
-    print ("usage: python main.py <host-address> <port>")
+    print ("usage: python main.py <host-address> <port> [data-directory] [--log-level <level>] [--key-file <path>] [--workers <n>]")
     sys.exit()
 
 portn=int(sys.argv[2])
 addr = sys.argv[1]
+# Without a data directory the chain only lives in memory
+data_dir = sys.argv[3] if len(sys.argv) > 3 else None
+logging.basicConfig(level=level.upper(), format='%(asctime)s %(name)s %(levelname)s %(message)s')
 
 
 if __name__ == '__main__':
-	routes.main(addr,portn)
+	if workers:
+		if data_dir is None:
+			print ("--workers needs a data directory, the readers share the chain through it")
+			sys.exit()
+		readers.serve(addr,portn,data_dir,key_file,workers)
+	else:
+		routes.main(addr,portn,data_dir,key_file)
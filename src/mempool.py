@@ -0,0 +1,144 @@
+import hashlib
+from collections import OrderedDict
+
+# Pending transactions kept at most
+MAX_SIZE = 100000
+# Share of the pool dropped at once when it is full under the 'oldest' policy
+EVICT_FRACTION = 0.1
+
+
+def transaction_id(transaction):
+    """
+    Canonical id of a transaction: the SHA-256 of the message its sender signed
+
+    :param transaction: <dict> Transaction with sender, recipient and amount
+    :return: <str>
+    """
+    message = f"{transaction['sender']}{transaction['recipient']}{transaction['amount']}"
+    return hashlib.sha256(message.encode('UTF-8')).hexdigest()
+
+
+class Mempool(object):
+    def __init__(self, max_size=MAX_SIZE, policy='oldest'):
+        """
+        Pending transactions in arrival order, indexed by id, by sender and by recipient
+
+        :param max_size: <int> Transactions kept at most
+        :param policy: <str> What happens when the pool is full:
+                       'oldest' drops the oldest transactions, 'reject' refuses the new one
+        """
+        if policy not in ('oldest', 'reject'):
+            raise ValueError(f'Unknown eviction policy {policy}')
+        self.max_size = max_size
+        self.policy = policy
+        self._transactions = OrderedDict()
+        # Id to arrival number of the pending transactions of each key
+        self._by_sender = {}
+        self._by_recipient = {}
+        self._arrivals = 0
+        # Goes up with every change, so a copy of the pool can tell it is out of date
+        self.version = 0
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __contains__(self, txid):
+        return txid in self._transactions
+
+    def __iter__(self):
+        return iter(self._transactions.values())
+
+    def get(self, txid):
+        return self._transactions.get(txid)
+
+    def transactions(self):
+        """
+        :return: <list> Pending transactions, oldest first
+        """
+        return list(self._transactions.values())
+
+    def by_sender(self, sender):
+        """
+        :param sender: <str> The public key of the sender
+        :return: <list> Pending transactions sent by sender
+        """
+        return [self._transactions[txid] for txid in self._by_sender.get(sender, ())]
+
+    def touching(self, keys):
+        """
+        :param keys: <iterable> Public keys
+        :return: <list> Pending transactions sent or received by any of them, oldest first
+        """
+        found = {}
+        for key in keys:
+            found.update(self._by_sender.get(key, ()))
+            found.update(self._by_recipient.get(key, ()))
+        return [self._transactions[txid] for txid in sorted(found, key=found.get)]
+
+    def full(self):
+        """
+        :return: <bool> True if add refuses new transactions for now
+        """
+        return self.policy == 'reject' and len(self._transactions) >= self.max_size
+
+    def add(self, transaction):
+        """
+        Adds a transaction unless it is already pending
+
+        :param transaction: <dict> The transaction
+        :return: <tuple> (whether it was added, <list> transactions evicted to make room)
+        """
+        txid = transaction_id(transaction)
+        if txid in self._transactions:
+            return False, []
+        evicted = []
+        if len(self._transactions) >= self.max_size:
+            if self.policy == 'reject':
+                return False, []
+            count = max(1, int(self.max_size * EVICT_FRACTION))
+            for _ in range(count):
+                evicted.append(self._pop(next(iter(self._transactions))))
+        self._transactions[txid] = transaction
+        self._arrivals += 1
+        self._by_sender.setdefault(transaction['sender'], {})[txid] = self._arrivals
+        self._by_recipient.setdefault(transaction['recipient'], {})[txid] = self._arrivals
+        self.version += 1
+        return True, evicted
+
+    def remove(self, txid):
+        """
+        :param txid: <str> Id of the transaction
+        :return: <dict> The removed transaction, None if it was not pending
+        """
+        if txid not in self._transactions:
+            return None
+        return self._pop(txid)
+
+    def remove_included(self, transactions):
+        """
+        Removes the transactions of a block from the pool
+
+        :param transactions: <list> Transactions of the block
+        :return: <int> Number of transactions removed
+        """
+        removed = 0
+        for t in transactions:
+            if self.remove(transaction_id(t)) is not None:
+                removed += 1
+        return removed
+
+    def clear(self):
+        self._transactions.clear()
+        self._by_sender.clear()
+        self._by_recipient.clear()
+        self.version += 1
+
+    def _pop(self, txid):
+        transaction = self._transactions.pop(txid)
+        for index, key in ((self._by_sender, transaction['sender']), (self._by_recipient, transaction['recipient'])):
+            entries = index[key]
+            del entries[txid]
+            if not entries:
+                del index[key]
+        self.version += 1
+        return transaction
@@ -0,0 +1,165 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+from threading import Lock
+
+# Difficulty of the first blocks: four leading hex zeros, i.e. 16 leading zero bits.
+# Later blocks carry their own target, see Blockchain.next_target
+DIFFICULTY_BITS = 16
+# Number of nonces handed to a worker process at a time
+CHUNK_SIZE = 50000
+# How many nonces a worker tries between checks of the stop flag
+CHECK_INTERVAL = 4096
+
+# Set in each worker process by _init_worker
+_worker_stop = None
+
+
+def _init_worker(stop):
+    global _worker_stop
+    _worker_stop = stop
+
+
+def target_for(difficulty):
+    """
+    Turns a number of leading zero bits into the digest a proof has to be below
+
+    :param difficulty: <int> Number of leading zero bits, at least 1
+    :return: <bytes> 32 byte big endian target
+    """
+    return (1 << (256 - difficulty)).to_bytes(32, 'big')
+
+
+def search_range(last_proof, start, stop, target, stop_event=None):
+    """
+    Tight proof of work loop over [start, stop)
+
+    The SHA-256 state of the last proof is computed once and copied for every
+    guess, and the raw digest is compared against the target instead of
+    formatting and slicing a hex string, the same comparison valid_proof makes.
+
+    :param last_proof: <int> Previous Proof
+    :param start: <int> First nonce to try
+    :param stop: <int> Nonce to stop before
+    :param target: <bytes> 32 byte big endian target, Eg. from target_for
+    :param stop_event: (Optional) Event that aborts the search when set
+    :return: <tuple> (proof or None, number of nonces tried)
+    """
+    copy = hashlib.sha256(f'{last_proof}'.encode()).copy
+    nonce = start
+    while nonce < stop:
+        end = min(nonce + CHECK_INTERVAL, stop)
+        for proof in range(nonce, end):
+            h = copy()
+            h.update(b'%d' % proof)
+            if h.digest() < target:
+                return proof, proof - start + 1
+        nonce = end
+        if stop_event is not None and stop_event.is_set():
+            break
+    return None, nonce - start
+
+
+def _search_chunk(last_proof, start, stop, target):
+    return search_range(last_proof, start, stop, target, _worker_stop)
+
+
+class ProofMiner(object):
+    def __init__(self, workers=None, chunk_size=CHUNK_SIZE):
+        """
+        Splits the nonce space into chunks and searches them on a process pool
+
+        :param workers: (Optional) <int> Number of processes, defaults to the core count
+        :param chunk_size: <int> Nonces per chunk
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # Number of nonces tried by the current (or last) search
+        self.hashes = 0
+        self._stop = multiprocessing.Event()
+        self._cancelled = False
+        self._stopped = None
+        self._pool = None
+        self._lock = Lock()
+
+    def search(self, last_proof, target=None, stopped=None):
+        """
+        Finds a proof for last_proof, stopping every worker as soon as one has it
+
+        :param last_proof: <int> Previous Proof
+        :param target: (Optional) <bytes> 32 byte big endian target the hash has to be below,
+                       defaults to DIFFICULTY_BITS leading zero bits
+        :param stopped: (Optional) Function returning True once the caller no longer wants the proof,
+                        checked before the search starts and between chunks. Unlike cancel, it also
+                        covers a stop that comes in before the search starts
+        :return: <int> A valid proof, or None if the search was cancelled
+        """
+        with self._lock:
+            self.hashes = 0
+            self._cancelled = False
+            self._stop.clear()
+            self._stopped = stopped or (lambda: False)
+            if target is None:
+                target = target_for(DIFFICULTY_BITS)
+            if self.workers == 1:
+                return self._search_inline(last_proof, target)
+            return self._search_pool(last_proof, target)
+
+    def cancel(self):
+        """
+        Aborts a running search, which then returns None
+        """
+        self._cancelled = True
+        self._stop.set()
+
+    def close(self):
+        """
+        Shuts down the worker processes
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _done(self):
+        return self._cancelled or self._stopped()
+
+    def _search_inline(self, last_proof, target):
+        start = 0
+        while not self._done():
+            proof, tried = search_range(last_proof, start, start + self.chunk_size, target, self._stop)
+            self.hashes += tried
+            if proof is not None:
+                return proof
+            start += self.chunk_size
+        return None
+
+    def _search_pool(self, last_proof, target):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers, _init_worker, (self._stop,))
+
+        done = queue.Queue()
+        outstanding = 0
+        start = 0
+        found = None
+        # Keep two chunks queued per worker so nobody idles between chunks
+        while found is None and not self._done():
+            while outstanding < self.workers * 2:
+                self._pool.apply_async(_search_chunk, (last_proof, start, start + self.chunk_size, target),
+                                       callback=done.put, error_callback=lambda e: done.put((None, 0)))
+                start += self.chunk_size
+                outstanding += 1
+            proof, tried = done.get()
+            outstanding -= 1
+            self.hashes += tried
+            if proof is not None:
+                found = proof
+
+        # Tell the remaining workers to give up their chunks and wait for them
+        self._stop.set()
+        while outstanding:
+            self.hashes += done.get()[1]
+            outstanding -= 1
+        self._stop.clear()
+        return None if self._done() else found
@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+from time import monotonic
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+import wire
+
+# Seconds to wait for a peer to connect and to answer
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 10
+# Requests in flight to all peers at once
+MAX_WORKERS = 16
+# Connections kept open per peer
+CONNECTIONS_PER_PEER = 4
+# A peer that keeps failing is skipped for BACKOFF_BASE * 2^(failures - 1) seconds, at most BACKOFF_MAX
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+# Weight of the newest sample in the latency average
+LATENCY_SMOOTHING = 0.2
+
+REQUEST_SECONDS = metrics.histogram('educoin_peer_request_seconds',
+                                    'Time for a peer to answer a request, by path', ('path',))
+REQUEST_FAILURES = metrics.counter('educoin_peer_request_failures_total',
+                                   'Requests to peers that got no answer, by path', ('path',))
+
+
+class PeerError(Exception):
+    pass
+
+
+class PeerStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        # Moving average of successful request latency, in seconds
+        self.latency = None
+        self.backoff_until = 0
+        # Whether the peer understands the compact wire format
+        self.binary = False
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+            'latency': self.latency,
+            'backed_off': self.backoff_until > monotonic(),
+            'binary': self.binary,
+        }
+
+
+class PeerClient(object):
+    def __init__(self, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_workers=MAX_WORKERS):
+        """
+        Talks to other nodes over pooled connections, many peers at once
+
+        :param timeout: <tuple> Connect and read timeout in seconds
+        :param max_workers: <int> Requests in flight at once
+        """
+        self.timeout = timeout
+        self.sessions = {}
+        self.stats = {}
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='peers')
+        self._lock = Lock()
+
+    def session(self, node):
+        """
+        :param node: <str> Address of the node, Eg. '192.168.0.5:5000'
+        :return: <requests.Session> The pooled session of the node
+        """
+        with self._lock:
+            if node not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTIONS_PER_PEER)
+                session.mount('http://', adapter)
+                # Ask for the compact format, peers that don't know it answer with JSON
+                session.headers['Accept'] = f'{wire.MEDIA_TYPE}, application/json;q=0.9'
+                self.sessions[node] = session
+                self.stats[node] = PeerStats()
+            return self.sessions[node]
+
+    def available(self, node):
+        """
+        :param node: <str> Address of the node
+        :return: <bool> False while the node is backed off after failures
+        """
+        stats = self.stats.get(node)
+        return stats is None or stats.backoff_until <= monotonic()
+
+    def request(self, method, node, path, **kwargs):
+        """
+        Sends one request to a node and records how it went
+
+        :param method: <str> HTTP method
+        :param node: <str> Address of the node
+        :param path: <str> Path on the node, Eg. '/chain/tip'
+        :param document: (Optional) Body to send, in the compact format if the node understands it
+        :return: <requests.Response> The response, whatever its status code
+        :raises PeerError: If the node is backed off, unreachable or too slow
+        """
+        if not self.available(node):
+            raise PeerError(f'{node} is backed off')
+        session = self.session(node)
+        stats = self.stats[node]
+        kwargs.setdefault('timeout', self.timeout)
+        if 'document' in kwargs:
+            document = kwargs.pop('document')
+            if stats.binary:
+                kwargs['data'] = wire.encode(document)
+                kwargs['headers'] = {'Content-Type': wire.MEDIA_TYPE}
+            else:
+                kwargs['json'] = document
+        # Query strings would give every request its own time series
+        endpoint = path.split('?', 1)[0]
+        start = monotonic()
+        try:
+            response = session.request(method, f'http://{node}{path}', **kwargs)
+        except requests.exceptions.RequestException as e:
+            REQUEST_FAILURES.inc(path=endpoint)
+            with self._lock:
+                stats.requests += 1
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                backoff = BACKOFF_BASE * 2 ** (stats.consecutive_failures - 1)
+                stats.backoff_until = monotonic() + min(backoff, BACKOFF_MAX)
+            raise PeerError(f'{node}: {e}') from e
+        elapsed = monotonic() - start
+        REQUEST_SECONDS.observe(elapsed, path=endpoint)
+        with self._lock:
+            stats.binary = response.headers.get(wire.CAPABILITY_HEADER) == '1'
+            stats.requests += 1
+            stats.consecutive_failures = 0
+            stats.backoff_until = 0
+            if stats.latency is None:
+                stats.latency = elapsed
+            else:
+                stats.latency += LATENCY_SMOOTHING * (elapsed - stats.latency)
+        return response
+
+    def get(self, node, path, **kwargs):
+        return self.request('GET', node, path, **kwargs)
+
+    def post(self, node, path, **kwargs):
+        return self.request('POST', node, path, **kwargs)
+
+    @staticmethod
+    def read(response):
+        """
+        :param response: <requests.Response> Response of a node
+        :return: The body, decoded from JSON or the compact wire format
+        """
+        if response.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+            return wire.decode(response.content)
+        return response.json()
+
+    def broadcast(self, nodes, path, method='POST', wait_for=True, **kwargs):
+        """
+        Sends the same request to many nodes concurrently
+
+        :param nodes: Addresses of the nodes
+        :param path: <str> Path on every node
+        :param method: <str> HTTP method
+        :param wait_for: <bool> Wait for the answers, or fire and forget
+        :return: <dict> Node address to response, None for nodes that failed.
+                 Empty if wait_for is False
+        """
+        futures = {}
+        for node in nodes:
+            if self.available(node):
+                futures[node] = self._executor.submit(self.request, method, node, path, **kwargs)
+        if not wait_for:
+            return {}
+        wait(futures.values())
+        return {node: (None if f.exception() else f.result()) for node, f in futures.items()}
+
+    def to_dict(self):
+        """
+        :return: <dict> Stats of every node talked to so far
+        """
+        with self._lock:
+            return {node: stats.to_dict() for node, stats in self.stats.items()}
@@ -0,0 +1,215 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+from threading import Thread
+from time import sleep
+from flask import Flask, Response, jsonify, request
+import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+import routes
+import snapshot
+import wire
+
+# Seconds the writer has to answer a request a reader passes on, resolving conflicts takes a while
+FORWARD_TIMEOUT = 300
+# Connections to the writer kept open by each reader
+WRITER_CONNECTIONS = 32
+# Headers that only concern one connection, not passed on in either direction
+HOP_BY_HOP = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding', 'host',
+              'server', 'date'}
+
+# Serves the read endpoints from the published snapshots, in each reader process
+app = Flask(__name__)
+
+# Set in each reader process by serve
+reader = None
+writer = None
+session = None
+
+
+def wants_wire():
+    """
+    :return: <bool> Whether the client asked for the compact wire format
+    """
+    return request.accept_mimetypes.best_match(['application/json', wire.MEDIA_TYPE]) == wire.MEDIA_TYPE
+
+
+@app.after_request
+def advertise_wire_format(response):
+    # Like the writer, so other nodes keep sending blocks in the compact format
+    response.headers[wire.CAPABILITY_HEADER] = '1'
+    return response
+
+@app.route('/chain', methods=['GET'])
+def full_chain():
+    # One version of the chain for the whole response, even if newer ones come out while it streams
+    view = reader.current()
+    length = view.length
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', length, type=int)
+    if after < 0 or limit < 0:
+        return 'Invalid range', 400
+    end = min(length, after + limit)
+    next_cursor = end if end < length else None
+
+    if (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best_match(['application/json', routes.NDJSON]) == routes.NDJSON):
+        response = Response((block + b'\n' for block in view.blocks(after, end)), mimetype=routes.NDJSON)
+        response.headers['X-Chain-Length'] = str(length)
+        response.headers['X-Next-Cursor'] = '' if next_cursor is None else str(next_cursor)
+        return response
+
+    if wants_wire():
+        fields = {
+            'transactions': json.loads(view.pending),
+            'length': length,
+            'next': next_cursor,
+            'chain': [json.loads(block) for block in view.blocks(after, end)]
+        }
+        return Response(wire.encode(fields), status=200, mimetype=wire.MEDIA_TYPE)
+
+    def generate():
+        # The blocks are sent as they were published, without parsing them
+        yield (b'{"transactions": ' + view.pending
+               + f', "length": {length}, "next": {json.dumps(next_cursor)}, "chain": ['.encode())
+        for i, block in enumerate(view.blocks(after, end)):
+            yield b', ' + block if i else block
+        yield b']}'
+    return Response(generate(), mimetype='application/json')
+
+@app.route('/chain/tip', methods=['GET'])
+def chain_tip():
+    return Response(reader.current().tip, status=200, mimetype='application/json')
+
+@app.route('/chain/blocks', methods=['GET'])
+def chain_blocks():
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', routes.MAX_BLOCKS_PER_PAGE, type=int)
+    if after < 0 or limit < 1:
+        return 'Invalid range', 400
+    limit = min(limit, routes.MAX_BLOCKS_PER_PAGE)
+    view = reader.current()
+    blocks = list(view.blocks(after, after + limit))
+    if wants_wire():
+        response = {'blocks': [json.loads(block) for block in blocks], 'length': view.length}
+        return Response(wire.encode(response), status=200, mimetype=wire.MEDIA_TYPE)
+    body = b'{"blocks": [' + b', '.join(blocks) + f'], "length": {view.length}}}'.encode()
+    return Response(body, status=200, mimetype='application/json')
+
+@app.route('/identifier', methods=['GET'])
+def identity():
+    return Response(reader.current().address, status=200, mimetype='application/json')
+
+@app.route('/balance', methods=['POST'])
+def balance():
+    values = request.get_json()
+    if values is None:
+        return "Error: Please provide some json",400
+    keys = values.get('keys')
+    if keys is None:
+        return "String missing parameter key.", 400
+    view = reader.current()
+    response = {'balance': [view.balance(key) for key in keys]}
+    return jsonify(response), 200
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def forward(path):
+    # Everything that changes the chain, the mempool or the node is handled by the writer
+    url = writer + request.path
+    if request.query_string:
+        url += '?' + request.query_string.decode('UTF-8')
+    headers = {name: value for name, value in request.headers if name.lower() not in HOP_BY_HOP}
+    try:
+        answer = session.request(request.method, url, data=request.get_data(), headers=headers,
+                                 timeout=FORWARD_TIMEOUT, stream=True)
+    except requests.exceptions.RequestException:
+        return 'The writer is not answering', 503
+
+    def relay():
+        # Passed on as the writer sends it, so streamed answers like /nodes/resolve stay streamed
+        try:
+            yield from answer.iter_content(chunk_size=None)
+        finally:
+            answer.close()
+    response = Response(relay(), status=answer.status_code)
+    for name, value in answer.headers.items():
+        if name.lower() not in HOP_BY_HOP:
+            response.headers[name] = value
+    return response
+
+
+def serve_reads(listener, path, writer_url, parent):
+    """
+    Runs a reader process: waits for the first snapshot, then serves requests accepted on listener
+
+    :param listener: <socket> The node's listening socket, shared by every reader
+    :param path: <str> Data directory the writer publishes in
+    :param writer_url: <str> Where requests for the writer are passed on to
+    :param parent: <int> Process id of the writer, the reader stops when it is gone
+    """
+    global reader, writer, session
+
+    def watch_parent():
+        while os.getppid() == parent:
+            sleep(1)
+        os._exit(0)
+    Thread(target=watch_parent, name='watch-writer', daemon=True).start()
+
+    while not os.path.exists(os.path.join(path, snapshot.VERSION_FILE)):
+        sleep(0.05)
+    reader = snapshot.SnapshotReader(path)
+    writer = writer_url
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=WRITER_CONNECTIONS))
+    host, port = listener.getsockname()[:2]
+    make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+
+
+def serve(host, port, data_dir, key_file=None, workers=2):
+    """
+    Starts the node as one writer process and workers reader processes
+
+    Readers accept every request on the node's port. They answer /chain, /chain/tip,
+    /chain/blocks, /balance and /identifier from the snapshots the writer publishes
+    in data_dir, and pass every other request on to the writer, which listens on a
+    local port of its own. The writer's /metrics only times the requests passed on to
+    it, requests the readers answer themselves are not in educoin_http_request_seconds.
+
+    :param host: <str> The host address of the server
+    :param port: <int> The port that the server is listening too
+    :param data_dir: <str> Directory the chain, the node's keys and the snapshots are kept in
+    :param key_file: (Optional) <str> File the node's keys are kept in, instead of the data directory
+    :param workers: <int> Number of reader processes
+    """
+    listener = socket.create_server((host, port))
+    internal = socket.create_server(('127.0.0.1', 0))
+    writer_url = f'http://127.0.0.1:{internal.getsockname()[1]}'
+    os.makedirs(data_dir, exist_ok=True)
+    snapshot.clear(data_dir)
+
+    # Forked before the chain is loaded and before any thread starts, readers don't hold the chain
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=serve_reads, args=(listener, data_dir, writer_url, os.getpid()),
+                                 name=f'reader-{i}', daemon=True) for i in range(workers)]
+    for process in processes:
+        process.start()
+    listener.close()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        routes.setup(host, port, data_dir, key_file)
+        publisher = snapshot.Publisher(routes.blockchain, data_dir, routes.node_keys.address)
+        publisher.publish()
+        publisher.start()
+        make_server('127.0.0.1', internal.getsockname()[1], routes.app, threaded=True,
+                    fd=internal.fileno()).serve_forever()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
@@ -0,0 +1,213 @@
+import base64
+import binascii
+import sys
+from collections.abc import Mapping
+from threading import Lock
+
+# Fields of a transaction, in the order the API sends them
+TRANSACTION_FIELDS = ('sender', 'recipient', 'amount', 'signature')
+# Fields of a block, in the order the API sends them
+BLOCK_FIELDS = ('index', 'timestamp', 'transactions', 'proof', 'previous_hash', 'target', 'merkle_root', 'hash')
+
+# Value of a block field the block does not have, Eg. the target of blocks stored before targets were added
+MISSING = object()
+
+
+class KeyTable(object):
+    def __init__(self):
+        """
+        Numbers every public key seen in a block, so records hold the number and the PEM text is kept once
+        """
+        self._ids = {}
+        self._keys = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def id(self, key):
+        """
+        :param key: <str> Public key in PEM text, or "0" for the sender of a mining reward
+        :return: <int> Its id, the same for every call with the same key
+        """
+        key_id = self._ids.get(key)
+        if key_id is None:
+            with self._lock:
+                key_id = self._ids.get(key)
+                if key_id is None:
+                    key_id = self._ids[key] = len(self._keys)
+                    self._keys.append(key)
+        return key_id
+
+    def key(self, key_id):
+        """
+        :param key_id: <int> An id given by id
+        :return: <str> The key
+        """
+        return self._keys[key_id]
+
+
+KEYS = KeyTable()
+
+
+class Transaction(Mapping):
+    __slots__ = ('sender_id', 'recipient_id', 'amount', 'raw_signature')
+
+    def __init__(self, sender_id, recipient_id, amount, raw_signature):
+        """
+        A transaction of a block, read like the dict it was made from
+
+        :param sender_id: <int> Id of the sender in KEYS
+        :param recipient_id: <int> Id of the recipient in KEYS
+        :param amount: <int> The amount of money sent
+        :param raw_signature: <bytes> The signature, decoded from base64
+        """
+        self.sender_id = sender_id
+        self.recipient_id = recipient_id
+        self.amount = amount
+        self.raw_signature = raw_signature
+
+    @classmethod
+    def compact(cls, transaction):
+        """
+        :param transaction: <dict> A transaction
+        :return: <Transaction> Its record, or the transaction itself if the record
+                 would not give back the same JSON, Eg. because of extra fields
+        """
+        if isinstance(transaction, Transaction):
+            return transaction
+        if not isinstance(transaction, dict) or len(transaction) != len(TRANSACTION_FIELDS):
+            return transaction
+        try:
+            sender, recipient, amount, signature = (transaction[field] for field in TRANSACTION_FIELDS)
+        except KeyError:
+            return transaction
+        if not (isinstance(sender, str) and isinstance(recipient, str) and isinstance(signature, str)):
+            return transaction
+        try:
+            raw_signature = base64.b64decode(signature, validate=True)
+        except (binascii.Error, ValueError):
+            return transaction
+        if base64.b64encode(raw_signature).decode('ascii') != signature:
+            return transaction
+        return cls(KEYS.id(sender), KEYS.id(recipient), amount, raw_signature)
+
+    def __getitem__(self, field):
+        if field == 'sender':
+            return KEYS.key(self.sender_id)
+        if field == 'recipient':
+            return KEYS.key(self.recipient_id)
+        if field == 'amount':
+            return self.amount
+        if field == 'signature':
+            return base64.b64encode(self.raw_signature).decode('ascii')
+        raise KeyError(field)
+
+    def __contains__(self, field):
+        return field in TRANSACTION_FIELDS
+
+    def __iter__(self):
+        return iter(TRANSACTION_FIELDS)
+
+    def __len__(self):
+        return len(TRANSACTION_FIELDS)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        """
+        :return: <dict> The transaction as the API sends it
+        """
+        keys = KEYS._keys
+        return {'sender': keys[self.sender_id], 'recipient': keys[self.recipient_id], 'amount': self.amount,
+                'signature': base64.b64encode(self.raw_signature).decode('ascii')}
+
+
+class Block(Mapping):
+    __slots__ = BLOCK_FIELDS
+
+    def __init__(self, **fields):
+        """
+        A block of the chain, read like the dict it was made from. Its hash and
+        merkle root can be set, like seal does, the other fields are fixed
+
+        :param fields: Values of BLOCK_FIELDS, the ones left out are MISSING
+        """
+        for field in BLOCK_FIELDS:
+            setattr(self, field, fields.pop(field, MISSING))
+        if fields:
+            raise TypeError(f'Unknown block fields {", ".join(fields)}')
+
+    @classmethod
+    def compact(cls, block):
+        """
+        :param block: <dict> A block
+        :return: <Block> Its record, with its transactions as records and its target interned,
+                 or the block itself if it has fields a record doesn't
+        """
+        if isinstance(block, Block):
+            return block
+        if not isinstance(block, dict) or not isinstance(block.get('transactions'), list):
+            return block
+        if any(field not in BLOCK_FIELDS for field in block):
+            return block
+        fields = dict(block)
+        fields['transactions'] = tuple(Transaction.compact(t) for t in block['transactions'])
+        if isinstance(fields.get('target'), str):
+            # Consecutive blocks mostly share their target
+            fields['target'] = sys.intern(fields['target'])
+        return cls(**fields)
+
+    def __getitem__(self, field):
+        if field in BLOCK_FIELDS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                return value
+        raise KeyError(field)
+
+    def __setitem__(self, field, value):
+        if field not in ('merkle_root', 'hash'):
+            raise KeyError(f'{field} of a block record cannot change')
+        setattr(self, field, value)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, MISSING) if field in BLOCK_FIELDS else MISSING
+        return default if value is MISSING else value
+
+    def __contains__(self, field):
+        return field in BLOCK_FIELDS and getattr(self, field) is not MISSING
+
+    def __iter__(self):
+        return (field for field in BLOCK_FIELDS if getattr(self, field) is not MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        """
+        :return: <dict> The block as the API sends it
+        """
+        block = {}
+        for field in BLOCK_FIELDS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                block[field] = value
+        block['transactions'] = [t.to_dict() if type(t) is Transaction else t for t in self.transactions]
+        return block
+
+
+def to_json(obj):
+    """
+    The default argument of json.dumps for documents holding records
+
+    :param obj: An object json can't serialise by itself
+    :return: <dict> The record as a dict
+    :raises TypeError: If obj is not a record
+    """
+    if isinstance(obj, (Block, Transaction)):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -1,125 +1,295 @@
-import requests
-from flask import Flask, jsonify, request
+from urllib.parse import urlparse
+from time import perf_counter
+from flask import Flask, Response, g, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 import blockchain as bc
+import gossip
+import jobs
+import keystore
+import metrics
+import records
+import signatures
+import storage
+import wire
 import json
+import os
 import sys
 import rsa
 import base64
 from uuid import uuid4
 
-# Cryptocurrency is just a private key that "allows" access to account
-(pub_key, priv_key) = rsa.newkeys(512) 
-# Generate a public key unique address for this node
-node_identifier = pub_key.save_pkcs1().decode('UTF-8')
+# Cryptocurrency is just a private key that "allows" access to account.
+# The node's keys are read or generated on first use, main() points them at the data directory
+node_keys = keystore.NodeKeys()
 
 #Instantiate the Node
 app = Flask(__name__)
 
+class RecordJSONProvider(DefaultJSONProvider):
+    # Blocks of the chain are kept as records, see records.Block
+    @staticmethod
+    def default(o):
+        if isinstance(o, (records.Block, records.Transaction)):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+app.json = RecordJSONProvider(app)
+
+# Media type of streamed chains, one block per line
+NDJSON = 'application/x-ndjson'
+
 # Instantiate the Blockchain
 blockchain = bc.Blockchain()
 
+REQUEST_SECONDS = metrics.histogram('educoin_http_request_seconds',
+                                    'Time to answer a request, by endpoint', ('endpoint', 'method', 'status'))
+metrics.gauge('educoin_mempool_transactions', 'Pending transactions', function=lambda: len(blockchain.mempool))
+metrics.gauge('educoin_chain_length', 'Blocks on the main chain', function=lambda: len(blockchain.chain))
 
-@app.route('/mine', methods=['GET'])
-def mine():
-    # We run the proof of work algorithm to get the next proof...
-    last_block = blockchain.last_block
-    last_proof = last_block['proof']
-    proof = blockchain.proof_of_work(last_proof)
 
+def read_values():
+    """
+    :return: The POST'ed data, sent as JSON or in the compact wire format. None if missing or malformed
+    """
+    if request.mimetype == wire.MEDIA_TYPE:
+        try:
+            return wire.decode(request.get_data())
+        except wire.WireError:
+            return None
+    return request.get_json(silent=True)
+
+def respond(response, status):
+    """
+    Serialises a response as JSON, or in the compact wire format for nodes that ask for it
+
+    :param response: <dict> The response
+    :param status: <int> HTTP status
+    """
+    if request.accept_mimetypes.best_match(['application/json', wire.MEDIA_TYPE]) == wire.MEDIA_TYPE:
+        return Response(wire.encode(response), status=status, mimetype=wire.MEDIA_TYPE)
+    return jsonify(response), status
+
+@app.before_request
+def start_timer():
+    g.started = perf_counter()
+
+@app.after_request
+def advertise_wire_format(response):
+    # Lets other nodes know they can send blocks in the compact format
+    response.headers[wire.CAPABILITY_HEADER] = '1'
+    return response
+
+@app.after_request
+def record_latency(response):
+    # Streamed responses are timed up to their first byte
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    REQUEST_SECONDS.observe(perf_counter() - g.started, endpoint=endpoint, method=request.method,
+                            status=response.status_code)
+    return response
+
+
+def prepare_block():
+    """
+    Assembles the block a mining job searches a proof for, called before proof of work starts
+
+    :return: <BlockTemplate> The block, with a reward for this node
+    :raises ValueError: If there is not enough to mine
+    """
     # We must receive a reward for finding the proof.
     # The sender is "0" to signify that this node has mined a new coin.
+    node_identifier = node_keys.address
     message = f'0{node_identifier}1'
-    signature = rsa.sign(message.encode('UTF-8'),priv_key,'SHA-256')
-    blockchain.new_transaction(
-        sender="0",
-        recipient=node_identifier,
-        amount=1,
-        signature = base64.b64encode(signature).decode('UTF-8')
-    )
-
-    # Forge the new Block by adding it to the chain
-    previous_hash = blockchain.hash(last_block)
-    block = blockchain.new_block(proof, previous_hash)
-
-    temp = set()
-    temp.add(f'{addr}:{portn}')
-    temp.update(blockchain.nodes)
+    signature = rsa.sign(message.encode('UTF-8'),node_keys.private_key,'SHA-256')
+    reward = {
+        'sender': "0",
+        'recipient': node_identifier,
+        'amount': 1,
+        'signature': base64.b64encode(signature).decode('UTF-8')
+    }
+    template = blockchain.block_template([reward])
 
     threshold = 100
-    temp_sum = sum(blockchain.temp_unspent.values())
+    temp_sum = sum(template.unspent.values())
     if temp_sum < threshold:
-        return 'Not enough transactions', 400
-    
-    broadcast = {
-        'nodes': list(temp),
-        'block': block
-    }
-    
-    for node in blockchain.nodes:
-             requests.post(f'http://{node}/nodes/block/new', json = broadcast)
-             
-    response = {
+        raise ValueError('Not enough transactions')
+    return template
+
+def forge_block(template, proof):
+    """
+    Adds the mined block to the chain and sends it to the other nodes, called by a mining job
+
+    :param template: <BlockTemplate> The block the proof was found for
+    :param proof: <int> The proof found by the job
+    :return: <dict> Summary of the new block, None if another block was added first
+    """
+    # No other block may be added between the check and the new block
+    with blockchain.chain_lock:
+        if blockchain.last_block is not template.last_block:
+            return None
+        # Forge the new Block by adding it to the chain
+        previous_hash = blockchain.hash(template.last_block)
+        block = blockchain.new_block(proof, previous_hash, template)
+
+    # Peers fetch the block once they see its hash announced
+    relay.announce_block(blockchain.hash(block), block)
+
+    return {
         'message': "New Block Forged",
         'index': block['index'],
         'transactions': block['transactions'],
         'proof': block['proof'],
         'previous_hash': block['previous_hash'],
     }
-    return jsonify(response), 200
+
+# Instantiate the background miner
+mining_jobs = jobs.MiningJobs(blockchain, prepare_block, forge_block)
+
+# Fields a block sent by another node must have
+BLOCK_FIELDS = ['index', 'proof', 'previous_hash', 'timestamp', 'transactions', 'target']
+
+def receive_block(block):
+    """
+    Adds a block from another node to the chain, or to a side branch
+
+    :param block: <dict> The block
+    :return: <str> Hash of the block if it was accepted, None if not
+    """
+    if (not all(k in block for k in BLOCK_FIELDS)):
+        return None
+    tip = blockchain.last_block
+    if (not blockchain.accept_block(block['proof'], block['index'], block['previous_hash'], block['timestamp'],
+                                    block['transactions'], block['target'])):
+        return None
+    # Any proof being searched for was for the old tip. A block kept on a side branch leaves it as it is
+    if (blockchain.last_block is not tip):
+        mining_jobs.restart()
+    # Hashed from its fields, not the hash it claims
+    return blockchain.hash({k: block[k] for k in BLOCK_FIELDS})
+
+# Largest batch of transactions accepted in one request
+MAX_BATCH_SIZE = 10000
+
+def read_transaction(t):
+    """
+    Checks a transaction POST'ed by a client or sent by another node
+
+    :param t: The transaction
+    :return: <tuple> (<dict> its fields with the amount as an int, None) or (None, <str> why it was refused)
+    """
+    required = ['sender', 'recipient', 'amount', 'signature']
+    if (not isinstance(t, dict) or not all(k in t for k in required)):
+        return None, 'Missing transaction values'
+    try:
+        amount = int(t['amount'])
+    except (TypeError, ValueError):
+        return None, 'Invalid amount'
+    return {'sender': t['sender'], 'recipient': t['recipient'], 'amount': amount, 'signature': t['signature']}, None
+
+def read_transactions(items):
+    """
+    Checks a batch of transactions, see read_transaction
+
+    :param items: The list of transactions
+    :return: <tuple> (<list> the transactions, None) or (None, <str> why the batch was refused)
+    """
+    if (not isinstance(items, list)):
+        return None, 'Missing values'
+    if (len(items) > MAX_BATCH_SIZE):
+        return None, f'At most {MAX_BATCH_SIZE} transactions per batch'
+    transactions = []
+    for t in items:
+        transaction, error = read_transaction(t)
+        if (error is not None):
+            return None, error
+        transactions.append(transaction)
+    return transactions, None
+
+def receive_transactions(transactions):
+    """
+    :param transactions: <list> Transactions from another node
+    :return: <list> The result of each, like Blockchain.new_transactions. Malformed ones are 'invalid'
+    """
+    # Malformed ones are dropped, the others still count
+    read = [t for t, error in map(read_transaction, transactions)]
+    results = iter(blockchain.new_transactions([t for t in read if t is not None]))
+    return ['invalid' if t is None else next(results) for t in read]
+
+# Spreads new transactions and blocks to the other nodes
+relay = gossip.Gossip(blockchain.peers, lambda: list(blockchain.nodes), receive_transactions, receive_block,
+                      lambda block_hash: block_hash in blockchain.tree)
+
+
+@app.route('/mine', methods=['GET', 'POST'])
+def mine():
+    # Proof of work runs in the background, poll /mine/<job_id> for the result
+    job = mining_jobs.start()
+    response = {
+        'message': 'Mining started',
+        'job': job.id
+    }
+    return jsonify(response), 202
+
+@app.route('/mine/<job_id>', methods=['GET'])
+def mine_status(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    return jsonify(mining_jobs.status(job)), 200
+
+@app.route('/mine/<job_id>', methods=['DELETE'])
+def mine_cancel(job_id):
+    job = mining_jobs.get(job_id)
+    if job is None:
+        return 'Unknown job', 404
+    mining_jobs.cancel(job)
+    return jsonify(mining_jobs.status(job)), 200
 
 @app.route('/nodes/block/new', methods=['POST'])
 def recieve_block():
-    values = request.get_json()
+    values = read_values()
     
     required = ['nodes','block']
-    if (values is None or not all(k in values for k in required)):
+    if (not isinstance(values, dict) or not all(k in values for k in required)
+            or not isinstance(values['nodes'], list)):
         return 'Missing values', 400
-    required = ['index', 'proof', 'previous_hash','timestamp','transactions']
-    if (not all(k in values['block'] for k in required)):
+    if (not isinstance(values['block'], dict) or not all(k in values['block'] for k in BLOCK_FIELDS)):
         return 'Missing value in block', 400
-    
-    if (not blockchain.accept_block(values['block']['proof'],values['block']['index'],values['block']['previous_hash'],values['block']['timestamp'],values['block']['transactions'])):
+
+    block_hash = receive_block(values['block'])
+    if (block_hash is None):
         return 'Invalid block', 400
 
-    diff = blockchain.nodes - set(values['nodes'])
-    # find nodes that werent notified of transaction
-    values['nodes']= list(blockchain.nodes | set(values['nodes']))
-    for node in diff :
-        # add new nodes to blockchain
-        blockchain.register_node(node)
-        requests.post(f'http://{node}/nodes/block/new', json = values)
-    
+    # Announced to the nodes that weren't notified of the block
+    relay.announce_block(block_hash, values['block'], exclude=set(values['nodes']))
 
     return 'Block Added', 201
 
 @app.route('/nodes/transactions/new', methods=['POST'])
 def new_transaction_internal():
-    values = request.get_json()
+    values = read_values()
     
     # Check that required fields are in the POST'ed data
 
     required = ['nodes', 'transaction']
-    if (values is None or not all (k in values for k in required)):
+    if (not isinstance(values, dict) or not all (k in values for k in required)
+            or not isinstance(values['nodes'], list)):
         return 'Missing values', 400
-    required = ['sender', 'recipient', 'amount', 'signature']
-    if (not all(k in values['transaction'] for k in required)):
-        return 'Missing transaction values', 400
+    transaction, error = read_transaction(values['transaction'])
+    if (error is not None):
+        return error, 400
     
-    if (not blockchain.test_transaction(values)):
+    # Checks for a duplicate, validates and adds the transaction in one step
+    result = blockchain.new_transactions([transaction])[0]
+    if (result == 'duplicate'):
         return 'Already have transaction', 200
-    
-    if (not blockchain.valid_transaction(values['sender'],values['recipient'],values['amount'],values['signature'])):
+    if (result == 'invalid'):
         return 'Invalid Transaction', 400
-    
-    diff = blockchain.nodes - set(values['nodes'])
-    # find nodes that werent notified of transaction
-    values['nodes']= list(blockchain.nodes | set(values['nodes']))
-    for node in diff :
-        # add new nodes to blockchain
-        blockchain.register_node(node)
-        requests.post(f'http://{node}/nodes/transactions/new', json = values)
-    # Create a new Transaction
-    index = blockchain.new_transaction(values['transaction']['sender'],values['transaction']['recipient'],values['transaction']['amount'],values['transaction']['signature'])
+    if (result == 'rejected'):
+        return 'Too many pending transactions, try again later', 503
+    index = blockchain.last_block['index'] + 1
+
+    # Announced to the nodes that weren't notified of the transaction
+    relay.announce_transactions([transaction], exclude=set(values['nodes']))
 
     response = {'message': f'Transaction will be added to Block {index}'}
     return jsonify(response), 201
@@ -132,39 +302,145 @@ def new_transaction():
     
     # Check that the required fields are in the POST'ed data
     required = ['sender', 'recipient', 'amount', 'signature']
-    if (values is None or not all(k in values for k in required)):
+    if (not isinstance(values, dict) or not all(k in values for k in required)):
         return 'Missing values', 400
-    if (not blockchain.valid_transaction(values['sender'],values['recipient'],int(values['amount']),values['signature'])):
+    transaction, error = read_transaction(values)
+    if (error is not None):
+        return error, 400
+    # Create a new Transaction, checking for a duplicate and validating it in one step
+    result = blockchain.new_transactions([transaction])[0]
+    if (result == 'duplicate'):
+        return 'Already have transaction', 200
+    if (result == 'invalid'):
         return 'Invalid Transaction', 400
-    
-    # Create a new Transaction
-    index = blockchain.new_transaction(values['sender'],values['recipient'],int(values['amount']),values['signature'])
-    temp = set()
-    temp.add(f'{addr}:{portn}')
-    temp.update(blockchain.nodes)
-    # Include nodes broadcasting to so nodes know who it was sent too
-    broadcast = {
-                  'nodes': list(temp),
-                     'transaction': {
-                     'sender': values['sender'],
-                     'recipient': values['recipient'],
-                     'amount': values['amount'],
-                     'signature': values['signature']}}
-    
-    for node in blockchain.nodes:
-             requests.post(f'http://{node}/nodes/transactions/new', json = broadcast)
+    if (result == 'rejected'):
+        return 'Too many pending transactions, try again later', 503
+    index = blockchain.last_block['index'] + 1
+    relay.announce_transactions([transaction])
     response = {'message': f'Transaction will be added to Block {index}'}
     return jsonify(response), 201
 
+def batch_response(transactions, results):
+    accepted = [t for t, result in zip(transactions, results) if result == 'accepted']
+    response = {
+        'message': f'{len(accepted)} of {len(transactions)} transactions will be added to Block {blockchain.last_block["index"] + 1}',
+        'results': results
+    }
+    return accepted, response
+
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    values = read_values()
+    if (not isinstance(values, dict)):
+        return 'Missing values', 400
+    transactions, error = read_transactions(values.get('transactions'))
+    if (error is not None):
+        return error, 400
+
+    results = blockchain.new_transactions(transactions)
+    accepted, response = batch_response(transactions, results)
+    relay.announce_transactions(accepted)
+    if (not accepted and 'rejected' in results):
+        # Like /transactions/new, the batch can be sent again once blocks made room
+        return jsonify(response), 503
+    return jsonify(response), 201 if accepted else 400
+
+@app.route('/nodes/transactions/batch', methods=['POST'])
+def new_transactions_internal():
+    values = read_values()
+    required = ['nodes', 'transactions']
+    if (not isinstance(values, dict) or not all(k in values for k in required)
+            or not isinstance(values['nodes'], list)):
+        return 'Missing values', 400
+    transactions, error = read_transactions(values['transactions'])
+    if (error is not None):
+        return error, 400
+
+    results = blockchain.new_transactions(transactions)
+    accepted, response = batch_response(transactions, results)
+    # Announced to the nodes that weren't notified of the transactions
+    relay.announce_transactions(accepted, exclude=set(values['nodes']))
+    return jsonify(response), 201
+
+def stream_document(fields, key, blocks):
+    """
+    Streams a JSON object whose last member is a list of blocks, one block at a time
+
+    :param fields: <dict> The other members of the object
+    :param key: <str> Name of the list of blocks
+    :param blocks: Iterable of blocks
+    :return: <Response>
+    """
+    def generate():
+        head = json.dumps(fields)
+        yield head[:-1] + (', ' if fields else '') + json.dumps(key) + ': ['
+        for i, block in enumerate(blocks):
+            yield (', ' if i else '') + json.dumps(block, default=records.to_json)
+        yield ']}'
+    return Response(generate(), mimetype='application/json')
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
-    response = {
+    # Later blocks don't show up in a response that is already streaming, but
+    # one streaming while the chain switches branches can end with the new branch
+    chain = blockchain.chain
+    length = len(chain)
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', length, type=int)
+    if after < 0 or limit < 0:
+        return 'Invalid range', 400
+    end = min(length, after + limit)
+    # Value of after for the next page, None once the end of the chain is reached
+    next_cursor = end if end < length else None
+    blocks = (chain[i] for i in range(after, end))
+
+    if (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON):
+        response = Response((json.dumps(block, default=records.to_json) + '\n' for block in blocks), mimetype=NDJSON)
+        response.headers['X-Chain-Length'] = str(length)
+        response.headers['X-Next-Cursor'] = '' if next_cursor is None else str(next_cursor)
+        return response
+
+    fields = {
 	'transactions': blockchain.current_transactions,
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain)
+        'length': length,
+        'next': next_cursor
+    }
+    if request.accept_mimetypes.best_match(['application/json', wire.MEDIA_TYPE]) == wire.MEDIA_TYPE:
+        fields['chain'] = list(blocks)
+        return respond(fields, 200)
+    return stream_document(fields, 'chain', blocks)
+
+@app.route('/chain/tip', methods=['GET'])
+def chain_tip():
+    last_block = blockchain.last_block
+    response = {
+        'index': last_block['index'],
+        'hash': blockchain.hash(last_block)
     }
     return jsonify(response), 200
 
+# Largest page of blocks handed out at once
+MAX_BLOCKS_PER_PAGE = 500
+
+@app.route('/chain/blocks', methods=['GET'])
+def chain_blocks():
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', MAX_BLOCKS_PER_PAGE, type=int)
+    if after < 0 or limit < 1:
+        return 'Invalid range', 400
+    limit = min(limit, MAX_BLOCKS_PER_PAGE)
+    response = {
+        'blocks': blockchain.chain[after:after + limit],
+        'length': len(blockchain.chain)
+    }
+    return respond(response, 200)
+
+@app.route('/transactions/pending', methods=['GET'])
+def pending_transactions():
+    response = {'transactions': blockchain.current_transactions}
+    return respond(response, 200)
+
 @app.route('/nodes/register', methods=['POST'])
 def internal_register_nodes():
     values = request.get_json()
@@ -174,6 +450,10 @@ def internal_register_nodes():
     if nodes is None:
         return "Error: Please supply a valid list of nodes", 400    
 
+    # The node that registered us, so it hears about our transactions and blocks too
+    for node in nodes:
+        blockchain.register_node(node)
+
     response = {
         'message': 'New nodes have been added',
         'total_nodes': list(blockchain.nodes),
@@ -195,7 +475,7 @@ def external_register_nodes():
 
     for node in nodes:
         blockchain.register_node(node)
-        requests.post(f'{node}/nodes/register', json = request_body)
+    blockchain.peers.broadcast([urlparse(node).netloc for node in nodes], '/nodes/register', json = request_body)
 
     response = {
         'message': 'New nodes have been added',
@@ -204,28 +484,59 @@ def external_register_nodes():
     return jsonify(response), 201
 
 
+def valid_inventory(values):
+    """
+    :param values: The JSON body of an inventory request
+    :return: <bool> Whether it is an object whose kinds of items, if given, are lists of ids
+    """
+    return isinstance(values, dict) and all(isinstance(values.get(kind, []), list) for kind in gossip.KINDS)
+
+@app.route('/nodes/inventory', methods=['POST'])
+def inventory_announced():
+    # Another node announces ids of new transactions and blocks, the unseen ones are fetched from it
+    values = read_values()
+    if (not valid_inventory(values) or not isinstance(values.get('node'), str)):
+        return 'Missing values', 400
+    wanted = relay.announced(values['node'], values)
+    response = {kind: len(ids) for kind, ids in wanted.items()}
+    return jsonify(response), 202
+
+@app.route('/nodes/inventory/get', methods=['POST'])
+def inventory_get():
+    # Items we announced, by short id
+    values = read_values()
+    if (not valid_inventory(values)):
+        return 'Missing values', 400
+    return respond(relay.lookup(values), 200)
+
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
     replaced = blockchain.resolve_conflicts()
 
     if replaced:
-        response = {
-            'message': 'Our chain was replaced',
-            'new_chain': blockchain.chain
-        }
-    else:
-        response = {
-            'message': 'Our chain is authoritative',
-            'chain': blockchain.chain
-        }
+        return stream_document({'message': 'Our chain was replaced'}, 'new_chain', blockchain.chain)
+    return stream_document({'message': 'Our chain is authoritative'}, 'chain', blockchain.chain)
 
-    return jsonify(response), 200
+@app.route('/nodes/peers', methods=['GET'])
+def peer_stats():
+    # Latency and failures of every node we talked to
+    return jsonify(blockchain.peers.to_dict()), 200
+
+@app.route('/nodes/cache', methods=['GET'])
+def cache_stats():
+    # Hit and miss counters of the public key and signature caches
+    return jsonify(signatures.cache_stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def expose_metrics():
+    # Every metric in the Prometheus text format
+    return Response(metrics.REGISTRY.expose(), status=200, content_type=metrics.CONTENT_TYPE)
 
 # This will probably be used by the website and mobile
 # to turn an ip address into a node identifier
 @app.route('/identifier', methods=['GET'])
 def identity():
-    response = {'address': node_identifier}
+    response = {'address': node_keys.address}
     return jsonify(response), 200
 
 # Retrieves a user's unspent coin balance
@@ -238,25 +549,101 @@ def balance():
     if keys is None:
         return "String missing parameter key.", 400
     response = {'balance':[]}
+    # unspent is replaced as a whole when blocks arrive, read one version of it
+    unspent = blockchain.unspent
     for key in keys:
-        if key in blockchain.unspent.keys():
-            response['balance'].append(blockchain.unspent[key])
+        if key in unspent.keys():
+            response['balance'].append(unspent[key])
         else: 
             response['balance'].append(0)
     return jsonify(response), 200
     
 
 
-def main(host,port):
+# Largest page of account history handed out at once
+MAX_HISTORY_PAGE = 500
+
+# Transactions that sent or paid a key, oldest first
+@app.route('/history', methods=['POST'])
+def history():
+    values = request.get_json()
+    if values is None:
+        return "Error: Please provide some json",400
+    key = values.get('key')
+    if key is None:
+        return "String missing parameter key.", 400
+    offset = values.get('offset', 0)
+    limit = min(values.get('limit', 50), MAX_HISTORY_PAGE)
+    if (not isinstance(offset, int) or not isinstance(limit, int) or offset < 0 or limit < 1):
+        return "Invalid offset or limit", 400
+
+    index = blockchain.account_index()
+    transactions = []
+    for block_index, position, balance in index.history(key, offset, limit):
+        transactions.append({
+            'block': block_index,
+            'position': position,
+            'transaction': blockchain.chain[block_index - 1]['transactions'][position],
+            'balance': balance
+        })
+    response = {
+        'total': index.count(key),
+        'offset': offset,
+        'transactions': transactions
+    }
+    return jsonify(response), 200
+
+# Retrieves users' balances as they were once a given block was added
+@app.route('/balance/at', methods=['POST'])
+def balance_at():
+    values = request.get_json()
+    if values is None:
+        return "Error: Please provide some json",400
+    keys = values.get('keys')
+    block = values.get('block')
+    if keys is None or not isinstance(block, int):
+        return "Missing parameter keys or block.", 400
+
+    index = blockchain.account_index()
+    response = {
+        'block': block,
+        'balance': [index.balance_at(key, block) for key in keys]
+    }
+    return jsonify(response), 200
+
+
+def setup(host,port,data_dir=None,key_file=None):
     """
 
-    Starts up the server
+    Gives the node its address, its keys and its chain, before it serves
 
     :param host: <str> The host address of the server
     :param port: <int> The port that the server is listening too
+    :param data_dir: (Optional) <str> Directory the chain and the node's keys are persisted in
+    :param key_file: (Optional) <str> File the node's keys are kept in, instead of the data directory
     """
     global portn
     global addr
     portn=port
     addr=host
+    relay.address = f'{host}:{port}'
+    if key_file is not None:
+        node_keys.path = key_file
+    elif data_dir is not None:
+        node_keys.path = os.path.join(data_dir, keystore.KEY_FILE)
+    if data_dir is not None:
+        blockchain.attach_store(storage.BlockStore(data_dir))
+
+
+def main(host,port,data_dir=None,key_file=None):
+    """
+
+    Starts up the server
+
+    :param host: <str> The host address of the server
+    :param port: <int> The port that the server is listening too
+    :param data_dir: (Optional) <str> Directory the chain and the node's keys are persisted in
+    :param key_file: (Optional) <str> File the node's keys are kept in, instead of the data directory
+    """
+    setup(host, port, data_dir, key_file)
     app.run(host=host, port=port)
@@ -0,0 +1,186 @@
+import base64
+import hashlib
+import multiprocessing
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+import rsa
+
+# Parsed public keys kept, one per student or node that was seen recently
+KEY_CACHE_SIZE = 4096
+# Transactions whose signature is remembered as checked
+SIGNATURE_CACHE_SIZE = 100000
+# Batches with fewer unchecked signatures than this are verified in process
+MIN_PARALLEL_BATCH = 32
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_public_key(pem):
+    """
+    Parses a PEM public key, remembering the most recently used ones
+
+    :param pem: <str> PKCS#1 PEM text
+    :return: <rsa.PublicKey>
+    """
+    return rsa.PublicKey.load_pkcs1(pem)
+
+
+class SignatureCache(object):
+    def __init__(self, max_size=SIGNATURE_CACHE_SIZE):
+        """
+        LRU set of transactions whose signature was verified
+
+        :param max_size: <int> Transactions remembered at most
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._verified = OrderedDict()
+        self._lock = Lock()
+
+    def __contains__(self, entry):
+        """
+        :param entry: <tuple> (transaction id, signature)
+        """
+        txid, signature = entry
+        with self._lock:
+            # The signature has to match too, a forged one is never a hit
+            if self._verified.get(txid) == signature:
+                self._verified.move_to_end(txid)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, txid, signature):
+        with self._lock:
+            self._verified[txid] = signature
+            self._verified.move_to_end(txid)
+            if len(self._verified) > self.max_size:
+                self._verified.popitem(last=False)
+
+    def to_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._verified),
+            'max_size': self.max_size,
+        }
+
+
+verified = SignatureCache()
+
+
+def transaction_id(sender, recipient, amount):
+    """
+    :return: <str> Same id as mempool.transaction_id, the SHA-256 of the signed message
+    """
+    return hashlib.sha256(f'{sender}{recipient}{amount}'.encode('UTF-8')).hexdigest()
+
+
+def verify(sender, recipient, amount, signature):
+    """
+    Checks that a transaction was signed by its sender, or by its recipient for newly mined coins
+
+    :param sender: <str> The public key of the sender, "0" for a mining reward
+    :param recipient: <str> The public key of the recipient
+    :param amount: <int> The amount of money being sent
+    :param signature: <str> Base64 signature of sender, recipient and amount
+    :raises: If either key does not parse or the signature does not match
+    """
+    txid = transaction_id(sender, recipient, amount)
+    if (txid, signature) in verified:
+        return
+    _verify(sender, recipient, amount, signature)
+    verified.add(txid, signature)
+
+
+def _verify(sender, recipient, amount, signature):
+    pub = load_public_key(recipient if sender == "0" else sender)
+    # double check if destination is valid public key
+    load_public_key(recipient)
+    message = f'{sender}{recipient}{amount}'.encode('UTF-8')
+    rsa.verify(message, base64.b64decode(signature.encode('UTF-8')), pub)
+
+
+def _check(transaction):
+    try:
+        _verify(*transaction)
+        return True
+    except Exception:
+        return False
+
+
+class BatchVerifier(object):
+    def __init__(self, workers=None):
+        """
+        Verifies the signatures of many transactions on a process pool
+
+        :param workers: (Optional) <int> Number of processes, defaults to the core count
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._lock = Lock()
+
+    def verify(self, transactions):
+        """
+        Checks every signature without looking at balances
+
+        :param transactions: <list> Transactions with sender, recipient, amount and signature
+        :return: <list> <bool> per transaction, True if its signature is valid
+        """
+        results = [None] * len(transactions)
+        unchecked = []
+        for i, t in enumerate(transactions):
+            try:
+                args = (t['sender'], t['recipient'], t['amount'], t['signature'])
+            except (KeyError, TypeError):
+                results[i] = False
+                continue
+            txid = transaction_id(*args[:3])
+            if (txid, args[3]) in verified:
+                results[i] = True
+            else:
+                unchecked.append((i, txid, args))
+
+        if self.workers == 1 or len(unchecked) < MIN_PARALLEL_BATCH:
+            checked = [_check(args) for _, _, args in unchecked]
+        else:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = multiprocessing.Pool(self.workers)
+                chunksize = max(1, len(unchecked) // (self.workers * 4))
+                checked = self._pool.map(_check, [args for _, _, args in unchecked], chunksize)
+
+        for (i, txid, args), ok in zip(unchecked, checked):
+            results[i] = ok
+            if ok:
+                verified.add(txid, args[3])
+        return results
+
+    def close(self):
+        """
+        Shuts down the worker processes
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool.join()
+                self._pool = None
+
+
+def cache_stats():
+    """
+    :return: <dict> Hit and miss counters of the key and signature caches
+    """
+    keys = load_public_key.cache_info()
+    return {
+        'keys': {
+            'hits': keys.hits,
+            'misses': keys.misses,
+            'size': keys.currsize,
+            'max_size': keys.maxsize,
+        },
+        'signatures': verified.to_dict(),
+    }
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from threading import Lock, Thread
+from time import monotonic, sleep
+import metrics
+import records
+
+# Files the writer publishes the chain in, inside the data directory
+LOG_FILE = 'published.log'
+SNAPSHOT_FILE = 'published.snap'
+VERSION_FILE = 'published.version'
+# Seconds between two looks at the chain and the mempool for changes to publish
+PUBLISH_INTERVAL = 0.05
+# Seconds between two versions that only change the pending transactions, which are written
+# out whole every time and keep changing while transactions come in
+PENDING_INTERVAL = 1
+
+MAGIC = b'EDUSNAP1'
+# Start of a snapshot: magic, version, number of blocks, number of balances, offset of
+# the block table, then offset and size of the pending transactions, the tip and the address
+HEADER = struct.Struct('>8sQQQQQIQIQI')
+# Entry of the balance table, sorted by hash of the key: the hash, then offset and size of [key, balance]
+BALANCE_ENTRY = struct.Struct('>QQI')
+# Entry of the block table, one per block in chain order: offset and size of the block in the log
+BLOCK_ENTRY = struct.Struct('>QI')
+# The version file holds the version of the latest snapshot, updated in place
+VERSION = struct.Struct('>Q')
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_SECONDS = metrics.histogram('educoin_snapshot_publish_seconds', 'Time to publish a snapshot for readers')
+PUBLISHED_VERSION = metrics.gauge('educoin_snapshot_version', 'Version of the latest snapshot published for readers')
+
+
+def key_hash(key):
+    """
+    :param key: <str> Public key
+    :return: <int> 64 bit hash of the key, the balance table is sorted by it
+    """
+    return int.from_bytes(hashlib.sha256(key.encode('UTF-8')).digest()[:8], 'big')
+
+
+def clear(path):
+    """
+    Removes the files of an earlier publisher, so readers wait for the new one
+
+    :param path: <str> Data directory
+    """
+    for name in (VERSION_FILE, SNAPSHOT_FILE, LOG_FILE):
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+
+
+class Publisher(object):
+    def __init__(self, blockchain, path, address, interval=PUBLISH_INTERVAL, pending_interval=PENDING_INTERVAL):
+        """
+        Publishes the chain, the balances and the pending transactions of the node
+        for reader processes, as a new version every time one of them changes
+
+        Blocks are appended to a log that is never rewritten, a reorg appends the
+        blocks of the new branch again. Each version is a snapshot file listing
+        where its blocks are in the log, with the balances and pending transactions,
+        swapped in whole so readers keep the version they mapped.
+
+        :param blockchain: <Blockchain> The node's chain
+        :param path: <str> Data directory the files are written to
+        :param address: <str> The node's address, served by /identifier
+        :param interval: <float> Seconds between two looks for changes
+        :param pending_interval: <float> Seconds between two versions for new pending transactions alone
+        """
+        self.blockchain = blockchain
+        self.path = path
+        self.interval = interval
+        self.pending_interval = pending_interval
+        self.version = 0
+        self._address = json.dumps({'address': address}).encode()
+        self._log = open(os.path.join(path, LOG_FILE), 'wb')
+        self._log_size = 0
+        # Hash of every published block of the chain, and its packed block table entry
+        self._hashes = []
+        self._table = bytearray()
+        # The chain the balances were packed for, with the packed balance table and entries
+        self._balances_for = None
+        self._balances = (0, b'')
+        self._last = None
+        self._published_at = None
+        self._version_map = None
+
+    def publish(self):
+        """
+        Writes a new snapshot if the chain or the pending transactions changed since the last one
+
+        :return: <bool> True if a new version was published
+        """
+        blockchain = self.blockchain
+        with blockchain.chain_lock, blockchain.pending_lock:
+            chain = blockchain.chain
+            tip = {'index': chain[-1]['index'], 'hash': blockchain.hash(chain[-1])}
+            current = (len(chain), tip['hash'], blockchain.mempool.version)
+            if current == self._last:
+                return False
+            if (self._last is not None and current[:2] == self._last[:2]
+                    and monotonic() - self._published_at < self.pending_interval):
+                return False
+            common = min(len(self._hashes), len(chain))
+            # Only the end of the chain changes, a reorg replaces a few blocks
+            while common and self._hashes[common - 1] != blockchain.hash(chain[common - 1]):
+                common -= 1
+            added = chain[common:]
+            unspent = dict(blockchain.unspent) if current[:2] != self._balances_for else None
+            pending = blockchain.mempool.transactions()
+
+        with PUBLISH_SECONDS.time():
+            self._append(common, added)
+            if unspent is not None:
+                self._balances = self._pack_balances(unspent)
+                self._balances_for = current[:2]
+            self._write(json.dumps(pending, default=records.to_json).encode(), json.dumps(tip).encode())
+        self._last = current
+        self._published_at = monotonic()
+        PUBLISHED_VERSION.set(self.version)
+        return True
+
+    def start(self):
+        """
+        Publishes changes in the background from now on
+
+        :return: None
+        """
+        Thread(target=self._run, name='publisher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.publish()
+            except OSError:
+                logger.exception('Could not publish a snapshot')
+
+    def _append(self, common, blocks):
+        del self._hashes[common:]
+        del self._table[common * BLOCK_ENTRY.size:]
+        for block in blocks:
+            data = json.dumps(block, default=records.to_json).encode()
+            self._log.write(data)
+            self._hashes.append(self.blockchain.hash(block))
+            self._table += BLOCK_ENTRY.pack(self._log_size, len(data))
+            self._log_size += len(data)
+        # Readers map the log as it is when they open a snapshot
+        self._log.flush()
+
+    @staticmethod
+    def _pack_balances(unspent):
+        """
+        :param unspent: <dict> Balance of every public key
+        :return: <tuple> (number of balances, the balance table followed by the [key, balance] it points to)
+        """
+        entries = []
+        data = []
+        offset = HEADER.size + len(unspent) * BALANCE_ENTRY.size
+        for key, amount in unspent.items():
+            encoded = json.dumps([key, amount]).encode()
+            entries.append((key_hash(key), offset, len(encoded)))
+            data.append(encoded)
+            offset += len(encoded)
+        entries.sort()
+        return len(entries), b''.join(BALANCE_ENTRY.pack(*entry) for entry in entries) + b''.join(data)
+
+    def _write(self, pending, tip):
+        self.version += 1
+        count, balances = self._balances
+        blocks_at = HEADER.size + len(balances)
+        pending_at = blocks_at + len(self._table)
+        tip_at = pending_at + len(pending)
+        address_at = tip_at + len(tip)
+        header = HEADER.pack(MAGIC, self.version, len(self._hashes), count, blocks_at,
+                             pending_at, len(pending), tip_at, len(tip), address_at, len(self._address))
+        # A new file swapped in whole, readers of the last version keep reading theirs
+        snapshot_path = os.path.join(self.path, SNAPSHOT_FILE)
+        with open(snapshot_path + '.tmp', 'wb') as f:
+            f.write(header)
+            f.write(balances)
+            f.write(self._table)
+            f.write(pending)
+            f.write(tip)
+            f.write(self._address)
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+
+        if self._version_map is None:
+            version_path = os.path.join(self.path, VERSION_FILE)
+            with open(version_path + '.tmp', 'wb') as f:
+                f.write(VERSION.pack(self.version))
+            os.replace(version_path + '.tmp', version_path)
+            with open(version_path, 'r+b') as f:
+                self._version_map = mmap.mmap(f.fileno(), VERSION.size)
+        else:
+            self._version_map[:] = VERSION.pack(self.version)
+
+
+class Snapshot(object):
+    def __init__(self, path):
+        """
+        One version of the published chain, read in place from the mapped files
+
+        :param path: <str> Data directory of the publisher
+        """
+        with open(os.path.join(path, SNAPSHOT_FILE), 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.version, self.length, self._balance_count, self._blocks_at, pending_at, pending_size,
+         tip_at, tip_size, address_at, address_size) = HEADER.unpack_from(self._data)
+        if magic != MAGIC:
+            raise ValueError(f'{SNAPSHOT_FILE} is not a snapshot')
+        # Opened after the snapshot, the log already holds every block it lists
+        with open(os.path.join(path, LOG_FILE), 'rb') as f:
+            self._log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pending = self._data[pending_at:pending_at + pending_size]
+        self.tip = self._data[tip_at:tip_at + tip_size]
+        self.address = self._data[address_at:address_at + address_size]
+
+    def block(self, index):
+        """
+        :param index: <int> Position of the block in the chain, starting at 0
+        :return: <bytes> The block as JSON
+        """
+        offset, size = BLOCK_ENTRY.unpack_from(self._data, self._blocks_at + index * BLOCK_ENTRY.size)
+        return self._log[offset:offset + size]
+
+    def blocks(self, start, end):
+        """
+        :return: Generator of <bytes> the blocks from position start up to end, as JSON
+        """
+        for index in range(start, min(end, self.length)):
+            yield self.block(index)
+
+    def balance(self, key):
+        """
+        :param key: <str> Public key
+        :return: The balance of the key, 0 if it has none
+        """
+        if not isinstance(key, str):
+            return 0
+        wanted = key_hash(key)
+        low, high = 0, self._balance_count
+        while low < high:
+            middle = (low + high) // 2
+            if BALANCE_ENTRY.unpack_from(self._data, HEADER.size + middle * BALANCE_ENTRY.size)[0] < wanted:
+                low = middle + 1
+            else:
+                high = middle
+        # Keys sharing a hash are next to each other
+        for index in range(low, self._balance_count):
+            found, offset, size = BALANCE_ENTRY.unpack_from(self._data, HEADER.size + index * BALANCE_ENTRY.size)
+            if found != wanted:
+                break
+            entry_key, amount = json.loads(self._data[offset:offset + size])
+            if entry_key == key:
+                return amount
+        return 0
+
+
+class SnapshotReader(object):
+    def __init__(self, path):
+        """
+        Follows the snapshots of a publisher, each request reads the latest one
+
+        :param path: <str> Data directory of the publisher, which published at least once
+        """
+        self.path = path
+        with open(os.path.join(path, VERSION_FILE), 'rb') as f:
+            self._version = mmap.mmap(f.fileno(), VERSION.size, access=mmap.ACCESS_READ)
+        self._current = Snapshot(path)
+        self._lock = Lock()
+
+    def current(self):
+        """
+        :return: <Snapshot> The latest published version, which stays readable once a newer one is out
+        """
+        snapshot = self._current
+        if VERSION.unpack_from(self._version)[0] != snapshot.version:
+            with self._lock:
+                if VERSION.unpack_from(self._version)[0] != self._current.version:
+                    self._current = Snapshot(self.path)
+                snapshot = self._current
+        return snapshot
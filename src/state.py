@@ -0,0 +1,82 @@
+from collections.abc import Mapping
+
+# Staged in place of a balance to remove the account, Eg. when undoing the block that created it
+MISSING = object()
+
+
+class BalanceOverlay(Mapping):
+    def __init__(self, base):
+        """
+        Balances staged on top of another balance map without copying it
+
+        Reads fall through to base for accounts the overlay did not change.
+        Writes only touch the overlay until commit, so staging a block costs
+        O(accounts it touches), not O(all accounts).
+
+        :param base: <dict> or <BalanceOverlay> The balances to stage on top of
+        """
+        self.base = base
+        self.changes = {}
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            balance = self.changes[key]
+            if balance is MISSING:
+                raise KeyError(key)
+            return balance
+        return self.base[key]
+
+    def __setitem__(self, key, balance):
+        self.changes[key] = balance
+
+    def __delitem__(self, key):
+        self.changes[key] = MISSING
+
+    def __contains__(self, key):
+        if key in self.changes:
+            return self.changes[key] is not MISSING
+        return key in self.base
+
+    def __iter__(self):
+        for key in self.base:
+            if self.changes.get(key) is not MISSING:
+                yield key
+        for key, balance in self.changes.items():
+            if balance is not MISSING and key not in self.base:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def update(self, balances):
+        """
+        :param balances: <dict> New balance of some accounts, MISSING to remove one
+        """
+        self.changes.update(balances)
+
+    def commit(self):
+        """
+        Writes the staged balances into base and empties the overlay.
+        Without removals that is a single update, so readers of base see all of it or none.
+
+        :return: <dict> Undo record: the previous balance in base of every changed account,
+                 MISSING for the ones it did not have. Staging it with update reverts the commit
+        """
+        undo = {key: self.base.get(key, MISSING) for key in self.changes}
+        removed = [key for key, balance in self.changes.items() if balance is MISSING]
+        if not removed or isinstance(self.base, BalanceOverlay):
+            self.base.update(self.changes)
+        else:
+            self.base.update({key: balance for key, balance in self.changes.items() if balance is not MISSING})
+            for key in removed:
+                self.base.pop(key, None)
+        self.changes = {}
+        return undo
+
+    def discard(self):
+        """
+        Drops the staged balances
+
+        :return: None
+        """
+        self.changes = {}
@@ -0,0 +1,160 @@
+import json
+import os
+import struct
+import records
+
+# Every record in the block log is a 4 byte length followed by the block as JSON
+RECORD_HEADER = struct.Struct('>I')
+# The index holds one 8 byte log offset per block, block n lives at (n - 1) * 8
+INDEX_ENTRY = struct.Struct('>Q')
+
+
+class BlockStore(object):
+    def __init__(self, path, snapshot_interval=100):
+        """
+        Append-only block log on local disk with periodic balance snapshots
+
+        :param path: <str> Directory holding the node's data, created if missing
+        :param snapshot_interval: <int> Blocks between snapshots of unspent
+        """
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(path, exist_ok=True)
+        self.log_path = os.path.join(path, 'blocks.log')
+        self.index_path = os.path.join(path, 'blocks.idx')
+        self.snapshot_path = os.path.join(path, 'snapshot.json')
+        self._log = open(self.log_path, 'ab+')
+        self._index = open(self.index_path, 'ab+')
+        self._recover()
+        # Height of the latest snapshot, so appending doesn't need to read it
+        self.snapshot_height = self.load_snapshot()[0]
+
+    @property
+    def height(self):
+        """
+        :return: <int> Number of blocks in the store
+        """
+        return self._index_size // INDEX_ENTRY.size
+
+    def append(self, block):
+        """
+        Adds a block to the end of the log
+
+        :param block: <dict> Block whose index is height + 1
+        """
+        data = json.dumps(block, sort_keys=True, default=records.to_json).encode()
+        offset = self._log_size
+        self._log.write(RECORD_HEADER.pack(len(data)) + data)
+        self._log.flush()
+        # The index entry goes last so a crash never indexes a partial record
+        self._index.write(INDEX_ENTRY.pack(offset))
+        self._index.flush()
+        self._log_size += RECORD_HEADER.size + len(data)
+        self._index_size += INDEX_ENTRY.size
+
+    def read(self, index):
+        """
+        :param index: <int> Index of the block, starting at 1
+        :return: <dict> Block
+        """
+        return self._read_at(self._offset(index))[0]
+
+    def blocks(self, start=1):
+        """
+        Reads blocks in order
+
+        :param start: <int> Index of the first block to read
+        :return: Generator of <dict> blocks
+        """
+        if start > self.height:
+            return
+        offset = self._offset(start)
+        for _ in range(start, self.height + 1):
+            block, offset = self._read_at(offset)
+            yield block
+
+    def truncate(self, height):
+        """
+        Drops every block after height, used when the chain is replaced
+
+        :param height: <int> Number of blocks to keep
+        """
+        if height >= self.height:
+            return
+        end = self._offset(height + 1)
+        self._log.truncate(end)
+        self._index.truncate(height * INDEX_ENTRY.size)
+        self._log_size = end
+        self._index_size = height * INDEX_ENTRY.size
+        if self.snapshot_height > height:
+            os.remove(self.snapshot_path)
+            self.snapshot_height = 0
+
+    def save_snapshot(self, height, unspent):
+        """
+        Atomically writes the balances as of block height
+
+        :param height: <int> Index of the last block applied to unspent
+        :param unspent: <dict> Balance of every public key
+        """
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'height': height, 'unspent': unspent}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self.snapshot_height = height
+
+    def load_snapshot(self):
+        """
+        :return: <tuple> (height, unspent) of the latest snapshot, (0, {}) if there is none
+        """
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return 0, {}
+        if snapshot['height'] > self.height:
+            return 0, {}
+        return snapshot['height'], snapshot['unspent']
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+    def _offset(self, index):
+        self._index.seek((index - 1) * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))[0]
+
+    def _read_at(self, offset):
+        self._log.seek(offset)
+        (length,) = RECORD_HEADER.unpack(self._log.read(RECORD_HEADER.size))
+        block = json.loads(self._log.read(length))
+        return block, offset + RECORD_HEADER.size + length
+
+    def _recover(self):
+        """
+        Cuts off whatever a crash in the middle of append left behind
+        """
+        self._index_size = os.path.getsize(self.index_path)
+        self._index_size -= self._index_size % INDEX_ENTRY.size
+        self._index.truncate(self._index_size)
+        self._log_size = os.path.getsize(self.log_path)
+
+        end = 0
+        while self.height:
+            offset = self._offset(self.height)
+            self._log.seek(offset)
+            header = self._log.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                end = offset + RECORD_HEADER.size + RECORD_HEADER.unpack(header)[0]
+                if end <= self._log_size:
+                    break
+            # The last indexed record is incomplete, forget about it
+            end = 0
+            self._index_size -= INDEX_ENTRY.size
+            self._index.truncate(self._index_size)
+
+        if self._log_size > end:
+            self._log.truncate(end)
+            self._log_size = end
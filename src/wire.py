@@ -0,0 +1,251 @@
+import base64
+import binascii
+import struct
+from collections.abc import Mapping
+from functools import lru_cache
+import rsa
+
+# Media type of the compact encoding, peers ask for it in the Accept header
+MEDIA_TYPE = 'application/x-educoin'
+# Header every node sets on its responses to advertise that it understands MEDIA_TYPE
+CAPABILITY_HEADER = 'X-Educoin-Wire'
+
+MAGIC = b'EDC1'
+PEM_PREFIX = '-----BEGIN RSA PUBLIC KEY-----'
+
+# Value tags
+NULL, FALSE, TRUE, INT, FLOAT, TEXT, HEX32, STRING_REF, BASE64, LIST, DICT = range(11)
+# String table entry tags
+TABLE_TEXT, TABLE_KEY = range(2)
+
+DOUBLE = struct.Struct('>d')
+
+
+class WireError(ValueError):
+    pass
+
+
+def _write_varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data, pos):
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+@lru_cache(maxsize=4096)
+def _key_to_der(pem):
+    """
+    :return: <bytes> DER of a PEM public key, None if the PEM would not come back byte for byte
+    """
+    try:
+        key = rsa.PublicKey.load_pkcs1(pem)
+    except Exception:
+        return None
+    if key.save_pkcs1().decode('UTF-8') != pem:
+        return None
+    return key.save_pkcs1('DER')
+
+
+@lru_cache(maxsize=4096)
+def _der_to_key(der):
+    return rsa.PublicKey.load_pkcs1(der, 'DER').save_pkcs1().decode('UTF-8')
+
+
+def _is_hex32(s):
+    if len(s) != 64:
+        return False
+    try:
+        return bytes.fromhex(s).hex() == s
+    except ValueError:
+        return False
+
+
+def _raw_base64(s):
+    """
+    :return: <bytes> Decoded signature, None if s is not base64 that encodes back to itself
+    """
+    if len(s) < 16 or len(s) % 4:
+        return None
+    try:
+        raw = base64.b64decode(s, validate=True)
+    except binascii.Error:
+        return None
+    return raw if base64.b64encode(raw).decode('ascii') == s else None
+
+
+class _Encoder(object):
+    def __init__(self):
+        self.strings = {}
+        self.table = []
+
+    def ref(self, s):
+        if s not in self.strings:
+            self.strings[s] = len(self.table)
+            self.table.append(s)
+        return self.strings[s]
+
+    def value(self, out, v):
+        if v is None:
+            out.append(NULL)
+        elif v is True:
+            out.append(TRUE)
+        elif v is False:
+            out.append(FALSE)
+        elif isinstance(v, int):
+            out.append(INT)
+            # zigzag so small negative numbers stay small
+            _write_varint(out, v * 2 if v >= 0 else -v * 2 - 1)
+        elif isinstance(v, float):
+            out.append(FLOAT)
+            out += DOUBLE.pack(v)
+        elif isinstance(v, str):
+            self.string(out, v)
+        elif isinstance(v, (list, tuple)):
+            out.append(LIST)
+            _write_varint(out, len(v))
+            for item in v:
+                self.value(out, item)
+        elif isinstance(v, (dict, Mapping)):
+            out.append(DICT)
+            _write_varint(out, len(v))
+            for k, item in v.items():
+                _write_varint(out, self.ref(k))
+                self.value(out, item)
+        else:
+            raise WireError(f'Cannot encode {type(v).__name__}')
+
+    def string(self, out, s):
+        # Public keys repeat across transactions, they go to the string table once
+        if s.startswith(PEM_PREFIX):
+            out.append(STRING_REF)
+            _write_varint(out, self.ref(s))
+            return
+        if _is_hex32(s):
+            out.append(HEX32)
+            out += bytes.fromhex(s)
+            return
+        raw = _raw_base64(s)
+        if raw is not None:
+            out.append(BASE64)
+            _write_varint(out, len(raw))
+            out += raw
+            return
+        data = s.encode('UTF-8')
+        out.append(TEXT)
+        _write_varint(out, len(data))
+        out += data
+
+
+def encode(document):
+    """
+    Encodes a JSON document, typically holding blocks and transactions, in the compact format
+
+    Layout: magic, then a string table of dict keys and public keys, each stored
+    once either as raw DER or as text, then the document where hashes are 32 raw
+    bytes, signatures raw bytes and public keys short ids into the table.
+    Decoding gives back exactly the same JSON, so block hashes don't change.
+
+    :param document: JSON compatible value
+    :return: <bytes>
+    """
+    encoder = _Encoder()
+    body = bytearray()
+    encoder.value(body, document)
+
+    out = bytearray(MAGIC)
+    _write_varint(out, len(encoder.table))
+    for s in encoder.table:
+        der = _key_to_der(s) if s.startswith(PEM_PREFIX) else None
+        if der is not None:
+            out.append(TABLE_KEY)
+            data = der
+        else:
+            out.append(TABLE_TEXT)
+            data = s.encode('UTF-8')
+        _write_varint(out, len(data))
+        out += data
+    out += body
+    return bytes(out)
+
+
+def decode(data):
+    """
+    :param data: <bytes> Output of encode
+    :return: The JSON document
+    :raises WireError: If data is not a valid message
+    """
+    data = memoryview(data)
+    if bytes(data[:4]) != MAGIC:
+        raise WireError('Not an educoin message')
+    try:
+        count, pos = _read_varint(data, 4)
+        table = []
+        for _ in range(count):
+            tag = data[pos]
+            length, pos = _read_varint(data, pos + 1)
+            raw = bytes(data[pos:pos + length])
+            pos += length
+            table.append(_der_to_key(raw) if tag == TABLE_KEY else raw.decode('UTF-8'))
+        document, pos = _read_value(data, pos, table)
+    except WireError:
+        raise
+    except Exception as e:
+        # Truncated data, bad UTF-8 or a key that does not parse
+        raise WireError(f'Malformed message: {e}') from e
+    if pos != len(data):
+        raise WireError('Trailing bytes after message')
+    return document
+
+
+def _read_value(data, pos, table):
+    tag = data[pos]
+    pos += 1
+    if tag == NULL:
+        return None, pos
+    if tag == TRUE:
+        return True, pos
+    if tag == FALSE:
+        return False, pos
+    if tag == INT:
+        n, pos = _read_varint(data, pos)
+        return (n >> 1 if not n & 1 else -((n + 1) >> 1)), pos
+    if tag == FLOAT:
+        return DOUBLE.unpack_from(data, pos)[0], pos + DOUBLE.size
+    if tag == TEXT:
+        length, pos = _read_varint(data, pos)
+        return bytes(data[pos:pos + length]).decode('UTF-8'), pos + length
+    if tag == HEX32:
+        return bytes(data[pos:pos + 32]).hex(), pos + 32
+    if tag == STRING_REF:
+        i, pos = _read_varint(data, pos)
+        return table[i], pos
+    if tag == BASE64:
+        length, pos = _read_varint(data, pos)
+        return base64.b64encode(data[pos:pos + length]).decode('ascii'), pos + length
+    if tag == LIST:
+        count, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _read_value(data, pos, table)
+            items.append(item)
+        return items, pos
+    if tag == DICT:
+        count, pos = _read_varint(data, pos)
+        items = {}
+        for _ in range(count):
+            i, pos = _read_varint(data, pos)
+            items[table[i]], pos = _read_value(data, pos, table)
+        return items, pos
+    raise WireError(f'Unknown tag {tag}')